@@ -26,6 +26,7 @@ enum class TaskType {
     ACCEPT_FRIEND,      // 通过好友请求
     GET_CONTACT_LIST,   // 获取联系人列表
     DUMP_UI_TREE,       // 导出控件树（调试）
+    CHAT_SESSION,       // 聊天会话（一次导航执行多个动作）
 }
 
 /**
@@ -44,6 +45,13 @@ data class TaskRequest(
     fun getStringList(key: String): List<String> =
         (params[key] as? List<*>)?.mapNotNull { it?.toString() } ?: emptyList()
 
+    fun getMapList(key: String): List<Map<String, Any>> =
+        (params[key] as? List<*>)?.mapNotNull { item ->
+            (item as? Map<*, *>)?.entries
+                ?.filter { it.key != null && it.value != null }
+                ?.associate { it.key.toString() to it.value!! }
+        } ?: emptyList()
+
     fun getInt(key: String, default: Int = 0): Int =
         (params[key] as? Number)?.toInt() ?: default
 
@@ -59,7 +67,10 @@ data class TaskResult(
     val success: Boolean,
     val message: String = "",
     val data: Any? = null
-)
+) {
+    /** 任务实际执行耗时（毫秒，不含排队），由 TaskController 在执行完成后填写 */
+    var elapsedMs: Long = 0
+}
 
 /**
  * 聊天消息
@@ -12,6 +12,7 @@ import android.os.IBinder
 import android.os.PowerManager
 import android.util.Log
 import com.wechatrpa.model.AppTarget
+import com.wechatrpa.model.ChatMessage
 import com.wechatrpa.model.TaskRequest
 import com.wechatrpa.model.TaskResult
 import com.wechatrpa.model.TaskType
@@ -36,6 +37,7 @@ import java.util.UUID
  *   POST /api/invite_to_group     - 邀请入群
  *   POST /api/remove_from_group   - 移除群成员
  *   POST /api/get_group_members   - 获取群成员列表
+ *   POST /api/chat_session        - 聊天会话（一次导航执行多个动作）
  *   GET  /api/dump_ui             - 导出控件树（调试）
  *   GET  /api/task_result/{id}    - 查询任务结果
  */
@@ -156,37 +158,43 @@ class HttpServerService : Service() {
                     // 发送消息
                     uri == "/api/send_message" && method == Method.POST -> {
                         val body = parseBody(session)
-                        handleSendMessage(body)
+                        handleSendMessage(body, idempotencyKey(session))
                     }
 
                     // 读取消息
                     uri == "/api/read_messages" && method == Method.POST -> {
                         val body = parseBody(session)
-                        handleReadMessages(body)
+                        handleReadMessages(body, idempotencyKey(session))
                     }
 
                     // 创建群聊
                     uri == "/api/create_group" && method == Method.POST -> {
                         val body = parseBody(session)
-                        handleCreateGroup(body)
+                        handleCreateGroup(body, idempotencyKey(session))
                     }
 
                     // 邀请入群
                     uri == "/api/invite_to_group" && method == Method.POST -> {
                         val body = parseBody(session)
-                        handleInviteToGroup(body)
+                        handleInviteToGroup(body, idempotencyKey(session))
                     }
 
                     // 移除群成员
                     uri == "/api/remove_from_group" && method == Method.POST -> {
                         val body = parseBody(session)
-                        handleRemoveFromGroup(body)
+                        handleRemoveFromGroup(body, idempotencyKey(session))
                     }
 
                     // 获取群成员
                     uri == "/api/get_group_members" && method == Method.POST -> {
                         val body = parseBody(session)
-                        handleGetGroupMembers(body)
+                        handleGetGroupMembers(body, idempotencyKey(session))
+                    }
+
+                    // 聊天会话
+                    uri == "/api/chat_session" && method == Method.POST -> {
+                        val body = parseBody(session)
+                        handleChatSession(body, idempotencyKey(session))
                     }
 
                     // 获取联系人列表
@@ -235,7 +243,7 @@ class HttpServerService : Service() {
             return jsonResponse(200, true, "ok", status)
         }
 
-        private fun handleSendMessage(body: JSONObject): Response {
+        private fun handleSendMessage(body: JSONObject, idempotencyKey: String?): Response {
             val contact = body.optString("contact", "")
             val message = body.optString("message", "")
             if (contact.isBlank() || message.isBlank()) {
@@ -249,12 +257,12 @@ class HttpServerService : Service() {
                 target = target,
                 params = mapOf("contact" to contact, "message" to message)
             )
-            taskController.submitTask(task)
+            val submittedId = taskController.submitTask(task, idempotencyKey)
 
-            return jsonResponse(200, true, "任务已提交", JSONObject().put("task_id", taskId))
+            return jsonResponse(200, true, "任务已提交", JSONObject().put("task_id", submittedId))
         }
 
-        private fun handleReadMessages(body: JSONObject): Response {
+        private fun handleReadMessages(body: JSONObject, idempotencyKey: String?): Response {
             val contact = body.optString("contact", "")
             val count = body.optInt("count", 10)
             if (contact.isBlank()) {
@@ -268,12 +276,12 @@ class HttpServerService : Service() {
                 target = target,
                 params = mapOf("contact" to contact, "count" to count)
             )
-            taskController.submitTask(task)
+            val submittedId = taskController.submitTask(task, idempotencyKey)
 
-            return jsonResponse(200, true, "任务已提交", JSONObject().put("task_id", taskId))
+            return jsonResponse(200, true, "任务已提交", JSONObject().put("task_id", submittedId))
         }
 
-        private fun handleCreateGroup(body: JSONObject): Response {
+        private fun handleCreateGroup(body: JSONObject, idempotencyKey: String?): Response {
             val groupName = body.optString("group_name", "")
             val membersArray = body.optJSONArray("members") ?: JSONArray()
             val members = (0 until membersArray.length()).map { membersArray.getString(it) }
@@ -289,12 +297,12 @@ class HttpServerService : Service() {
                 target = target,
                 params = mapOf("group_name" to groupName, "members" to members)
             )
-            taskController.submitTask(task)
+            val submittedId = taskController.submitTask(task, idempotencyKey)
 
-            return jsonResponse(200, true, "任务已提交", JSONObject().put("task_id", taskId))
+            return jsonResponse(200, true, "任务已提交", JSONObject().put("task_id", submittedId))
         }
 
-        private fun handleInviteToGroup(body: JSONObject): Response {
+        private fun handleInviteToGroup(body: JSONObject, idempotencyKey: String?): Response {
             val groupName = body.optString("group_name", "")
             val membersArray = body.optJSONArray("members") ?: JSONArray()
             val members = (0 until membersArray.length()).map { membersArray.getString(it) }
@@ -310,12 +318,12 @@ class HttpServerService : Service() {
                 target = target,
                 params = mapOf("group_name" to groupName, "members" to members)
             )
-            taskController.submitTask(task)
+            val submittedId = taskController.submitTask(task, idempotencyKey)
 
-            return jsonResponse(200, true, "任务已提交", JSONObject().put("task_id", taskId))
+            return jsonResponse(200, true, "任务已提交", JSONObject().put("task_id", submittedId))
         }
 
-        private fun handleRemoveFromGroup(body: JSONObject): Response {
+        private fun handleRemoveFromGroup(body: JSONObject, idempotencyKey: String?): Response {
             val groupName = body.optString("group_name", "")
             val membersArray = body.optJSONArray("members") ?: JSONArray()
             val members = (0 until membersArray.length()).map { membersArray.getString(it) }
@@ -331,12 +339,12 @@ class HttpServerService : Service() {
                 target = target,
                 params = mapOf("group_name" to groupName, "members" to members)
             )
-            taskController.submitTask(task)
+            val submittedId = taskController.submitTask(task, idempotencyKey)
 
-            return jsonResponse(200, true, "任务已提交", JSONObject().put("task_id", taskId))
+            return jsonResponse(200, true, "任务已提交", JSONObject().put("task_id", submittedId))
         }
 
-        private fun handleGetGroupMembers(body: JSONObject): Response {
+        private fun handleGetGroupMembers(body: JSONObject, idempotencyKey: String?): Response {
             val groupName = body.optString("group_name", "")
             if (groupName.isBlank()) {
                 return jsonResponse(400, false, "缺少参数: group_name")
@@ -349,9 +357,32 @@ class HttpServerService : Service() {
                 target = target,
                 params = mapOf("group_name" to groupName)
             )
-            taskController.submitTask(task)
+            val submittedId = taskController.submitTask(task, idempotencyKey)
+
+            return jsonResponse(200, true, "任务已提交", JSONObject().put("task_id", submittedId))
+        }
+
+        private fun handleChatSession(body: JSONObject, idempotencyKey: String?): Response {
+            val contact = body.optString("contact", "")
+            val actionsArray = body.optJSONArray("actions") ?: JSONArray()
+            val actions = (0 until actionsArray.length()).mapNotNull { i ->
+                val obj = actionsArray.optJSONObject(i) ?: return@mapNotNull null
+                obj.keys().asSequence().associateWith { obj.get(it) }
+            }
+            if (contact.isBlank() || actions.isEmpty()) {
+                return jsonResponse(400, false, "缺少参数: contact, actions")
+            }
+            val target = appTargetFromBody(body)
+            val taskId = UUID.randomUUID().toString().take(8)
+            val task = TaskRequest(
+                taskId = taskId,
+                taskType = TaskType.CHAT_SESSION,
+                target = target,
+                params = mapOf("contact" to contact, "actions" to actions)
+            )
+            val submittedId = taskController.submitTask(task, idempotencyKey)
 
-            return jsonResponse(200, true, "任务已提交", JSONObject().put("task_id", taskId))
+            return jsonResponse(200, true, "任务已提交", JSONObject().put("task_id", submittedId))
         }
 
         private fun handleGetContactList(body: JSONObject): Response {
@@ -408,7 +439,8 @@ class HttpServerService : Service() {
                     put("task_id", result.taskId)
                     put("success", result.success)
                     put("message", result.message)
-                    put("data", result.data?.toString() ?: "")
+                    put("data", toJsonValue(result.data))
+                    put("elapsed_ms", result.elapsedMs)
                 }
                 jsonResponse(200, true, "ok", data)
             } else {
@@ -418,6 +450,31 @@ class HttpServerService : Service() {
 
         // --- 工具方法 ---
 
+        /**
+         * 把任务结果转为 JSON 值（列表→数组、Map/消息→对象），
+         * 服务端无需再解析 toString 后的字符串
+         */
+        private fun toJsonValue(value: Any?): Any = when (value) {
+            null -> JSONObject.NULL
+            is JSONObject, is JSONArray, is String, is Number, is Boolean -> value
+            is ChatMessage -> JSONObject().apply {
+                put("sender", value.sender)
+                put("content", value.content)
+                put("timestamp", value.timestamp)
+                put("is_self", value.isSelf)
+                put("msg_type", value.msgType)
+            }
+            is Map<*, *> -> JSONObject().apply {
+                value.forEach { (k, v) -> put(k.toString(), toJsonValue(v)) }
+            }
+            is Iterable<*> -> JSONArray().apply { value.forEach { put(toJsonValue(it)) } }
+            else -> value.toString()
+        }
+
+        /** 客户端携带的幂等键（NanoHTTPD 请求头名均为小写） */
+        private fun idempotencyKey(session: IHTTPSession): String? =
+            session.headers["idempotency-key"]?.takeIf { it.isNotBlank() }
+
         private fun parseBody(session: IHTTPSession): JSONObject {
             val files = mutableMapOf<String, String>()
             session.parseBody(files)
@@ -28,6 +28,10 @@ class TaskController {
     private val isRunning = AtomicBoolean(false)
     private val weworkOperator = WeworkOperator()
     private val resultMap = mutableMapOf<String, TaskResult>()
+    /** 幂等键 -> 任务ID（最多保留1000条），客户端超时重试时返回已提交的任务 */
+    private val idempotencyMap = object : LinkedHashMap<String, String>() {
+        override fun removeEldestEntry(eldest: MutableMap.MutableEntry<String, String>?): Boolean = size > 1000
+    }
 
     /**
      * 启动任务执行循环
@@ -61,8 +65,20 @@ class TaskController {
 
     /**
      * 提交任务到队列
+     *
+     * @param idempotencyKey 幂等键，同一键重复提交时不再入队，直接返回首次的任务ID
      */
-    fun submitTask(task: TaskRequest): String {
+    fun submitTask(task: TaskRequest, idempotencyKey: String? = null): String {
+        if (!idempotencyKey.isNullOrBlank()) {
+            synchronized(idempotencyMap) {
+                val existing = idempotencyMap[idempotencyKey]
+                if (existing != null) {
+                    Log.i(TAG, "重复提交已忽略: $idempotencyKey -> $existing")
+                    return existing
+                }
+                idempotencyMap[idempotencyKey] = task.taskId
+            }
+        }
         taskQueue.offer(task)
         Log.i(TAG, "任务已入队: ${task.taskId} (${task.taskType}), 队列大小: ${taskQueue.size}")
         return task.taskId
@@ -154,6 +170,17 @@ class TaskController {
                     }
                 }
 
+                TaskType.CHAT_SESSION -> {
+                    val contact = task.getString("contact")
+                    val actions = task.getMapList("actions")
+                    if (contact.isBlank() || actions.isEmpty()) {
+                        TaskResult(task.taskId, false, "缺少参数: contact 或 actions")
+                    } else {
+                        val r = weworkOperator.runChatSession(contact, actions, task.target)
+                        r.copy(taskId = task.taskId)
+                    }
+                }
+
                 TaskType.GET_CONTACT_LIST -> {
                     val r = weworkOperator.getContactList(task.target)
                     r.copy(taskId = task.taskId)
@@ -174,6 +201,7 @@ class TaskController {
         }
 
         val elapsed = System.currentTimeMillis() - startTime
+        result.elapsedMs = elapsed
         Log.i(TAG, "任务完成: ${task.taskId} (${result.success}) 耗时: ${elapsed}ms")
 
         // 保存结果（最多保留1000条）
@@ -5,6 +5,8 @@ import android.net.Uri
 import android.util.Log
 import com.wechatrpa.model.*
 import com.wechatrpa.utils.NodeHelper
+import org.json.JSONArray
+import org.json.JSONObject
 
 /**
  * 企业微信自动化操作实现
@@ -175,7 +177,15 @@ class WeworkOperator {
         if (!openChat(contactName, target)) {
             return TaskResult("", false, "无法打开与 '$contactName' 的聊天窗口")
         }
+        val result = inputAndSend(message, target)
+        if (result.success) Log.i(TAG, "消息已发送给 '$contactName'")
+        return result
+    }
 
+    /**
+     * 在已打开的聊天窗口中输入并发送一条消息（按 target 选择控件定位方式）
+     */
+    private fun inputAndSend(message: String, target: AppTarget): TaskResult {
         // 微信没有企微的 ID，优先用“第一个输入框 + 发送文案”
         val inputOk = if (target == AppTarget.WECHAT) {
             NodeHelper.inputToField(message) || NodeHelper.inputToField(message, WeworkIds.CHAT_INPUT)
@@ -196,8 +206,6 @@ class WeworkOperator {
             return TaskResult("", false, "发送按钮点击失败")
         }
         Thread.sleep(DELAY_SHORT)
-
-        Log.i(TAG, "消息已发送给 '$contactName'")
         return TaskResult("", true, "消息发送成功")
     }
 
@@ -260,6 +268,61 @@ class WeworkOperator {
         return TaskResult("", true, "读取成功", messages)
     }
 
+    /**
+     * 聊天会话：只导航一次，在同一聊天窗口中按顺序执行多个动作
+     *
+     * 每个动作为 {"type": "send" | "read" | "group_members", ...}：
+     * - send: message 消息内容
+     * - read: count 读取条数（默认10）
+     * - group_members: 打开群设置采集成员后返回聊天页
+     *
+     * 遇到失败的动作即停止，data 为已执行动作的结果数组（JSON）。
+     */
+    fun runChatSession(contactName: String, actions: List<Map<String, Any>>, target: AppTarget = AppTarget.WEWORK): TaskResult {
+        Log.i(TAG, "聊天会话: '$contactName', 动作数: ${actions.size} (${target.label})")
+        if (!openChat(contactName, target)) {
+            return TaskResult("", false, "无法打开与 '$contactName' 的聊天窗口")
+        }
+
+        val results = JSONArray()
+        for ((index, action) in actions.withIndex()) {
+            val type = action["type"]?.toString() ?: ""
+            val r = when (type) {
+                "send" -> {
+                    val message = action["message"]?.toString() ?: ""
+                    if (message.isBlank()) TaskResult("", false, "缺少参数: message")
+                    else inputAndSend(message, target)
+                }
+                "read" -> {
+                    val count = (action["count"] as? Number)?.toInt() ?: 10
+                    val messages = readMessages(count)
+                    TaskResult("", true, "读取成功", JSONArray(messages.map {
+                        JSONObject().put("content", it.content).put("msg_type", it.msgType)
+                    }))
+                }
+                "group_members" -> {
+                    NodeHelper.clickId(WeworkIds.CHAT_MORE_BTN)
+                    Thread.sleep(DELAY_PAGE_LOAD)
+                    val members = collectGroupMembers()
+                    service?.pressBack()
+                    Thread.sleep(DELAY_MEDIUM)
+                    TaskResult("", true, "获取群成员成功", JSONArray(members))
+                }
+                else -> TaskResult("", false, "不支持的动作类型: $type")
+            }
+            results.put(JSONObject().apply {
+                put("type", type)
+                put("success", r.success)
+                put("message", r.message)
+                if (r.data != null) put("data", r.data)
+            })
+            if (!r.success) {
+                return TaskResult("", false, "第${index + 1}个动作失败: ${r.message}", results)
+            }
+        }
+        return TaskResult("", true, "会话完成: ${actions.size}个动作", results)
+    }
+
     // ====================================================================
     // 群管理操作
     // ====================================================================
@@ -443,7 +506,20 @@ class WeworkOperator {
         }
         NodeHelper.clickId(WeworkIds.CHAT_MORE_BTN)
         Thread.sleep(DELAY_PAGE_LOAD)
-        // 收集所有成员名称
+        val members = collectGroupMembers()
+
+        service?.pressBack()
+        return TaskResult("", true, "获取群成员成功", members)
+    }
+
+    // ====================================================================
+    // 辅助方法
+    // ====================================================================
+
+    /**
+     * 在群设置页采集当前可见的成员名称（去重）
+     */
+    private fun collectGroupMembers(): List<String> {
         val members = mutableListOf<String>()
         val textViews = NodeHelper.findByClassName("android.widget.TextView")
         val excludeTexts = setOf("群聊名称", "群公告", "群管理", "投诉", "添加", "删除",
@@ -455,15 +531,9 @@ class WeworkOperator {
                 members.add(text)
             }
         }
-
-        service?.pressBack()
-        return TaskResult("", true, "获取群成员成功", members.distinct())
+        return members.distinct()
     }
 
-    // ====================================================================
-    // 辅助方法
-    // ====================================================================
-
     /**
      * 修改群名称
      */
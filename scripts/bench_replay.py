@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+网关回放基准：不连接手机，按录制的设备交互回放，测量网关吞吐与延迟
+
+先在连接真实手机时录制（server/config 中 DEVICE_TRANSPORT = "record"，正常使用或跑一遍联调脚本），
+得到 device_exchanges.jsonl；之后本脚本在进程内启动网关（DEVICE_TRANSPORT = "replay"），
+虚构若干台设备共用该录制，并发提交操作并轮询 /api/tasks/{task_id} 直到完成：
+  - submit_ms      提交接口耗时（p50 / p95 / p99）
+  - complete_ms    从提交到任务完成的耗时（含设备队列排队与模拟执行）
+  - ops_per_sec    完成吞吐
+  - failed         提交失败、任务失败或超时的数量
+
+设备执行时间取录制结果中的 elapsed_ms，--latency-scale 同时缩放网络耗时与执行时间，
+缩小后可在短时间内跑完大量请求；同一录制、同一参数下的结果可直接对比前后版本。
+
+用法示例：
+  python scripts/bench_replay.py --file device_exchanges.jsonl
+  python scripts/bench_replay.py --file device_exchanges.jsonl --devices 20 --requests 1000 --latency-scale 0.1
+"""
+import argparse
+import atexit
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# 网关运行时读写的持久化文件与目录（录制文件除外），回放时全部指向临时目录，不影响正常运行的数据
+STORE_SETTINGS = (
+    "RESULT_STORE_SPILL_DIR", "TENANT_USAGE_STORE", "CONTACT_INDEX_STORE", "WEBHOOK_STORE", "WEBHOOK_OUTBOX_DIR",
+    "SCHEDULER_STORE", "TEMPLATE_STORE", "CAMPAIGN_SPOOL_DIR", "SCREEN_CAPTURE_DIR",
+)
+
+
+def _percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def start_gateway(args) -> None:
+    """按回放配置导入网关并在后台线程中启动"""
+    import server.config as config
+    config.DEVICE_TRANSPORT = "replay"
+    config.DEVICE_TRANSPORT_FILE = args.file
+    config.DEVICE_REPLAY_LATENCY_SCALE = args.latency_scale
+    config.DEVICES = {
+        f"replay_{i}": {"name": f"回放设备{i}", "api_base": f"http://10.255.{i // 250}.{i % 250 + 1}:9527"}
+        for i in range(args.devices)
+    }
+    tmp_dir = tempfile.mkdtemp(prefix="bench-replay-")
+    atexit.register(shutil.rmtree, tmp_dir, ignore_errors=True)
+    for name in STORE_SETTINGS:
+        setattr(config, name, os.path.join(tmp_dir, os.path.basename(getattr(config, name))))
+
+    import uvicorn
+    from server.api import app as gateway
+    server = uvicorn.Server(uvicorn.Config(gateway.app, host="127.0.0.1", port=args.port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+
+def run_one(session, base: str, device_id: str, index: int, args) -> dict:
+    body = {"device_id": device_id, "contact": f"回放联系人{index % 50}"}
+    if args.op == "send_message":
+        body["message"] = f"回放消息 {index}"
+    start = time.perf_counter()
+    resp = session.post(f"{base}/api/wework/{args.op}", json=body, timeout=args.timeout).json()
+    submit_ms = (time.perf_counter() - start) * 1000
+    data = resp.get("data") or {}
+    if args.op == "read_messages":
+        # 读消息接口等待完成后返回
+        return {"submit_ms": submit_ms, "complete_ms": submit_ms, "ok": bool(data.get("success"))}
+    task_id = data.get("data", {}).get("task_id", "") if data.get("success") else ""
+    if not task_id:
+        return {"submit_ms": submit_ms, "complete_ms": None, "ok": False}
+    deadline = start + args.timeout
+    while time.perf_counter() < deadline:
+        task = session.get(f"{base}/api/tasks/{task_id}", timeout=args.timeout).json().get("data") or {}
+        if task.get("status") not in (None, "pending"):
+            return {
+                "submit_ms": submit_ms,
+                "complete_ms": (time.perf_counter() - start) * 1000,
+                "ok": task.get("status") == "success",
+            }
+        time.sleep(args.poll)
+    return {"submit_ms": submit_ms, "complete_ms": None, "ok": False}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按录制回放设备交互，测量网关吞吐与延迟")
+    parser.add_argument("--file", default="device_exchanges.jsonl", help="录制文件（DEVICE_TRANSPORT=record 生成）")
+    parser.add_argument("--devices", type=int, default=5, help="虚构设备数（共用同一录制）")
+    parser.add_argument("--requests", type=int, default=100, help="总请求数（轮流分配到各设备）")
+    parser.add_argument("--concurrency", type=int, default=20, help="并发客户端数")
+    parser.add_argument("--op", choices=["send_message", "read_messages"], default="send_message")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="耗时缩放：1 为原始耗时，0 为不等待")
+    parser.add_argument("--poll", type=float, default=0.2, help="客户端查询任务状态的间隔（秒）")
+    parser.add_argument("--timeout", type=float, default=120, help="单个请求从提交到完成的超时（秒）")
+    parser.add_argument("--port", type=int, default=18181)
+    parser.add_argument("--json", action="store_true", help="以一行 JSON 输出结果")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.file):
+        print(f"录制文件不存在: {args.file}（先以 DEVICE_TRANSPORT = \"record\" 运行网关录制）")
+        sys.exit(1)
+    start_gateway(args)
+
+    import requests
+    base = f"http://127.0.0.1:{args.port}"
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency))
+    device_ids = [f"replay_{i}" for i in range(args.devices)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(
+            lambda i: run_one(session, base, device_ids[i % len(device_ids)], i, args), range(args.requests)
+        ))
+    wall = time.perf_counter() - start
+
+    submit = [r["submit_ms"] for r in results]
+    complete = [r["complete_ms"] for r in results if r["complete_ms"] is not None]
+    summary = {
+        "op": args.op,
+        "devices": args.devices,
+        "requests": args.requests,
+        "latency_scale": args.latency_scale,
+        "wall_s": round(wall, 2),
+        "ops_per_sec": round(sum(r["ok"] for r in results) / wall, 2) if wall > 0 else 0.0,
+        "failed": sum(not r["ok"] for r in results),
+        "submit_ms": {q: round(_percentile(submit, v), 1) for q, v in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+        "complete_ms": {q: round(_percentile(complete, v), 1) for q, v in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+    }
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False))
+        return
+    for key, value in summary.items():
+        print(f"{key:>14}: {value}")
+
+
+if __name__ == "__main__":
+    main()
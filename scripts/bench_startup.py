@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+网关启动基准：测量导入 server.api.app 的耗时与空闲内存随设备数的变化
+
+每组设备数在独立子进程中测量（避免模块缓存互相影响），设备为虚构地址，不会发起网络请求：
+  - import_ms     导入 server.api.app（构建 FastAPI 应用、注册路由、登记设备）的耗时
+  - rss_mb        导入后进程常驻内存（RSS 峰值）
+  - rss_delta_mb  相对只导入 fastapi/pydantic/requests 等依赖时的增量
+  - routes        注册的路由数（不随应用数增长）
+  - clients       已创建的 DeviceClient 数（懒加载时应为 0）
+
+--eager 额外对每台设备调用一次 get_device，模拟旧版启动时即创建全部客户端的开销。
+
+用法示例：
+  python scripts/bench_startup.py
+  python scripts/bench_startup.py --devices 10 500 2000 --eager
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 网关导入时读取或创建的持久化文件与目录，测量时全部指向临时目录，不读写正常运行的数据
+STORE_SETTINGS = (
+    "DEVICE_TRANSPORT_FILE", "RESULT_STORE_SPILL_DIR", "TENANT_USAGE_STORE", "CONTACT_INDEX_STORE",
+    "WEBHOOK_STORE", "WEBHOOK_OUTBOX_DIR", "SCHEDULER_STORE", "TEMPLATE_STORE", "CAMPAIGN_SPOOL_DIR",
+    "SCREEN_CAPTURE_DIR",
+)
+
+
+def _rss_mb() -> float:
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_child(device_count: int, eager: bool) -> dict:
+    """在当前进程中测量（由父进程以子进程方式调用）"""
+    import fastapi, pydantic, requests  # noqa: F401  依赖本身的导入开销不计入
+    base_rss = _rss_mb()
+
+    import server.config as config
+    config.DEVICES = {
+        f"bench_{i}": {"name": f"基准设备{i}", "api_base": f"http://10.0.{i // 250}.{i % 250 + 1}:9527"}
+        for i in range(device_count)
+    }
+    tmp_dir = tempfile.mkdtemp(prefix="bench-startup-")
+    for name in STORE_SETTINGS:
+        setattr(config, name, os.path.join(tmp_dir, os.path.basename(getattr(config, name))))
+
+    try:
+        start = time.perf_counter()
+        from server.api import app as gateway
+        import_ms = (time.perf_counter() - start) * 1000
+
+        eager_ms = 0.0
+        if eager:
+            start = time.perf_counter()
+            for device_id in config.DEVICES:
+                gateway.device_manager.get_device(device_id)
+            eager_ms = (time.perf_counter() - start) * 1000
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    rss = _rss_mb()
+    return {
+        "devices": device_count,
+        "import_ms": round(import_ms, 1),
+        "eager_ms": round(eager_ms, 1),
+        "rss_mb": round(rss, 1),
+        "rss_delta_mb": round(rss - base_rss, 1),
+        "routes": len(gateway.app.routes),
+        "clients": gateway.device_manager.stats()["active_clients"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="网关启动耗时与空闲内存基准")
+    parser.add_argument("--devices", type=int, nargs="+", default=[1, 100, 1000], help="设备数（可多个）")
+    parser.add_argument("--eager", action="store_true", help="导入后为所有设备创建客户端，对比旧版开销")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(run_child(args.child, args.eager)))
+        return
+
+    env = {**os.environ, "PYTHONPATH": ROOT + os.pathsep + os.environ.get("PYTHONPATH", "")}
+    columns = ["devices", "import_ms", "eager_ms", "rss_mb", "rss_delta_mb", "routes", "clients"]
+    print("  ".join(f"{c:>12}" for c in columns))
+    for count in args.devices:
+        cmd = [sys.executable, os.path.abspath(__file__), "--child", str(count)] + (["--eager"] if args.eager else [])
+        out = subprocess.run(cmd, capture_output=True, text=True, env=env, cwd=ROOT)
+        if out.returncode != 0:
+            print(f"设备数 {count} 测量失败:\n{out.stderr}")
+            sys.exit(1)
+        row = json.loads(out.stdout.strip().splitlines()[-1])
+        print("  ".join(f"{row[c]:>12}" for c in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,25 +2,72 @@
 """
 Android RPA Server
 
-多应用、多套 API：每增加一个 app，就多一套相同能力的 API（/api/<app>/*）。
+多应用、同一套 API：每个 app 通过路径前缀 /api/<app>/* 访问相同能力，路由只注册一次。
 当前支持：微信(wechat)、企业微信(wework)；新增应用时在 APPS 中追加一项并实现设备端即可。
 """
+import asyncio
+import json
 import logging
+import os
 import subprocess
+import time
+import uuid
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from enum import Enum
 from pathlib import Path
+from typing import Callable, Literal, Optional
 
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response, RedirectResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, RedirectResponse
 from pydantic import BaseModel, Field
 
-from server.core import DeviceClient, DeviceManager
-from server.config import DEVICES, SERVER_PORT, ADB_PATH
+from server.core import (
+    AdmissionController, AdmissionRejected, CapacityController, ContactIndex, DeviceClient, DeviceManager, EventBus, GroupCache, IdempotencyConflict, IdempotencyStore, Job, LoopMonitor,
+    MessageTracker, QuotaExceeded, ResultStore, RouteStats, Scheduler, ScreenRecorder, SessionBatcher, StackSampler,
+    TaskRecord, Tenant, TenantRegistry,
+)
+from server.core.campaign import ROW_FORMATS, Campaign, CampaignRunner, read_csv_header, spool_upload
+from server.core.admission import PRIORITY_BULK, PRIORITY_CRITICAL, PRIORITY_INTERACTIVE
+from server.core.events import (
+    EVENT_DEVICE_OFFLINE, EVENT_DEVICE_ONLINE, EVENT_MESSAGE_RECEIVED, EVENT_PING, EVENT_TASK_COMPLETED,
+    EVENT_TASK_SUBMITTED, EVENT_TASK_TIMEOUT, EVENT_TYPES,
+)
+from server.core.result_store import STATUS_SUCCESS
+from server.core.results import TaskResult, decode_task_data
+from server.core.screen_capture import screencap
+from server.core.templates import MessageTemplate, TemplateError, TemplateRegistry
+from server.core.tenants import REASON_FORBIDDEN, REASON_RATE_LIMITED
+from server.core.transport import make_transport
+from server.api.encoding import EncodedResponse, decode_body, make_encoding_middleware
+from server.config import (
+    DEVICES, SERVER_PORT, ADB_PATH, SESSION_MERGE_WINDOW, SESSION_MAX_ACTIONS,
+    GROUP_CACHE_TTL, CONTACT_INDEX_STORE, CONTACT_INDEX_REFRESH_INTERVAL, IDEMPOTENCY_TTL, IDEMPOTENCY_MAX_KEYS, COMPRESS_MIN_SIZE,
+    SCHEDULER_STORE, SCHEDULER_SPREAD_SECONDS, SCHEDULER_MISSED_GRACE, SCHEDULER_FINISHED_RETENTION,
+    DEVICE_CLIENT_IDLE_TIMEOUT, DEVICE_TRANSPORT, DEVICE_TRANSPORT_FILE, DEVICE_REPLAY_LATENCY_SCALE, TASK_POLL_INTERVAL, TASK_TIMEOUT, CAPACITY_AUTOTUNE, CAPACITY_INITIAL_WINDOW,
+    CAPACITY_MAX_WINDOW, CAPACITY_DEGRADE_RATIO, CAPACITY_STATUS_INTERVAL, RESULT_STORE_MAX_PER_DEVICE, RESULT_STORE_TTL,
+    RESULT_STORE_SPILL_DIR, RESULT_STORE_SPILL_BYTES, TEMPLATE_STORE, CAMPAIGN_SPOOL_DIR,
+    CAMPAIGN_MAX_UPLOAD_MB, CAMPAIGN_QUEUE_SIZE, CAMPAIGN_SEND_INTERVAL, PROFILING_ENABLED, PROFILING_LOOP_INTERVAL, PROFILING_SLOW_THRESHOLD, PROFILING_MAX_SECONDS,
+    SCREEN_CAPTURE_ENABLED, SCREEN_CAPTURE_DIR, SCREEN_CAPTURE_INTERVAL, SCREEN_CAPTURE_SCALE, SCREEN_CAPTURE_DEDUP_DISTANCE,
+    SCREEN_CAPTURE_KEYFRAME_INTERVAL, SCREEN_CAPTURE_MAX_SECONDS, SCREEN_CAPTURE_MAX_MB,
+    ADMISSION_ENABLED, ADMISSION_MAX_CONCURRENT, ADMISSION_MAX_QUEUE, ADMISSION_MAX_PER_DEVICE, ADMISSION_QUEUE_TIMEOUT,
+    ADMISSION_BULK_QUEUE_TIMEOUT, ADMISSION_BULK_SHARE, WEBHOOK_STORE, WEBHOOK_OUTBOX_DIR, WEBHOOK_BATCH_SIZE,
+    WEBHOOK_BATCH_INTERVAL, WEBHOOK_TIMEOUT, WEBHOOK_RETRY_MAX_SECONDS, WEBHOOK_MAX_OUTBOX,
+    EVENT_DEVICE_PROBE_INTERVAL, EVENT_TASK_WATCH_SECONDS, TENANTS, TENANT_ADMIN_KEY, TENANT_USAGE_STORE,
+)
 
 # Swagger 分组（与根 API 结构一致）
 TAG_DEVICES = "设备管理 /api/devices"
 TAG_APPS = "应用管理 /api/apps"
+TAG_APP_API = "应用 API /api/{app_name}"
 TAG_BROADCAST = "广播与调试"
+TAG_JOBS = "定时任务 /api/jobs"
+TAG_TASKS = "任务结果 /api/tasks"
+TAG_CONTACTS = "联系人索引 /api/contacts"
+TAG_CAMPAIGNS = "模板群发 /api/templates"
+TAG_WEBHOOKS = "事件推送 /api/webhooks"
+TAG_TENANTS = "租户 /api/tenants"
 
 logging.basicConfig(
     level=logging.INFO,
@@ -31,27 +78,258 @@ logger = logging.getLogger("AndroidRpaServer")
 # ================================================================
 # Android RPA Server
 # ================================================================
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    capacity.start()
+    scheduler.start()
+    event_bus.start()
+    background = [
+        asyncio.ensure_future(_contact_refresh_loop()),
+        asyncio.ensure_future(_task_event_loop()),
+        asyncio.ensure_future(_device_event_loop()),
+    ]
+    if PROFILING_ENABLED:
+        loop_monitor.start()
+    yield
+    for task in background:
+        task.cancel()
+    contact_index.save()
+    tenants.save()
+    await loop_monitor.stop()
+    await scheduler.stop()
+    await event_bus.stop()
+    await asyncio.get_running_loop().run_in_executor(None, screen_recorder.close)
+
+
 app = FastAPI(
     title="Android RPA Server",
-    description="多应用 RPA 网关：每增加一个 app 即多一套 API（获取联系人、单聊、创建群、群管理、收发消息）。文档分组与根 API 结构一致。",
+    description="多应用 RPA 网关：每个 app 通过 /api/{app_name}/* 访问同一套 API（获取联系人、单聊、创建群、群管理、收发消息）。文档分组与根 API 结构一致。",
     version="2.0.0",
+    default_response_class=EncodedResponse,
+    lifespan=lifespan,
     openapi_tags=[
-        {"name": TAG_DEVICES, "description": "设备列表、状态、实时画面、控件树"},
+        {"name": TAG_DEVICES, "description": "设备列表、状态、容量、实时画面、任务画面录制、控件树"},
         {"name": TAG_APPS, "description": "已注册应用及对应 /api/<app>/* 前缀"},
-        {"name": "微信 /api/wechat", "description": "个人微信：联系人、单聊、群聊与群管理"},
-        {"name": "企业微信 /api/wework", "description": "企业微信：联系人、单聊、群聊与群管理"},
-        {"name": TAG_BROADCAST, "description": "广播、健康检查"},
+        {"name": TAG_APP_API, "description": "联系人、单聊、群聊与群管理；app_name 为 wechat（个人微信）或 wework（企业微信）"},
+        {"name": TAG_TASKS, "description": "经网关提交的设备任务状态与结果（网关侧存储）、录制的任务画面时间轴"},
+        {"name": TAG_CONTACTS, "description": "全设备联系人检索：名称、备注、拼音首字母；查询联系人在哪些设备上"},
+        {"name": TAG_CAMPAIGNS, "description": "消息模板注册与按收件人变量行流式群发"},
+        {"name": TAG_JOBS, "description": "定时/周期任务：发消息、读消息、群管理"},
+        {"name": TAG_WEBHOOKS, "description": "订阅任务、设备、新消息事件，批量推送到 Webhook 地址"},
+        {"name": TAG_TENANTS, "description": "多租户：当前租户信息与各租户用量"},
+        {"name": TAG_BROADCAST, "description": "广播、健康检查、性能剖析 /debug/*"},
     ],
 )
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
+# ================================================================
+# 幂等键：有副作用的 POST 接口携带 Idempotency-Key（请求头或 idempotency_key 字段）
+# 时，重复请求直接返回首次响应，调用方可放心重试
+# ================================================================
+
+idempotency_store = IdempotencyStore(max_keys=IDEMPOTENCY_MAX_KEYS, ttl=IDEMPOTENCY_TTL)
+# 删除、取消等接口重复执行结果相同，不需要幂等键
+_IDEMPOTENT_PATHS: set[str] = {"/api/broadcast", "/api/jobs", "/api/templates", "/api/webhooks"}
+# 上传类接口（模板群发）：请求体可达数百 MB，中间件不读取请求体，幂等键只能放在请求头，
+# 指纹取查询参数与请求体类型、长度
+_IDEMPOTENT_UPLOAD_PATHS: set[str] = set()
+
+
+def _is_idempotent_path(path: str) -> bool:
+    if path in _IDEMPOTENT_PATHS or path in _IDEMPOTENT_UPLOAD_PATHS:
+        return True
+    # 立即执行定时任务：/api/jobs/{job_id}/run
+    parts = path.strip("/").split("/")
+    return len(parts) == 4 and parts[:2] == ["api", "jobs"] and parts[3] == "run"
+
+
+def _response_failed(content: bytes, content_type: str) -> bool:
+    """
+    2xx 响应中的操作是否失败：路由把设备端提交结果放在 data 中原样返回，
+    设备不可达、提交被拒绝时 data.success 为 False，这类结果不作为幂等结果保存，重试时重新执行
+    """
+    data = decode_body(content, content_type)
+    if not isinstance(data, dict):
+        return False
+    inner = data.get("data")
+    return data.get("success") is False or (isinstance(inner, dict) and inner.get("success") is False)
+
+
+def _idempotency_key_from_body(body: bytes) -> str:
+    try:
+        data = json.loads(body) if body else {}
+    except ValueError:
+        return ""
+    key = data.get("idempotency_key") if isinstance(data, dict) else None
+    return str(key) if key else ""
+
+
+@app.middleware("http")
+async def idempotency_middleware(request: Request, call_next):
+    path = request.url.path
+    if request.method != "POST" or not _is_idempotent_path(path):
+        return await call_next(request)
+    if path in _IDEMPOTENT_UPLOAD_PATHS:
+        key = request.headers.get("Idempotency-Key", "")
+        body = "|".join((
+            request.url.query, request.headers.get("content-type", ""), request.headers.get("content-length", ""),
+        )).encode()
+    else:
+        body = await request.body()
+        key = request.headers.get("Idempotency-Key") or _idempotency_key_from_body(body)
+    if not key:
+        return await call_next(request)
+    # 幂等键按租户隔离，不同租户使用相同的键互不影响
+    scope = f"{_tenant_id()}:{path}" if tenants.enabled else path
+
+    try:
+        record, is_new = idempotency_store.begin(scope, key, body)
+    except IdempotencyConflict as e:
+        return JSONResponse(status_code=422, content={"detail": str(e)})
+    if not is_new:
+        try:
+            status_code, headers, content = await asyncio.shield(record.future)
+        except KeyError:
+            # 首次请求失败未留下结果，本次按新请求执行
+            return await call_next(request)
+        logger.info(f"幂等重放: {scope} key={key}")
+        return Response(content=content, status_code=status_code, headers={**headers, "Idempotent-Replayed": "true"})
+
+    try:
+        response = await call_next(request)
+    except Exception:
+        idempotency_store.abort(scope, key)
+        raise
+    if not 200 <= response.status_code < 300:
+        idempotency_store.abort(scope, key)
+        return response
+    content = b"".join([chunk async for chunk in response.body_iterator])
+    headers = dict(response.headers)
+    if _response_failed(content, headers.get("content-type", "")):
+        idempotency_store.abort(scope, key)
+    else:
+        idempotency_store.complete(scope, key, (response.status_code, headers, content))
+    return Response(content=content, status_code=response.status_code, headers=headers)
+
+
+# 响应编码（msgpack 协商、gzip/br 压缩）位于幂等中间件外层，幂等重放的响应同样会被压缩
+app.middleware("http")(make_encoding_middleware(COMPRESS_MIN_SIZE))
+
+# ================================================================
+# 性能剖析（PROFILING_ENABLED 开启时生效）：事件循环延迟/慢回调、按路由耗时、按需采样
+# ================================================================
+
+loop_monitor = LoopMonitor(interval=PROFILING_LOOP_INTERVAL, slow_threshold=PROFILING_SLOW_THRESHOLD)
+route_stats = RouteStats()
+stack_sampler = StackSampler()
+
+
+@app.middleware("http")
+async def route_timing_middleware(request: Request, call_next):
+    if not PROFILING_ENABLED:
+        return await call_next(request)
+    wall_start, cpu_start = time.perf_counter(), time.thread_time()
+    response = await call_next(request)
+    # 按路由模板归并（/api/devices/{device_id}/status），未匹配的路径统一计入 <unmatched>
+    route = request.scope.get("route")
+    key = f"{request.method} {route.path}" if route is not None else "<unmatched>"
+    route_stats.record(key, time.perf_counter() - wall_start, time.thread_time() - cpu_start, response.status_code)
+    return response
+
+
+# 设备容量模型：从任务结果学习服务时间，自动调整每台设备的在途窗口与下发节奏
+capacity = CapacityController(
+    poll=lambda device_id, task_id: device_manager.get_device(device_id).get_task_result(task_id),
+    status=lambda device_id: device_manager.get_device(device_id).get_status(),
+    initial_window=CAPACITY_INITIAL_WINDOW,
+    max_window=CAPACITY_MAX_WINDOW,
+    degrade_ratio=CAPACITY_DEGRADE_RATIO,
+    task_timeout=TASK_TIMEOUT,
+    poll_interval=TASK_POLL_INTERVAL,
+    status_interval=CAPACITY_STATUS_INTERVAL,
+    autotune=CAPACITY_AUTOTUNE,
 )
 
-device_manager = DeviceManager()
+# 任务画面录制：开启录制的设备上，经网关提交的任务在执行期间经 adb 连续截屏
+screen_recorder = ScreenRecorder(
+    SCREEN_CAPTURE_DIR,
+    capture=lambda device_id: screencap((ADB_PATH or "adb").strip(), (DEVICES[device_id].get("adb_serial") or "").strip()),
+    poll=lambda device_id, task_id: device_manager.get_device(device_id).get_task_result(task_id),
+    enabled=SCREEN_CAPTURE_ENABLED,
+    interval=SCREEN_CAPTURE_INTERVAL,
+    scale=SCREEN_CAPTURE_SCALE,
+    dedup_distance=SCREEN_CAPTURE_DEDUP_DISTANCE,
+    keyframe_interval=SCREEN_CAPTURE_KEYFRAME_INTERVAL,
+    max_seconds=SCREEN_CAPTURE_MAX_SECONDS,
+    max_bytes=SCREEN_CAPTURE_MAX_MB * 1024 * 1024,
+    poll_interval=TASK_POLL_INTERVAL,
+)
+
+# 事件总线：任务、设备、新消息事件按订阅批量推送到 Webhook 地址（/api/webhooks）
+event_bus = EventBus(
+    store_path=WEBHOOK_STORE or None,
+    outbox_dir=WEBHOOK_OUTBOX_DIR or None,
+    batch_size=WEBHOOK_BATCH_SIZE,
+    batch_interval=WEBHOOK_BATCH_INTERVAL,
+    timeout=WEBHOOK_TIMEOUT,
+    compress_min_size=COMPRESS_MIN_SIZE,
+    retry_max_seconds=WEBHOOK_RETRY_MAX_SECONDS,
+    max_outbox=WEBHOOK_MAX_OUTBOX,
+)
+message_tracker = MessageTracker()
+
+
+def _on_task_tracked(record: TaskRecord) -> None:
+    """任务登记：录制任务画面，发布 task.submitted（可能在线程池中调用）"""
+    screen_recorder.track(record)
+    event_bus.publish(EVENT_TASK_SUBMITTED, record.to_dict(), device_id=record.device_id)
+
+
+def _on_task_completed(record: TaskRecord) -> None:
+    """任务取到结果：更新容量模型，发布 task.completed 与读消息结果中的新消息（可能在线程池中调用）"""
+    capacity.observe(record)
+    device_id = record.device_id
+    # 落盘的大结果不放进事件（spilled 为 true），接收方按需调用 /api/tasks/{task_id}
+    event_bus.publish(EVENT_TASK_COMPLETED, record.to_dict(record.payload), device_id=device_id)
+    if (record.status != STATUS_SUCCESS or record.op not in ("read_messages", "chat_session") or not record.target
+            or not event_bus.wants(EVENT_MESSAGE_RECEIVED, device_id)):
+        return
+    messages = _read_messages_of(record.op, result_store.load_payload(record))
+    for message in message_tracker.new_messages(device_id, record.app_type, record.target, messages):
+        event_bus.publish(EVENT_MESSAGE_RECEIVED, {
+            "app_type": record.app_type, "contact": record.target, "task_id": record.task_id, "message": message,
+        }, device_id=device_id)
+
+
+def _read_messages_of(op: str, payload) -> list[dict]:
+    """读消息任务（或会话任务中的读动作）返回的消息"""
+    task = TaskResult(success=True, data=payload)
+    if op == "read_messages":
+        messages = task.as_messages() or []
+    else:
+        messages = [
+            m for action in task.as_session() or [] if action.type == "read" and action.success
+            for m in TaskResult(data=action.data).as_messages() or []
+        ]
+    return [m.model_dump() for m in messages]
+
+
+# 经网关提交的任务及其结果（各设备客户端共用），已完成任务的查询不再访问设备
+result_store = ResultStore(
+    max_per_device=RESULT_STORE_MAX_PER_DEVICE,
+    ttl=RESULT_STORE_TTL,
+    spill_dir=RESULT_STORE_SPILL_DIR or None,
+    spill_bytes=RESULT_STORE_SPILL_BYTES,
+    on_complete=_on_task_completed,
+    on_track=_on_task_tracked,
+)
+
+# 只登记设备配置，客户端在首次请求该设备时创建，空闲超时后回收；DEVICE_TRANSPORT 为录制/回放时经适配器访问
+device_manager = DeviceManager(
+    idle_timeout=DEVICE_CLIENT_IDLE_TIMEOUT,
+    result_store=result_store,
+    transport=make_transport(DEVICE_TRANSPORT, DEVICE_TRANSPORT_FILE, DEVICE_REPLAY_LATENCY_SCALE),
+)
 for device_id, device_config in DEVICES.items():
     device_manager.add_device(
         device_id=device_id,
@@ -60,6 +338,189 @@ for device_id, device_config in DEVICES.items():
     )
 
 
+# ================================================================
+# 多租户（配置 TENANTS 时启用）：按 API Key 识别租户，租户只能访问自己的设备，
+# 按租户权重公平排队，并受并发、速率与每日配额限制；用量见 /api/tenants/usage
+# ================================================================
+
+tenants = TenantRegistry(TENANTS, admin_key=TENANT_ADMIN_KEY, store_path=TENANT_USAGE_STORE or None)
+# 当前请求的租户（由 tenant_middleware 设置；定时任务执行时设为任务所属租户）
+_current_tenant: ContextVar[Tenant] = ContextVar("current_tenant", default=tenants.admin)
+
+
+def _tenant() -> Tenant:
+    """路由依赖：当前请求的租户"""
+    return _current_tenant.get()
+
+
+def _tenant_id() -> str:
+    """当前租户 ID，用于公平排队与隔离；未启用多租户时为空"""
+    return _current_tenant.get().tenant_id if tenants.enabled else ""
+
+
+def _require_admin(tenant: Tenant = Depends(_tenant)) -> Tenant:
+    if not tenant.admin:
+        raise HTTPException(status_code=403, detail="需要管理员 API Key")
+    return tenant
+
+
+def _owned(tenant: Tenant, owner_id: str) -> bool:
+    """群发、定时任务、订阅等资源是否对当前租户可见（管理员可见全部）"""
+    return tenant.admin or owner_id == tenant.tenant_id
+
+
+def _tenant_devices(tenant: Tenant, device_ids: Optional[list[str]] = None) -> Optional[list[str]]:
+    """把候选设备限定在租户的设备内；均不限制时返回 None"""
+    if tenant.devices is None:
+        return device_ids or None
+    return tenant.visible(device_ids) if device_ids else sorted(tenant.devices)
+
+
+# ================================================================
+# 准入控制（ADMISSION_ENABLED）：限制同时处理的请求数与每台设备的队列深度，
+# 过载时快速返回 429 + Retry-After；只读接口（健康检查、状态、任务查询）不受限制
+# ================================================================
+
+admission = AdmissionController(
+    max_concurrent=ADMISSION_MAX_CONCURRENT,
+    max_queue=ADMISSION_MAX_QUEUE,
+    max_per_device=ADMISSION_MAX_PER_DEVICE,
+    queue_timeout={PRIORITY_INTERACTIVE: ADMISSION_QUEUE_TIMEOUT, PRIORITY_BULK: ADMISSION_BULK_QUEUE_TIMEOUT},
+    bulk_share=ADMISSION_BULK_SHARE,
+    backlog=capacity.backlog,
+    drain=capacity.drain_seconds,
+    share=tenants.share,
+)
+
+# 批量类请求：过载时先被拒绝，排队时限更长
+_BULK_PATHS: set[str] = {"/api/broadcast"}
+# 应用 API 中的批量请求：/api/{app_name}/<action>（采集联系人列表、模板群发）
+_BULK_APP_ACTIONS: set[str] = {"contacts", "campaigns"}
+
+
+def _admission_class(method: str, path: str) -> tuple[str, str]:
+    """请求的优先级与可从路径确定的目标设备（只看方法与路径，不读取请求体）"""
+    if method == "OPTIONS":
+        return PRIORITY_CRITICAL, ""   # CORS 预检
+    parts = path.strip("/").split("/")
+    if method in ("GET", "HEAD"):
+        # 截屏、导出控件树会同步访问设备，其余只读接口总能通过
+        if len(parts) == 4 and parts[:2] == ["api", "devices"] and parts[3] in ("screen", "dump_ui"):
+            return PRIORITY_INTERACTIVE, parts[2]
+        return PRIORITY_CRITICAL, ""
+    if path in _BULK_PATHS or (parts[:2] == ["api", "jobs"] and parts[-1] == "run"):
+        return PRIORITY_BULK, ""
+    if len(parts) >= 3 and parts[0] == "api" and parts[1] in _APP_TYPES:
+        return (PRIORITY_BULK if len(parts) == 3 and parts[2] in _BULK_APP_ACTIONS else PRIORITY_INTERACTIVE), ""
+    return PRIORITY_CRITICAL, ""
+
+
+def _is_json_request(request: Request) -> bool:
+    """请求体类型是否为 application/json（不含 application/x-ndjson 等上传内容，避免中间件缓冲大请求体）"""
+    return request.headers.get("content-type", "").split(";")[0].strip().lower() == "application/json"
+
+
+async def _request_json(request: Request) -> dict:
+    if not _is_json_request(request):
+        return {}
+    try:
+        data = json.loads(await request.body() or b"{}")
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+async def _body_device_id(request: Request) -> str:
+    device_id = (await _request_json(request)).get("device_id")
+    return device_id if isinstance(device_id, str) else ""
+
+
+@app.middleware("http")
+async def admission_middleware(request: Request, call_next):
+    if not ADMISSION_ENABLED:
+        return await call_next(request)
+    priority, device_id = _admission_class(request.method, request.url.path)
+    if priority == PRIORITY_CRITICAL:
+        return await call_next(request)
+    if not device_id:
+        device_id = request.query_params.get("device_id") or ""
+    if not device_id and request.method == "POST":
+        device_id = await _body_device_id(request)
+    try:
+        timeout = float(request.headers.get("X-Queue-Timeout") or 0) or None
+    except ValueError:
+        timeout = None
+    try:
+        ticket = await admission.admit(priority, device_id, timeout=timeout, tenant=_tenant_id())
+    except AdmissionRejected as e:
+        if tenants.enabled:
+            tenants.reject(_current_tenant.get(), e.reason)
+        return JSONResponse(
+            status_code=429,
+            content={"detail": str(e), "reason": e.reason, "retry_after": e.retry_after},
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    try:
+        return await call_next(request)
+    finally:
+        admission.release(ticket)
+
+
+async def _request_device_ids(request: Request) -> list[str]:
+    """请求涉及的设备：路径 /api/devices/{device_id}/*、查询参数与 JSON 请求体中的 device_id / device_ids"""
+    parts = request.url.path.strip("/").split("/")
+    found = [parts[2]] if len(parts) >= 4 and parts[:2] == ["api", "devices"] else []
+    found.append(request.query_params.get("device_id") or "")
+    found += (request.query_params.get("device_ids") or "").split(",")
+    if request.method in ("POST", "PUT", "PATCH"):
+        data = await _request_json(request)
+        device_ids = data.get("device_ids")
+        found += [data.get("device_id")] + (device_ids if isinstance(device_ids, list) else [])
+    return [d for d in found if d and isinstance(d, str)]
+
+
+# 在准入控制之后注册（位于其外层）：先识别租户、校验设备归属与配额，准入控制再按租户公平排队
+@app.middleware("http")
+async def tenant_middleware(request: Request, call_next):
+    path = request.url.path
+    if (not tenants.enabled or request.method == "OPTIONS" or path == "/api/health"
+            or not path.startswith(("/api/", "/debug/"))):
+        return await call_next(request)
+    auth = request.headers.get("Authorization", "")
+    api_key = request.headers.get("X-API-Key") or (auth[7:].strip() if auth.lower().startswith("bearer ") else "")
+    tenant = tenants.authenticate(api_key)
+    if tenant is None:
+        return JSONResponse(status_code=401, content={"detail": "缺少或无效的 API Key（请求头 X-API-Key）"})
+    denied = [d for d in await _request_device_ids(request) if not tenant.allows(d)]
+    if denied:
+        tenants.reject(tenant, REASON_FORBIDDEN)
+        return JSONResponse(status_code=403, content={"detail": f"无权访问设备: {', '.join(sorted(set(denied)))}"})
+    priority, _ = _admission_class(request.method, path)
+    if priority != PRIORITY_CRITICAL:
+        try:
+            tenants.charge(tenant)
+        except QuotaExceeded as e:
+            return JSONResponse(
+                status_code=429,
+                content={"detail": str(e), "reason": e.reason, "retry_after": e.retry_after},
+                headers={"Retry-After": str(e.retry_after)},
+            )
+    _current_tenant.set(tenant)
+    start = time.perf_counter()
+    response = await call_next(request)
+    tenants.record(tenant, priority, response.status_code, time.perf_counter() - start)
+    return response
+
+
+# 最后注册（位于最外层）：鉴权、配额、准入控制返回的 401/403/429 同样带 CORS 头，浏览器端能读到错误内容
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+
 # ================================================================
 # 请求模型（通用，均含 device_id）
 # ================================================================
@@ -68,7 +529,13 @@ class DeviceIdMixin(BaseModel):
     device_id: str = Field(..., description="设备ID")
 
 
-class SendMessageRequest(DeviceIdMixin):
+class IdempotencyMixin(BaseModel):
+    idempotency_key: Optional[str] = Field(
+        None, description="幂等键（也可用请求头 Idempotency-Key），重复请求返回首次结果"
+    )
+
+
+class SendMessageRequest(DeviceIdMixin, IdempotencyMixin):
     contact: str = Field(..., description="联系人或群组名称")
     message: str = Field(..., description="消息内容")
 
@@ -78,21 +545,84 @@ class ReadMessagesRequest(DeviceIdMixin):
     count: int = Field(10, description="读取条数")
 
 
-class CreateGroupRequest(DeviceIdMixin):
+class CreateGroupRequest(DeviceIdMixin, IdempotencyMixin):
     group_name: str = Field("", description="群名称")
     members: list[str] = Field(..., description="初始成员列表")
 
 
-class GroupMemberRequest(DeviceIdMixin):
+class GroupMemberRequest(DeviceIdMixin, IdempotencyMixin):
     group_name: str = Field(..., description="群名称")
     members: list[str] = Field(..., description="成员列表")
 
 
 class GroupQueryRequest(DeviceIdMixin):
     group_name: str = Field(..., description="群名称")
+    refresh: bool = Field(False, description="忽略缓存，强制从设备获取")
+
+
+class GroupSyncRequest(DeviceIdMixin, IdempotencyMixin):
+    group_name: str = Field(..., description="群名称")
+    members: list[str] = Field(..., description="目标成员列表（期望的完整成员）")
+    remove_extra: bool = Field(True, description="是否移除不在目标列表中的成员")
+    dry_run: bool = Field(False, description="仅返回变更计划，不执行")
+
+
+class SessionAction(BaseModel):
+    type: Literal["send", "read", "group_members"] = Field(..., description="动作类型：发消息 / 读消息 / 获取群成员")
+    message: str = Field("", description="消息内容（send）")
+    count: int = Field(10, description="读取条数（read）")
+
+
+class ChatSessionRequest(DeviceIdMixin, IdempotencyMixin):
+    contact: str = Field(..., description="联系人或群组名称")
+    actions: list[SessionAction] = Field(..., min_length=1, description="按顺序执行的动作列表")
+    wait: bool = Field(True, description="是否等待会话执行完成")
+
+
+class JobCreateRequest(DeviceIdMixin):
+    app_type: str = Field("wework", description="目标应用，见 /api/apps")
+    action: Literal[
+        "send_message", "read_messages", "invite_to_group", "remove_from_group", "group_members", "group_sync",
+    ] = Field(..., description="执行的操作")
+    params: dict = Field(default_factory=dict, description="操作参数，与对应接口请求体相同（不含 device_id）")
+    cron: Optional[str] = Field(None, description="cron 表达式（分 时 日 月 周），周期任务")
+    run_at: Optional[float] = Field(None, description="一次性任务执行时间（Unix 时间戳）")
+    delay_seconds: Optional[float] = Field(None, description="一次性任务延时（秒）")
+    name: str = Field("", description="任务名称")
+    missed_policy: Literal["skip", "run_once"] = Field("run_once", description="错过执行时：跳过 / 补执行一次")
+    spread_seconds: int = Field(0, description="启动时间打散窗口（秒），0 使用默认值")
+
+
+class TemplateCreateRequest(BaseModel):
+    template_id: str = Field("", description="模板ID，留空自动生成；已存在时覆盖")
+    name: str = Field("", description="模板名称")
+    text: str = Field(..., min_length=1, description="模板内容，变量写作 {{name}} 或 {{name|默认值}}")
+
+
+class TemplatePreviewRequest(BaseModel):
+    row: dict = Field(default_factory=dict, description="变量行，如 {\"name\": \"张三\"}")
+
+
+class RoutedSendRequest(IdempotencyMixin):
+    contact: str = Field(..., description="联系人名称（与联系人索引中的名称完全一致）")
+    message: str = Field(..., description="消息内容")
+    device_ids: Optional[list[str]] = Field(None, description="候选设备，留空则在所有认识该联系人的设备中选择")
+    wait: bool = Field(False, description="是否等待发送完成")
+
+
+class CaptureToggleRequest(BaseModel):
+    enabled: Optional[bool] = Field(..., description="是否录制该设备上的任务画面；null 恢复为 config 中的全局设置")
 
 
-class BroadcastRequest(BaseModel):
+class WebhookCreateRequest(BaseModel):
+    url: str = Field(..., description="接收事件的地址（http:// 或 https://）")
+    events: list[str] = Field(default_factory=lambda: ["*"], description="订阅的事件类型，支持 task.*、*")
+    device_ids: list[str] = Field(default_factory=list, description="只推送这些设备的事件，留空为全部设备")
+    secret: str = Field("", description="签名密钥：设置后请求带 X-Webhook-Signature（HMAC-SHA256）")
+    description: str = Field("", description="备注")
+
+
+class BroadcastRequest(IdempotencyMixin):
     contact: str = Field(..., description="联系人名称")
     message: str = Field(..., description="消息内容")
 
@@ -101,17 +631,49 @@ class BroadcastRequest(BaseModel):
 # 设备管理 API  /api/devices
 # ================================================================
 
+def _own_devices(tenant: Tenant, data: dict) -> dict:
+    """按设备 ID 索引的数据只保留租户的设备"""
+    return {did: v for did, v in data.items() if tenant.allows(did)}
+
+
 @app.get("/api/devices", summary="获取所有设备列表", tags=[TAG_DEVICES])
-async def list_devices():
-    return {"success": True, "data": device_manager.get_all_devices()}
+async def list_devices(tenant: Tenant = Depends(_tenant)):
+    return {"success": True, "data": _own_devices(tenant, device_manager.get_all_devices())}
 
 
 @app.get("/api/devices/online", summary="获取在线设备列表", tags=[TAG_DEVICES])
-async def list_online_devices():
-    online = device_manager.get_online_devices()
+async def list_online_devices(tenant: Tenant = Depends(_tenant)):
+    online = tenant.visible(device_manager.get_online_devices())
     return {"success": True, "data": online, "count": len(online)}
 
 
+@app.get("/api/devices/capacity", summary="设备容量模型", tags=[TAG_DEVICES])
+async def list_device_capacity(tenant: Tenant = Depends(_tenant)):
+    """各设备学习到的服务时间、当前在途窗口与下发节奏、变慢告警"""
+    return {"success": True, "data": _own_devices(tenant, capacity.stats())}
+
+
+@app.get("/api/devices/{device_id}/capacity", summary="单台设备容量模型", tags=[TAG_DEVICES])
+async def get_device_capacity(device_id: str):
+    _get_client(device_id)
+    return {"success": True, "data": capacity.stats(device_id).get(device_id)}
+
+
+@app.get("/api/devices/capture", summary="任务画面录制状态", tags=[TAG_DEVICES])
+async def list_screen_capture(tenant: Tenant = Depends(_tenant)):
+    """各设备是否录制、排队录制的任务数、截屏/保存/去重帧数，以及段文件占用的磁盘空间"""
+    return {"success": True, "data": {
+        "devices": _own_devices(tenant, screen_recorder.stats()), "disk": screen_recorder.disk_usage(),
+    }}
+
+
+@app.post("/api/devices/{device_id}/capture", summary="开启/关闭任务画面录制", tags=[TAG_DEVICES])
+async def set_screen_capture(device_id: str, req: CaptureToggleRequest):
+    """开启后该设备上经网关提交的任务在执行期间连续截屏（需 ADB），用 /api/tasks/{task_id}/frames 回看"""
+    _get_client(device_id)
+    return {"success": True, "data": screen_recorder.enable(device_id, req.enabled)}
+
+
 @app.get("/api/devices/{device_id}/status", summary="获取设备状态", tags=[TAG_DEVICES])
 async def get_device_status(device_id: str):
     status = device_manager.get_device_status(device_id)
@@ -121,7 +683,7 @@ async def get_device_status(device_id: str):
 
 
 # ================================================================
-# 按应用注册 API：多一个 app 就多一套 /api/<app>/*
+# 应用 API：/api/{app_name}/*，各应用共用同一组路由，app_name 决定传给设备端的 app_type
 # ================================================================
 
 # 已支持的应用：(路径前缀, app_type 传设备端, 展示名)
@@ -129,6 +691,18 @@ APPS: list[tuple[str, str, str]] = [
     ("wechat", "wechat", "微信"),
     ("wework", "wework", "企业微信"),
 ]
+_APP_TYPES: dict[str, str] = {prefix: app_type for prefix, app_type, _ in APPS}
+AppName = Enum("AppName", {prefix: prefix for prefix in _APP_TYPES}, type=str)
+
+_IDEMPOTENT_PATHS.update(
+    f"/api/{prefix}/{action}"
+    for prefix in _APP_TYPES
+    for action in (
+        "send_message", "session", "create_group", "invite_to_group", "remove_from_group", "group_members/sync",
+        "contacts/send_message",
+    )
+)
+_IDEMPOTENT_UPLOAD_PATHS.update(f"/api/{prefix}/campaigns" for prefix in _APP_TYPES)
 
 
 def _get_client(device_id: str) -> DeviceClient:
@@ -138,70 +712,857 @@ def _get_client(device_id: str) -> DeviceClient:
     return client
 
 
+def _dispatch_chat_actions(device_id: str, app_type: str, contact: str, actions: list) -> dict:
+    """下发一批同聊天动作：单个动作走原接口，多个动作合并为一个聊天会话任务"""
+    client = _get_client(device_id)
+    if len(actions) == 1:
+        action = actions[0]
+        if action["type"] == "send":
+            return client.send_message(contact, action["message"], wait=False, app_type=app_type)
+        if action["type"] == "read":
+            return client.read_messages(contact, action.get("count", 10), wait=False, app_type=app_type)
+        if action["type"] == "group_members":
+            return client.get_group_members(contact, wait=False, app_type=app_type)
+    return client.chat_session(contact, actions, wait=False, app_type=app_type)
+
+
+async def _submit_limited(device_id: str, op: str, submit: Callable[[], dict]) -> dict:
+    """
+    经容量控制器下发一个不经合并器的设备任务（submit 为 wait=False 的阻塞提交，在线程池中执行）
+
+    所有提交都须登记为在途任务，否则设备队列中网关自己的任务会被当作外部积压，误降窗口。
+    """
+    await capacity.acquire(device_id, op)
+    task_id = ""
+    try:
+        resp = await asyncio.get_running_loop().run_in_executor(None, submit)
+        if isinstance(resp, dict) and resp.get("success") and isinstance(resp.get("data"), dict):
+            task_id = resp["data"].get("task_id", "")
+        return resp
+    finally:
+        capacity.dispatched(device_id, op, task_id)
+
+
+session_batcher = SessionBatcher(
+    _dispatch_chat_actions, window=SESSION_MERGE_WINDOW, max_actions=SESSION_MAX_ACTIONS, limiter=capacity,
+    weight=tenants.weight,
+)
+
+
+def _session_action_result(result: dict, index: int) -> dict:
+    """从合并会话的任务结果中取出第 index 个动作的结果"""
+    task = TaskResult.from_device(result)
+    actions = task.as_session() or []
+    if index < len(actions):
+        action = actions[index]
+        return TaskResult(
+            task_id=task.task_id, success=action.success, message=action.message, data=action.data
+        ).model_dump()
+    return TaskResult(
+        task_id=task.task_id, success=False, message=task.message or "会话在该动作之前已中止"
+    ).model_dump()
+
+
+# 全设备联系人索引：各设备采集的联系人列表与收发消息中确认过的联系人
+contact_index = ContactIndex(store_path=CONTACT_INDEX_STORE or None)
+
+
+async def _submit_chat_action(
+    device_id: str, app_type: str, contact: str, action: dict, wait: bool, tenant: Optional[str] = None
+) -> dict:
+    """经合并器提交单个聊天动作（按租户公平排队，默认为当前租户）；wait 时等待并取出本动作的结果"""
+    client = _get_client(device_id)
+    tenant = _tenant_id() if tenant is None else tenant
+    resp, index, size = await session_batcher.submit(device_id, app_type, contact, action, tenant=tenant)
+    task_id = (resp.get("data") or {}).get("task_id", "") if resp.get("success") else ""
+    if not wait or not task_id:
+        if size > 1 and task_id:
+            resp = {**resp, "data": {**resp["data"], "session_index": index, "session_size": size}}
+        return resp
+    result = await asyncio.get_running_loop().run_in_executor(None, client.wait_for_task, task_id)
+    result = _session_action_result(result, index) if size > 1 else result
+    if result.get("success") and action["type"] in ("send", "read"):
+        contact_index.learn(device_id, app_type, contact)
+    return result
+
+
+group_cache = GroupCache(ttl=GROUP_CACHE_TTL)
+
+
+async def _fetch_group_members(device_id: str, app_type: str, group_name: str) -> dict:
+    """从设备采集群成员（可与同群的其它操作合并），成功时写入缓存"""
+    result = await _submit_chat_action(device_id, app_type, group_name, {"type": "group_members"}, wait=True)
+    task = TaskResult.from_device(result)
+    members = task.as_names()
+    if task.success and members is not None:
+        group_cache.put(device_id, app_type, group_name, members)
+    return task.model_dump()
+
+
+def _track_group_mutation(device_id: str, app_type: str, group_name: str, submitted: dict, op: str) -> None:
+    """群变更提交后在后台等待结果：邀请/移除成功则更新缓存，否则使该群缓存失效"""
+    task_id = (submitted.get("data") or {}).get("task_id", "") if submitted.get("success") else ""
+    if not task_id or not group_name:
+        return
+    client = _get_client(device_id)
+
+    async def _watch():
+        task = TaskResult.from_device(
+            await asyncio.get_running_loop().run_in_executor(None, client.wait_for_task, task_id)
+        )
+        invite = task.as_invite() if task.success and op == "invite" else None
+        removed = task.as_names() if task.success and op == "remove" else None
+        if invite is not None:
+            group_cache.apply(device_id, app_type, group_name, added=invite.success)
+        elif removed is not None:
+            group_cache.apply(device_id, app_type, group_name, removed=removed)
+        else:
+            group_cache.invalidate(device_id, app_type, group_name)
+
+    asyncio.ensure_future(_watch())
+
+
+async def _sync_group(req: GroupSyncRequest, app_type: str) -> dict:
+    """将群成员同步为 req.members：按缓存计算计划，邀请与移除各最多下发一个设备任务"""
+    client = _get_client(req.device_id)
+    entry = group_cache.get(req.device_id, app_type, req.group_name)
+    if entry is None:
+        result = await _fetch_group_members(req.device_id, app_type, req.group_name)
+        entry = group_cache.get(req.device_id, app_type, req.group_name)
+        if entry is None:
+            return {"success": False, "message": result.get("message") or "获取群成员失败", "data": result}
+    to_invite, to_remove = GroupCache.plan(entry.members, req.members)
+    if not req.remove_extra:
+        to_remove = []
+    plan = {"current_count": entry.member_count, "invite": to_invite, "remove": to_remove}
+    if req.dry_run:
+        return {"success": True, "data": {"plan": plan, "tasks": {}}}
+
+    tasks = {}
+    if to_invite:
+        tasks["invite"] = await _submit_limited(
+            req.device_id, "invite_to_group",
+            lambda: client.invite_to_group(req.group_name, to_invite, wait=False, app_type=app_type),
+        )
+        _track_group_mutation(req.device_id, app_type, req.group_name, tasks["invite"], "invite")
+    if to_remove:
+        tasks["remove"] = await _submit_limited(
+            req.device_id, "remove_from_group",
+            lambda: client.remove_from_group(req.group_name, to_remove, wait=False, app_type=app_type),
+        )
+        _track_group_mutation(req.device_id, app_type, req.group_name, tasks["remove"], "remove")
+    return {"success": True, "data": {"plan": plan, "tasks": tasks}}
+
+
 def _norm_contact_result(result: dict) -> dict:
-    if isinstance(result.get("data"), list):
+    data = decode_task_data(result.get("data"))
+    if isinstance(data, list):
         return {
             "success": result.get("success", True),
-            "data": result["data"],
+            "data": data,
             "message": result.get("message", ""),
         }
     return {"success": True, "data": result}
 
 
-def _register_app_routes(prefix: str, app_type: str, label: str) -> None:
-    """为单个应用注册一套 API（获取联系人、单聊、创建群、群管理）"""
-    tag = f"{label} /api/{prefix}"
+def _app_type(app_name: AppName) -> str:
+    """路径中的应用前缀 -> 传给设备端的 app_type"""
+    return _APP_TYPES[app_name.value]
 
-    @app.post(f"/api/{prefix}/contacts", summary="获取联系人列表", tags=[tag])
-    async def _contacts(req: DeviceIdMixin):
-        result = _get_client(req.device_id).get_contact_list(app_type=app_type)
-        return _norm_contact_result(result)
 
-    @app.post(f"/api/{prefix}/send_message", summary="单聊-发送消息", tags=[tag])
-    async def _send_message(req: SendMessageRequest):
-        result = _get_client(req.device_id).send_message(
-            req.contact, req.message, wait=False, app_type=app_type
-        )
-        return {"success": True, "data": result}
+async def _refresh_contacts(device_id: str, app_type: str) -> dict:
+    """从设备采集联系人列表，成功时增量更新联系人索引"""
+    client = _get_client(device_id)
+    result = await asyncio.get_running_loop().run_in_executor(
+        None, lambda: client.get_contact_list(app_type=app_type)
+    )
+    normalized = _norm_contact_result(result)
+    if result.get("success") and isinstance(normalized["data"], list):
+        contact_index.update(device_id, app_type, normalized["data"])
+    return normalized
+
+
+async def _contact_refresh_loop() -> None:
+    """后台逐台重新采集超过 CONTACT_INDEX_REFRESH_INTERVAL 的设备，并保存学习到的联系人"""
+    while True:
+        await asyncio.sleep(60)
+        try:
+            due = contact_index.due(CONTACT_INDEX_REFRESH_INTERVAL) if CONTACT_INDEX_REFRESH_INTERVAL > 0 else []
+            for device_id, app_type in due[:1]:
+                if device_manager.has_device(device_id):
+                    await _refresh_contacts(device_id, app_type)
+            contact_index.schedule_save()
+        except Exception as e:
+            logger.error(f"刷新联系人索引失败: {e}")
+
+
+def _route_device(app_type: str, contact: str, device_ids: Optional[list[str]] = None) -> str:
+    """按联系人索引选择认识该联系人的设备：负载最低者优先，负载相同时取最近确认的；没有时返回空"""
+    candidates = [
+        d for d in contact_index.locate(contact, app_type)
+        if device_manager.has_device(d) and (device_ids is None or d in device_ids)
+    ]
+    return min(candidates, key=capacity.load) if candidates else ""
+
+
+@app.post("/api/{app_name}/contacts", summary="获取联系人列表", tags=[TAG_APP_API])
+async def app_contacts(req: DeviceIdMixin, app_type: str = Depends(_app_type)):
+    """从设备采集联系人列表（耗时较长），同时更新全设备联系人索引"""
+    return await _refresh_contacts(req.device_id, app_type)
+
+
+@app.post("/api/{app_name}/contacts/send_message", summary="单聊-按联系人索引选择设备发送", tags=[TAG_APP_API])
+async def app_routed_send_message(
+    req: RoutedSendRequest, app_type: str = Depends(_app_type), tenant: Tenant = Depends(_tenant)
+):
+    """不指定设备：从认识该联系人的设备中选择负载最低的一台发送"""
+    device_id = _route_device(app_type, req.contact, _tenant_devices(tenant, req.device_ids))
+    if not device_id:
+        raise HTTPException(status_code=404, detail=f"没有已知该联系人的设备: {req.contact}")
+    result = await _submit_chat_action(
+        device_id, app_type, req.contact, {"type": "send", "message": req.message}, wait=req.wait
+    )
+    return {"success": True, "device_id": device_id, "data": result}
 
-    @app.post(f"/api/{prefix}/read_messages", summary="单聊-读取消息", tags=[tag])
-    async def _read_messages(req: ReadMessagesRequest):
-        result = _get_client(req.device_id).read_messages(
-            req.contact, req.count, wait=True, app_type=app_type
-        )
-        return {"success": True, "data": result}
 
-    @app.post(f"/api/{prefix}/create_group", summary="创建群聊", tags=[tag])
-    async def _create_group(req: CreateGroupRequest):
-        result = _get_client(req.device_id).create_group(
-            req.group_name, req.members, wait=False, app_type=app_type
+@app.post("/api/{app_name}/send_message", summary="单聊-发送消息", tags=[TAG_APP_API])
+async def app_send_message(req: SendMessageRequest, app_type: str = Depends(_app_type)):
+    result = await _submit_chat_action(
+        req.device_id, app_type, req.contact, {"type": "send", "message": req.message}, wait=False
+    )
+    return {"success": True, "data": result}
+
+
+@app.post("/api/{app_name}/read_messages", summary="单聊-读取消息", tags=[TAG_APP_API])
+async def app_read_messages(req: ReadMessagesRequest, app_type: str = Depends(_app_type)):
+    result = await _submit_chat_action(
+        req.device_id, app_type, req.contact, {"type": "read", "count": req.count}, wait=True
+    )
+    task = TaskResult.from_device(result) if "task_id" in result else None
+    messages = task.as_messages() if task else None
+    if messages is not None:
+        result = {**task.model_dump(), "data": [m.model_dump() for m in messages]}
+    return {"success": True, "data": result}
+
+
+@app.post("/api/{app_name}/session", summary="聊天会话-一次导航执行多个动作", tags=[TAG_APP_API])
+async def app_chat_session(req: ChatSessionRequest, app_type: str = Depends(_app_type)):
+    client = _get_client(req.device_id)
+    actions = [a.model_dump() for a in req.actions]
+    result = await _submit_limited(
+        req.device_id, "chat_session", lambda: client.chat_session(req.contact, actions, wait=False, app_type=app_type)
+    )
+    task_id = (result.get("data") or {}).get("task_id", "") if result.get("success") else ""
+    if req.wait and task_id:
+        result = await asyncio.get_running_loop().run_in_executor(None, client.wait_for_task, task_id)
+    return {"success": True, "data": result}
+
+
+@app.post("/api/{app_name}/create_group", summary="创建群聊", tags=[TAG_APP_API])
+async def app_create_group(req: CreateGroupRequest, app_type: str = Depends(_app_type)):
+    client = _get_client(req.device_id)
+    result = await _submit_limited(
+        req.device_id, "create_group", lambda: client.create_group(req.group_name, req.members, wait=False, app_type=app_type)
+    )
+    _track_group_mutation(req.device_id, app_type, req.group_name, result, "create")
+    return {"success": True, "data": result}
+
+
+@app.post("/api/{app_name}/invite_to_group", summary="群管理-邀请入群", tags=[TAG_APP_API])
+async def app_invite_to_group(req: GroupMemberRequest, app_type: str = Depends(_app_type)):
+    client = _get_client(req.device_id)
+    result = await _submit_limited(
+        req.device_id, "invite_to_group", lambda: client.invite_to_group(req.group_name, req.members, wait=False, app_type=app_type)
+    )
+    _track_group_mutation(req.device_id, app_type, req.group_name, result, "invite")
+    return {"success": True, "data": result}
+
+
+@app.post("/api/{app_name}/remove_from_group", summary="群管理-移除成员", tags=[TAG_APP_API])
+async def app_remove_from_group(req: GroupMemberRequest, app_type: str = Depends(_app_type)):
+    client = _get_client(req.device_id)
+    result = await _submit_limited(
+        req.device_id, "remove_from_group", lambda: client.remove_from_group(req.group_name, req.members, wait=False, app_type=app_type)
+    )
+    _track_group_mutation(req.device_id, app_type, req.group_name, result, "remove")
+    return {"success": True, "data": result}
+
+
+@app.post("/api/{app_name}/group_members", summary="群管理-获取群成员", tags=[TAG_APP_API])
+async def app_group_members(req: GroupQueryRequest, app_type: str = Depends(_app_type)):
+    _get_client(req.device_id)
+    entry = None if req.refresh else group_cache.get(req.device_id, app_type, req.group_name)
+    if entry is not None:
+        return {"success": True, "data": {
+            "success": True, "message": "获取群成员成功（缓存）", "data": entry.members, "cached": True,
+        }}
+    result = await _fetch_group_members(req.device_id, app_type, req.group_name)
+    return {"success": True, "data": result}
+
+
+@app.post("/api/{app_name}/group_members/sync", summary="群管理-同步为目标成员", tags=[TAG_APP_API])
+async def app_sync_group_members(req: GroupSyncRequest, app_type: str = Depends(_app_type)):
+    """按缓存的当前成员计算最小邀请/移除计划，每类变更最多下发一个设备任务"""
+    return await _sync_group(req, app_type)
+
+
+# ================================================================
+# 任务结果 /api/tasks
+# ================================================================
+
+def _check_task_device(tenant: Tenant, task_id: str) -> None:
+    """任务不属于租户的设备时按不存在处理（任务记录已过期的只对不限设备的租户可见）"""
+    if tenant.devices is None:
+        return
+    record = result_store.get(task_id)
+    if record is None or not tenant.allows(record.device_id):
+        raise HTTPException(status_code=404, detail=f"任务不存在或已过期: {task_id}")
+
+
+@app.get("/api/tasks", summary="最近的任务记录", tags=[TAG_TASKS])
+async def list_tasks(device_id: Optional[str] = None, limit: int = 50, tenant: Tenant = Depends(_tenant)):
+    """最近经网关提交的任务（新的在前，不含结果数据）"""
+    records = result_store.list(device_id=device_id, limit=max(1, min(limit, 1000)), devices=tenant.devices)
+    return {"success": True, "data": [r.to_dict() for r in records], "stats": result_store.stats()}
+
+
+@app.get("/api/tasks/{task_id}", summary="查询任务状态与结果", tags=[TAG_TASKS])
+async def get_task(task_id: str, tenant: Tenant = Depends(_tenant)):
+    """
+    已完成的任务直接由网关返回；未完成的任务距上次向设备查询超过 TASK_POLL_INTERVAL 秒时
+    才再查询一次设备，频繁轮询本接口不会放大到设备
+    """
+    record = result_store.get(task_id)
+    if record is None or not tenant.allows(record.device_id):
+        raise HTTPException(status_code=404, detail=f"任务不存在或已过期: {task_id}")
+    if not record.done and time.time() - record.checked_at >= TASK_POLL_INTERVAL:
+        client = _get_client(record.device_id)
+        await asyncio.get_running_loop().run_in_executor(None, client.get_task_result, task_id)
+    payload = await asyncio.get_running_loop().run_in_executor(None, result_store.load_payload, record)
+    return {"success": True, "data": record.to_dict(payload)}
+
+
+@app.get("/api/tasks/{task_id}/frames", summary="任务画面时间轴", tags=[TAG_TASKS])
+async def get_task_frames(task_id: str, tenant: Tenant = Depends(_tenant)):
+    """
+    录制的任务画面时间轴：每帧的时间（相对录制开始，毫秒）与保存方式（key 关键帧 / delta 增量帧 /
+    repeat 与已保存帧重复）；用 /api/tasks/{task_id}/frames/{index} 取第 index 帧的 PNG。
+    录制中的任务也可查询，recording 为 true
+    """
+    _check_task_device(tenant, task_id)
+    timeline = await asyncio.get_running_loop().run_in_executor(None, screen_recorder.timeline, task_id)
+    if timeline is None:
+        raise HTTPException(status_code=404, detail=f"该任务没有录制画面: {task_id}")
+    record = result_store.get(task_id)
+    timeline["status"] = record.status if record is not None else None
+    return {"success": True, "data": timeline}
+
+
+@app.get("/api/tasks/{task_id}/frames/{index}", summary="任务画面单帧（PNG）", tags=[TAG_TASKS])
+async def get_task_frame(task_id: str, index: int, tenant: Tenant = Depends(_tenant)):
+    """时间轴第 index 帧的 PNG，负数从末尾数（-1 为最后一帧）；按顺序拖动时只需应用一个增量"""
+    _check_task_device(tenant, task_id)
+    try:
+        png = await asyncio.get_running_loop().run_in_executor(None, screen_recorder.frame_png, task_id, index)
+    except IndexError:
+        raise HTTPException(status_code=404, detail=f"帧序号超出时间轴: {index}")
+    if png is None:
+        raise HTTPException(status_code=404, detail=f"该任务没有录制画面: {task_id}")
+    return Response(content=png, media_type="image/png")
+
+
+# ================================================================
+# 联系人索引 /api/contacts
+# ================================================================
+
+@app.get("/api/contacts/search", summary="检索联系人（全设备）", tags=[TAG_CONTACTS])
+async def search_contacts(
+    q: str,
+    app_name: Optional[AppName] = None,
+    device_id: Optional[str] = None,
+    limit: int = 20,
+    tenant: Tenant = Depends(_tenant),
+):
+    """按名称、备注、拼音首字母/全拼检索已采集的联系人，返回认识该联系人的设备（最近确认的在前）"""
+    app_type = _APP_TYPES[app_name.value] if app_name is not None else None
+    results = contact_index.search(
+        q, app_type=app_type, device_id=device_id, limit=max(1, min(limit, 200)), devices=tenant.devices
+    )
+    return {"success": True, "data": results, "count": len(results)}
+
+
+@app.get("/api/contacts/locate", summary="联系人在哪些设备上", tags=[TAG_CONTACTS])
+async def locate_contact(
+    name: str, app_name: AppName, device_ids: Optional[str] = None, tenant: Tenant = Depends(_tenant)
+):
+    """名称完全一致的联系人所在设备，及按负载选择的发送设备（device_ids 逗号分隔，限定候选）"""
+    app_type = _APP_TYPES[app_name.value]
+    allowed = _tenant_devices(tenant, [d for d in device_ids.split(",") if d] if device_ids else None)
+    return {"success": True, "data": {
+        "devices": tenant.visible(contact_index.locate(name, app_type)),
+        "route": _route_device(app_type, name, allowed) or None,
+    }}
+
+
+@app.get("/api/contacts/stats", summary="联系人索引统计", tags=[TAG_CONTACTS])
+async def contact_index_stats(tenant: Tenant = Depends(_tenant)):
+    """限定设备的租户只统计本租户设备的联系人"""
+    return {"success": True, "data": contact_index.stats(devices=_tenant_devices(tenant))}
+
+
+# ================================================================
+# 模板群发 /api/templates  /api/{app_name}/campaigns
+# ================================================================
+
+template_registry = TemplateRegistry(store_path=TEMPLATE_STORE or None)
+
+
+async def _campaign_send(device_id: str, app_type: str, contact: str, message: str, tenant_id: str) -> dict:
+    """
+    群发单条消息：经合并器提交并等待完成，设备端任务队列不会因群发堆积。
+    每条消息计入租户配额：超过速率时等待后再发，今日配额用完时该条失败
+    """
+    tenant = tenants.get(tenant_id) if tenant_id else None
+    while tenant is not None:
+        try:
+            tenants.charge(tenant)
+            break
+        except QuotaExceeded as e:
+            if e.reason != REASON_RATE_LIMITED:
+                return {"success": False, "message": str(e)}
+            await asyncio.sleep(e.retry_after)
+    return await _submit_chat_action(
+        device_id, app_type, contact, {"type": "send", "message": message}, wait=True, tenant=tenant_id
+    )
+
+
+campaign_runner = CampaignRunner(
+    _campaign_send,
+    is_known_device=device_manager.has_device,
+    route=_route_device,
+    queue_size=CAMPAIGN_QUEUE_SIZE,
+    send_interval=CAMPAIGN_SEND_INTERVAL,
+)
+
+
+def _get_template(tenant: Tenant, template_id: str) -> MessageTemplate:
+    template = template_registry.get(template_id)
+    if template is None or not _owned(tenant, template.tenant_id):
+        raise HTTPException(status_code=404, detail=f"模板不存在: {template_id}")
+    return template
+
+
+@app.get("/api/templates", summary="消息模板列表", tags=[TAG_CAMPAIGNS])
+async def list_templates(tenant: Tenant = Depends(_tenant)):
+    return {"success": True, "data": [t.to_dict() for t in template_registry.list() if _owned(tenant, t.tenant_id)]}
+
+
+@app.post("/api/templates", summary="注册消息模板", tags=[TAG_CAMPAIGNS])
+async def create_template(req: TemplateCreateRequest, tenant: Tenant = Depends(_tenant)):
+    """模板注册时编译一次，群发时按行渲染；模板ID已被其他租户使用时返回 409"""
+    existing = template_registry.get(req.template_id) if req.template_id else None
+    if existing is not None and existing.tenant_id != _tenant_id():
+        raise HTTPException(status_code=409, detail=f"模板ID已被其他租户使用: {req.template_id}")
+    try:
+        template = template_registry.register(
+            req.text, name=req.name, template_id=req.template_id, tenant_id=_tenant_id()
         )
-        return {"success": True, "data": result}
+    except TemplateError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"success": True, "data": template.to_dict()}
+
+
+@app.get("/api/templates/{template_id}", summary="查询消息模板", tags=[TAG_CAMPAIGNS])
+async def get_template(template_id: str, tenant: Tenant = Depends(_tenant)):
+    return {"success": True, "data": _get_template(tenant, template_id).to_dict()}
+
+
+@app.delete("/api/templates/{template_id}", summary="删除消息模板", tags=[TAG_CAMPAIGNS])
+async def delete_template(template_id: str, tenant: Tenant = Depends(_tenant)):
+    _get_template(tenant, template_id)
+    template_registry.remove(template_id)
+    return {"success": True}
+
+
+@app.post("/api/templates/{template_id}/preview", summary="预览渲染结果", tags=[TAG_CAMPAIGNS])
+async def preview_template(template_id: str, req: TemplatePreviewRequest, tenant: Tenant = Depends(_tenant)):
+    try:
+        text = _get_template(tenant, template_id).render(req.row)
+    except TemplateError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"success": True, "data": text}
+
+
+@app.post(
+    "/api/{app_name}/campaigns",
+    summary="模板群发（上传 CSV / NDJSON 收件人）",
+    tags=[TAG_CAMPAIGNS],
+    openapi_extra={"requestBody": {"required": True, "content": {
+        "text/csv": {"schema": {"type": "string"}},
+        "application/x-ndjson": {"schema": {"type": "string"}},
+    }}},
+)
+async def create_campaign(
+    request: Request,
+    template_id: str,
+    device_id: Optional[str] = None,
+    format: Optional[Literal["csv", "ndjson"]] = None,
+    app_type: str = Depends(_app_type),
+    tenant: Tenant = Depends(_tenant),
+):
+    """
+    请求体为收件人变量行：CSV（首行为表头）或 NDJSON（每行一个 JSON 对象），需含 contact 列，
+    可选 device_id 列（否则使用查询参数 device_id，均未指定时按联系人索引选择设备），其余列为模板变量。
+    请求体流式写入暂存文件后立即返回，发送在后台进行，进度见 /api/campaigns/{campaign_id}。
+    """
+    template = _get_template(tenant, template_id)
+    if device_id is not None:
+        _get_client(device_id)
+    content_type = request.headers.get("content-type", "")
+    fmt = format or ("ndjson" if "ndjson" in content_type or "json" in content_type else "csv")
+    if fmt not in ROW_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format 须为 {ROW_FORMATS} 之一")
+
+    os.makedirs(CAMPAIGN_SPOOL_DIR, exist_ok=True)
+    path = os.path.join(CAMPAIGN_SPOOL_DIR, f"{uuid.uuid4().hex}.{fmt}")
+    try:
+        size = await spool_upload(request.stream(), path, CAMPAIGN_MAX_UPLOAD_MB * 1024 * 1024)
+    except ValueError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    if fmt == "csv":
+        header = read_csv_header(path)
+        missing = [c for c in ["contact"] + template.required if c not in header]
+        if missing:
+            os.remove(path)
+            raise HTTPException(status_code=400, detail=f"CSV 缺少列: {', '.join(missing)}")
+
+    campaign = campaign_runner.start(Campaign(
+        campaign_id="",
+        template_id=template_id,
+        app_type=app_type,
+        device_id=device_id or "",
+        fmt=fmt,
+        path=path,
+        tenant_id=_tenant_id(),
+        allowed_devices=tenant.devices,
+    ), template)
+    logger.info(f"群发已开始: {campaign.campaign_id} 模板={template_id} 上传 {size} 字节")
+    return {"success": True, "data": campaign.to_dict()}
+
+
+@app.get("/api/campaigns", summary="群发列表", tags=[TAG_CAMPAIGNS])
+async def list_campaigns(tenant: Tenant = Depends(_tenant)):
+    return {"success": True, "data": [c.to_dict() for c in campaign_runner.list() if _owned(tenant, c.tenant_id)]}
+
+
+def _get_campaign(tenant: Tenant, campaign_id: str) -> Campaign:
+    campaign = campaign_runner.get(campaign_id)
+    if campaign is None or not _owned(tenant, campaign.tenant_id):
+        raise HTTPException(status_code=404, detail=f"群发不存在: {campaign_id}")
+    return campaign
+
+
+@app.get("/api/campaigns/{campaign_id}", summary="群发进度", tags=[TAG_CAMPAIGNS])
+async def get_campaign(campaign_id: str, tenant: Tenant = Depends(_tenant)):
+    return {"success": True, "data": _get_campaign(tenant, campaign_id).to_dict()}
+
+
+@app.post("/api/campaigns/{campaign_id}/cancel", summary="取消群发", tags=[TAG_CAMPAIGNS])
+async def cancel_campaign(campaign_id: str, tenant: Tenant = Depends(_tenant)):
+    """停止读取收件人并清空发送队列；已提交到设备的消息不受影响"""
+    _get_campaign(tenant, campaign_id)
+    if not campaign_runner.cancel(campaign_id):
+        raise HTTPException(status_code=404, detail=f"群发不存在或已结束: {campaign_id}")
+    return {"success": True}
+
+
+# ================================================================
+# 定时任务 /api/jobs
+# ================================================================
 
-    @app.post(f"/api/{prefix}/invite_to_group", summary="群管理-邀请入群", tags=[tag])
-    async def _invite_to_group(req: GroupMemberRequest):
-        result = _get_client(req.device_id).invite_to_group(
-            req.group_name, req.members, wait=False, app_type=app_type
+# 定时任务操作 -> 参数校验模型（与对应接口请求体一致）
+_JOB_REQUEST_MODELS: dict[str, type[BaseModel]] = {
+    "send_message": SendMessageRequest,
+    "read_messages": ReadMessagesRequest,
+    "invite_to_group": GroupMemberRequest,
+    "remove_from_group": GroupMemberRequest,
+    "group_members": GroupQueryRequest,
+    "group_sync": GroupSyncRequest,
+}
+# 由任务本身决定的字段，不能出现在 params 中
+_JOB_RESERVED_PARAMS = {"device_id", "idempotency_key"}
+
+
+async def _run_job(job: Job) -> dict:
+    """执行一次定时任务（按任务所属租户计费与排队），结果结构与对应接口的 data 相同"""
+    tenant = tenants.get(job.tenant_id) if job.tenant_id else tenants.admin
+    if tenant is None:
+        return {"success": False, "message": f"租户不存在: {job.tenant_id}"}
+    try:
+        tenants.charge(tenant)
+    except QuotaExceeded as e:
+        return {"success": False, "message": str(e)}
+    token = _current_tenant.set(tenant)
+    try:
+        return await _execute_job(job)
+    finally:
+        _current_tenant.reset(token)
+
+
+async def _execute_job(job: Job) -> dict:
+    req = _JOB_REQUEST_MODELS[job.action](device_id=job.device_id, **job.params)
+    if job.action == "send_message":
+        return await _submit_chat_action(
+            job.device_id, job.app_type, req.contact, {"type": "send", "message": req.message}, wait=False
         )
-        return {"success": True, "data": result}
+    if job.action == "read_messages":
+        return await _submit_chat_action(
+            job.device_id, job.app_type, req.contact, {"type": "read", "count": req.count}, wait=True
+        )
+    if job.action == "group_members":
+        return await _fetch_group_members(job.device_id, job.app_type, req.group_name)
+    if job.action == "group_sync":
+        return await _sync_group(req, job.app_type)
+
+    client = _get_client(job.device_id)
+    method = client.invite_to_group if job.action == "invite_to_group" else client.remove_from_group
+    result = await _submit_limited(
+        job.device_id, job.action, lambda: method(req.group_name, req.members, wait=False, app_type=job.app_type)
+    )
+    _track_group_mutation(job.device_id, job.app_type, req.group_name, result, job.action.split("_")[0])
+    return result
+
+
+scheduler = Scheduler(
+    _run_job,
+    store_path=SCHEDULER_STORE or None,
+    missed_grace=SCHEDULER_MISSED_GRACE,
+    default_spread=SCHEDULER_SPREAD_SECONDS,
+    finished_retention=SCHEDULER_FINISHED_RETENTION,
+)
+
+
+def _get_job(tenant: Tenant, job_id: str) -> Job:
+    job = scheduler.get(job_id)
+    if job is None or not _owned(tenant, job.tenant_id):
+        raise HTTPException(status_code=404, detail=f"定时任务不存在: {job_id}")
+    return job
+
+
+@app.get("/api/jobs", summary="定时任务列表", tags=[TAG_JOBS])
+async def list_jobs(tenant: Tenant = Depends(_tenant)):
+    jobs = [j.to_dict() for j in scheduler.list() if _owned(tenant, j.tenant_id)]
+    return {"success": True, "data": jobs, "count": len(jobs)}
+
+
+@app.post("/api/jobs", summary="创建定时任务", tags=[TAG_JOBS])
+async def create_job(req: JobCreateRequest):
+    """cron（周期）、run_at（指定时间）、delay_seconds（延时）三选一"""
+    _get_client(req.device_id)
+    if req.app_type not in {a for _, a, _ in APPS}:
+        raise HTTPException(status_code=400, detail=f"不支持的应用: {req.app_type}")
+    if sum(x is not None for x in (req.cron, req.run_at, req.delay_seconds)) != 1:
+        raise HTTPException(status_code=400, detail="cron、run_at、delay_seconds 须且只能指定一个")
+    model = _JOB_REQUEST_MODELS[req.action]
+    unknown = sorted(set(req.params) - (set(model.model_fields) - _JOB_RESERVED_PARAMS))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"params 不支持的字段: {', '.join(unknown)}")
+    try:
+        model(device_id=req.device_id, **req.params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"params 校验失败: {e}")
+    run_at = time.time() + req.delay_seconds if req.delay_seconds is not None else req.run_at
+    try:
+        job = scheduler.add(Job(
+            job_id="",
+            device_id=req.device_id,
+            app_type=req.app_type,
+            action=req.action,
+            params=req.params,
+            cron=req.cron,
+            run_at=run_at,
+            name=req.name,
+            missed_policy=req.missed_policy,
+            spread_seconds=req.spread_seconds,
+            tenant_id=_tenant_id(),
+        ))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"success": True, "data": job.to_dict()}
+
+
+@app.get("/api/jobs/{job_id}", summary="查询定时任务", tags=[TAG_JOBS])
+async def get_job(job_id: str, tenant: Tenant = Depends(_tenant)):
+    return {"success": True, "data": _get_job(tenant, job_id).to_dict()}
+
+
+@app.delete("/api/jobs/{job_id}", summary="删除定时任务", tags=[TAG_JOBS])
+async def delete_job(job_id: str, tenant: Tenant = Depends(_tenant)):
+    _get_job(tenant, job_id)
+    scheduler.remove(job_id)
+    return {"success": True}
+
+
+@app.post("/api/jobs/{job_id}/run", summary="立即执行一次", tags=[TAG_JOBS])
+async def run_job_now(job_id: str, tenant: Tenant = Depends(_tenant)):
+    _get_job(tenant, job_id)
+    result = await scheduler.run_now(job_id)
+    return {"success": True, "data": result}
+
+
+# ================================================================
+# 事件推送 /api/webhooks
+# ================================================================
 
-    @app.post(f"/api/{prefix}/remove_from_group", summary="群管理-移除成员", tags=[tag])
-    async def _remove_from_group(req: GroupMemberRequest):
-        result = _get_client(req.device_id).remove_from_group(
-            req.group_name, req.members, wait=False, app_type=app_type
+def _poll_pending_tasks(device_id: str, records: list[TaskRecord]) -> None:
+    """按提交顺序查询设备上未完成的任务，遇到仍在执行的即停止（设备端串行执行，之后的任务也未完成）"""
+    client = device_manager.get_device(device_id)
+    now = time.time()
+    for record in records:
+        if now - record.submitted_at > EVENT_TASK_WATCH_SECONDS:
+            result_store.forget_pending(record.task_id)
+            event_bus.publish(EVENT_TASK_TIMEOUT, record.to_dict(), device_id=device_id)
+            continue
+        if now - record.checked_at < TASK_POLL_INTERVAL:
+            return      # 刚被查询过（有请求在等待结果或容量模型在轮询），本轮不重复查询
+        client.get_task_result(record.task_id)
+        if not record.done:
+            return
+
+
+async def _task_event_loop() -> None:
+    """有任务完成/新消息订阅时在后台查询未完成的任务，无人等待结果的任务也能推送完成事件"""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(TASK_POLL_INTERVAL)
+        if not any(event_bus.wants(t) for t in (EVENT_TASK_COMPLETED, EVENT_TASK_TIMEOUT, EVENT_MESSAGE_RECEIVED)):
+            continue
+        pending = {d: records for d, records in result_store.pending().items() if device_manager.has_device(d)}
+        results = await asyncio.gather(
+            *(loop.run_in_executor(None, _poll_pending_tasks, d, records) for d, records in pending.items()),
+            return_exceptions=True,
         )
-        return {"success": True, "data": result}
+        for device_id, result in zip(pending, results):
+            if isinstance(result, Exception):
+                logger.warning(f"查询未完成任务失败: {device_id} - {result}")
+
+
+def _probe_device(device_id: str) -> bool:
+    client = device_manager.get_device(device_id)
+    return client is not None and client.is_ready()
+
+
+async def _device_event_loop() -> None:
+    """有设备上线/离线订阅时定期探测各设备，状态变化时发布事件（首次探测只记录状态）"""
+    loop = asyncio.get_running_loop()
+    online: dict[str, bool] = {}
+    while EVENT_DEVICE_PROBE_INTERVAL > 0:
+        await asyncio.sleep(EVENT_DEVICE_PROBE_INTERVAL)
+        if not (event_bus.wants(EVENT_DEVICE_ONLINE) or event_bus.wants(EVENT_DEVICE_OFFLINE)):
+            online.clear()
+            continue
+        device_ids = list(DEVICES)
+        states = await asyncio.gather(*(loop.run_in_executor(None, _probe_device, d) for d in device_ids))
+        for device_id, ready in zip(device_ids, states):
+            previous = online.get(device_id)
+            online[device_id] = ready
+            if previous is None or previous == ready:
+                continue
+            logger.info(f"设备{'上线' if ready else '离线'}: {device_id}")
+            event_bus.publish(
+                EVENT_DEVICE_ONLINE if ready else EVENT_DEVICE_OFFLINE,
+                {"device_id": device_id, "name": DEVICES[device_id].get("name", device_id)},
+                device_id=device_id,
+            )
+
+
+def _get_subscription(tenant: Tenant, subscription_id: str):
+    subscription = event_bus.get(subscription_id)
+    if subscription is None or not _owned(tenant, subscription.tenant_id):
+        raise HTTPException(status_code=404, detail=f"订阅不存在: {subscription_id}")
+    return subscription
+
+
+def _subscription_dict(subscription) -> dict:
+    return {**subscription.to_dict(), "delivery": event_bus.stats(subscription.subscription_id).get(subscription.subscription_id)}
+
 
-    @app.post(f"/api/{prefix}/group_members", summary="群管理-获取群成员", tags=[tag])
-    async def _group_members(req: GroupQueryRequest):
-        result = _get_client(req.device_id).get_group_members(
-            req.group_name, wait=False, app_type=app_type
+@app.get("/api/webhooks", summary="Webhook 订阅列表", tags=[TAG_WEBHOOKS])
+async def list_webhooks(tenant: Tenant = Depends(_tenant)):
+    """各订阅及其推送状态：积压、已送达、丢弃、连续失败次数、下次重试时间"""
+    return {
+        "success": True,
+        "data": [_subscription_dict(s) for s in event_bus.list() if _owned(tenant, s.tenant_id)],
+        "event_types": list(EVENT_TYPES),
+        "published": event_bus.published,
+    }
+
+
+@app.post("/api/webhooks", summary="新增 Webhook 订阅", tags=[TAG_WEBHOOKS])
+async def create_webhook(req: WebhookCreateRequest, tenant: Tenant = Depends(_tenant)):
+    """
+    事件批量 POST 到 url；对端返回非 2xx 或不可达时按指数退避重试，未送达的事件保存在发件箱。
+    限定设备的租户不指定 device_ids 时只订阅本租户设备的事件
+    """
+    unknown = [d for d in req.device_ids if not device_manager.has_device(d)]
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"设备不存在: {', '.join(unknown)}")
+    device_ids = _tenant_devices(tenant, req.device_ids)
+    try:
+        subscription = event_bus.subscribe(
+            req.url, req.events, device_ids, req.secret, req.description, tenant_id=_tenant_id()
         )
-        return {"success": True, "data": result}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"success": True, "data": _subscription_dict(subscription)}
+
+
+@app.get("/api/webhooks/{subscription_id}", summary="查询 Webhook 订阅", tags=[TAG_WEBHOOKS])
+async def get_webhook(subscription_id: str, tenant: Tenant = Depends(_tenant)):
+    return {"success": True, "data": _subscription_dict(_get_subscription(tenant, subscription_id))}
+
+
+@app.delete("/api/webhooks/{subscription_id}", summary="删除 Webhook 订阅", tags=[TAG_WEBHOOKS])
+async def delete_webhook(subscription_id: str, tenant: Tenant = Depends(_tenant)):
+    """同时删除该订阅发件箱中未送达的事件"""
+    _get_subscription(tenant, subscription_id)
+    event_bus.unsubscribe(subscription_id)
+    return {"success": True}
+
+
+@app.post("/api/webhooks/{subscription_id}/test", summary="发送测试事件", tags=[TAG_WEBHOOKS])
+async def test_webhook(subscription_id: str, tenant: Tenant = Depends(_tenant)):
+    """向该订阅发送一个 webhook.ping 事件（与其它事件一起攒批推送），用于验证地址与签名"""
+    _get_subscription(tenant, subscription_id)
+    event = event_bus.publish(EVENT_PING, {"message": "ping"}, subscription_id=subscription_id)
+    return {"success": True, "data": event}
+
+
+# ================================================================
+# 租户 /api/tenants
+# ================================================================
 
+def _tenant_usage(tenant_id: str) -> dict:
+    return {**tenants.usage(tenant_id), "admission": admission.tenant_stats(tenant_id)}
 
-for _prefix, _app_type, _label in APPS:
-    _register_app_routes(_prefix, _app_type, _label)
+
+@app.get("/api/tenants/me", summary="当前租户", tags=[TAG_TENANTS])
+async def get_current_tenant(tenant: Tenant = Depends(_tenant)):
+    """当前 API Key 对应的租户：可访问的设备、权重与配额，以及用量"""
+    return {"success": True, "data": {
+        **tenant.to_dict(), "enabled": tenants.enabled, "usage": _tenant_usage(tenant.tenant_id),
+    }}
+
+
+@app.get("/api/tenants/usage", summary="租户用量", tags=[TAG_TENANTS])
+async def list_tenant_usage(tenant: Tenant = Depends(_tenant)):
+    """
+    各租户今日与累计操作数、剩余配额、按优先级的请求数、响应状态、被拒绝次数（限速、配额、
+    无权访问、准入控制）、平均耗时，以及在准入队列中的处理中/排队数与平均排队时间。
+    管理员可见全部租户，其他租户只能看到自己
+    """
+    ids = [t.tenant_id for t in tenants.list()] if tenant.admin else [tenant.tenant_id]
+    return {"success": True, "data": [_tenant_usage(tenant_id) for tenant_id in ids]}
 
 
 # ================================================================
@@ -209,8 +1570,18 @@ for _prefix, _app_type, _label in APPS:
 # ================================================================
 
 @app.post("/api/broadcast", summary="广播消息（多设备）", tags=[TAG_BROADCAST])
-async def broadcast_message(req: BroadcastRequest):
-    results = device_manager.broadcast_message(req.contact, req.message)
+async def broadcast_message(req: BroadcastRequest, tenant: Tenant = Depends(_tenant)):
+    """向所有在线设备（限定设备的租户为本租户的在线设备）广播，各设备经合并器与容量控制器下发"""
+    online = await asyncio.get_running_loop().run_in_executor(None, device_manager.get_online_devices)
+    device_ids = tenant.visible(online)
+    submitted = await asyncio.gather(*(
+        _submit_chat_action(d, "wework", req.contact, {"type": "send", "message": req.message}, wait=False)
+        for d in device_ids
+    ), return_exceptions=True)
+    results = {
+        d: {"success": False, "message": str(r)} if isinstance(r, Exception) else r
+        for d, r in zip(device_ids, submitted)
+    }
     return {"success": True, "data": results, "device_count": len(results)}
 
 
@@ -234,25 +1605,13 @@ async def device_screen(device_id: str):
             detail=f"ADB_PATH 指向的文件不存在: {adb}，请检查 config 中的 ADB_PATH 是否为本机 adb 实际路径。"
         )
     serial = (DEVICES[device_id].get("adb_serial") or "").strip()
-    cmd_with_serial = [adb, "-s", serial, "exec-out", "screencap", "-p"] if serial else None
-    cmd_default = [adb, "exec-out", "screencap", "-p"]
-
-    def run_screencap(cmd):
-        out = subprocess.run(cmd, capture_output=True, timeout=10)
-        err = out.stderr.decode(errors="ignore") if out.stderr else ""
-        return out.returncode, out.stdout, err
-
     try:
-        cmd = cmd_with_serial if cmd_with_serial else cmd_default
-        returncode, stdout, stderr = run_screencap(cmd)
-        if (returncode != 0 or not stdout) and cmd_with_serial and "not found" in stderr.lower():
-            returncode, stdout, stderr = run_screencap(cmd_default)
-        if returncode != 0 or not stdout:
-            raise HTTPException(
-                status_code=503,
-                detail=f"ADB 截屏失败: {stderr or '无输出'}。请确认手机已 USB 连接并开启调试，或在本机执行 adb devices 核对设备。"
-            )
-        return Response(content=stdout, media_type="image/png")
+        return Response(content=screencap(adb, serial, png=True), media_type="image/png")
+    except RuntimeError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"ADB 截屏失败: {e}。请确认手机已 USB 连接并开启调试，或在本机执行 adb devices 核对设备。"
+        )
     except FileNotFoundError:
         raise HTTPException(status_code=503, detail="未找到 adb，请配置 config.ADB_PATH 或确保 adb 在 PATH 中")
     except subprocess.TimeoutExpired:
@@ -261,6 +1620,55 @@ async def device_screen(device_id: str):
         raise HTTPException(status_code=503, detail=str(e))
 
 
+def _require_profiling() -> None:
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="性能剖析未开启，请设置 config.PROFILING_ENABLED = True")
+
+
+@app.get("/debug/loop", summary="事件循环延迟与慢回调", tags=[TAG_BROADCAST], dependencies=[Depends(_require_admin)])
+async def debug_loop():
+    """事件循环调度延迟统计，以及最近被阻塞时抓取的事件循环线程调用栈"""
+    _require_profiling()
+    return {"success": True, "data": loop_monitor.stats()}
+
+
+@app.get("/debug/routes", summary="按路由耗时统计", tags=[TAG_BROADCAST], dependencies=[Depends(_require_admin)])
+async def debug_routes(reset: bool = False):
+    """各路由请求次数、墙钟/CPU 耗时，按总耗时降序；reset=true 时返回后清零"""
+    _require_profiling()
+    data = route_stats.snapshot()
+    if reset:
+        route_stats.reset()
+    return {"success": True, "data": data}
+
+
+@app.get("/debug/profile", summary="采样剖析（火焰图）", tags=[TAG_BROADCAST], response_class=PlainTextResponse, dependencies=[Depends(_require_admin)])
+async def debug_profile(seconds: float = 10, interval_ms: float = 5):
+    """
+    在 seconds 秒内按 interval_ms 间隔采样所有线程调用栈，返回 collapsed stack 文本，
+    可直接交给 flamegraph.pl 或 speedscope 生成火焰图。采样在线程池中进行，不阻塞事件循环。
+    """
+    _require_profiling()
+    if not 0 < seconds <= PROFILING_MAX_SECONDS:
+        raise HTTPException(status_code=422, detail=f"seconds 须在 (0, {PROFILING_MAX_SECONDS}] 之间")
+    if stack_sampler.busy:
+        raise HTTPException(status_code=409, detail="已有采样正在进行")
+    loop = asyncio.get_running_loop()
+    try:
+        counts = await loop.run_in_executor(
+            None, stack_sampler.sample, seconds, max(1.0, interval_ms) / 1000,
+        )
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(stack_sampler.collapsed(counts))
+
+
+@app.get("/api/admission", summary="准入控制状态", tags=[TAG_BROADCAST], dependencies=[Depends(_require_admin)])
+async def admission_stats():
+    """处理中/排队的请求数、各设备队列深度、按优先级的接纳/排队/拒绝次数与平均排队时间"""
+    return {"success": True, "data": {"enabled": ADMISSION_ENABLED, **admission.stats()}}
+
+
 @app.get("/api/health", summary="健康检查", tags=[TAG_BROADCAST])
 async def health_check():
     return {"status": "ok", "version": "2.0.0"}
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+响应编码：msgpack 内容协商 + gzip/br 压缩
+
+联系人列表、群成员、控件树等响应体积较大，网关按请求头选择编码：
+    - Accept: application/msgpack  → 以 msgpack 二进制返回（需安装 msgpack）
+    - Accept-Encoding: br / gzip   → 超过 COMPRESS_MIN_SIZE 的响应压缩后返回
+      （br 需安装 brotli，否则回退 gzip）
+
+msgpack 在 EncodedResponse.render() 中直接由路由返回值编码，不经过 JSON 中转；
+压缩由 encoding_middleware 统一处理，图片等非文本响应不压缩。
+"""
+import gzip
+import json
+from contextvars import ContextVar
+
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+
+try:
+    import msgpack
+except ImportError:  # 可选依赖
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:  # 可选依赖
+    brotli = None
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+_COMPRESSIBLE_TYPES = ("application/json", MSGPACK_MEDIA_TYPE, "text/")
+
+# 当前请求是否要求 msgpack（由中间件设置，EncodedResponse 渲染时读取）
+_want_msgpack: ContextVar[bool] = ContextVar("want_msgpack", default=False)
+
+
+class EncodedResponse(JSONResponse):
+    """默认响应类：客户端 Accept msgpack 时输出 msgpack，否则输出 JSON"""
+
+    def render(self, content) -> bytes:
+        if msgpack is not None and _want_msgpack.get():
+            self.media_type = MSGPACK_MEDIA_TYPE
+            return msgpack.packb(content, use_bin_type=True)
+        return super().render(content)
+
+
+def decode_body(content: bytes, content_type: str):
+    """按 Content-Type 解码未压缩的 JSON / msgpack 响应体，其他类型或解码失败返回 None"""
+    try:
+        if MSGPACK_MEDIA_TYPE in content_type and msgpack is not None:
+            return msgpack.unpackb(content, raw=False)
+        if "application/json" in content_type:
+            return json.loads(content)
+    except (ValueError, TypeError):
+        return None
+    return None
+
+
+def _choose_encoding(accept_encoding: str) -> str:
+    accepted = {part.split(";")[0].strip().lower() for part in accept_encoding.split(",")}
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return ""
+
+
+def make_encoding_middleware(min_size: int = 1024):
+    """
+    创建响应编码中间件
+
+    Args:
+        min_size: 响应体不小于该字节数时才压缩
+    """
+
+    async def encoding_middleware(request: Request, call_next):
+        accept = request.headers.get("accept", "").lower()
+        token = _want_msgpack.set(MSGPACK_MEDIA_TYPE in accept or "application/x-msgpack" in accept)
+        try:
+            response = await call_next(request)
+        finally:
+            _want_msgpack.reset(token)
+
+        encoding = _choose_encoding(request.headers.get("accept-encoding", ""))
+        content_type = response.headers.get("content-type", "")
+        if (
+            not encoding
+            or "content-encoding" in response.headers
+            or not any(t in content_type for t in _COMPRESSIBLE_TYPES)
+        ):
+            return response
+
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        headers = {k: v for k, v in response.headers.items() if k.lower() != "content-length"}
+        if len(body) >= min_size:
+            body = brotli.compress(body, quality=4) if encoding == "br" else gzip.compress(body, compresslevel=5)
+            headers["content-encoding"] = encoding
+            headers["vary"] = "Accept-Encoding"
+        return Response(content=body, status_code=response.status_code, headers=headers)
+
+    return encoding_middleware
@@ -27,12 +27,125 @@ DEVICES = {
     # },
 }
 
+# 设备客户端空闲回收（秒）：客户端在首次请求设备时创建，超过该时长未使用则关闭连接池；0 表示不回收
+DEVICE_CLIENT_IDLE_TIMEOUT = 600
+
+# 设备交互录制/回放：record 照常访问设备并把每次交互及耗时写入文件；replay 不访问设备，
+# 按文件回放响应（模拟设备任务队列），用于无手机时测量网关吞吐与延迟；留空为正常模式
+DEVICE_TRANSPORT = ""
+DEVICE_TRANSPORT_FILE = "device_exchanges.jsonl"
+DEVICE_REPLAY_LATENCY_SCALE = 1.0     # 回放耗时缩放：1 为原始耗时，0 为不等待
+
 # 任务轮询间隔（秒）
 TASK_POLL_INTERVAL = 2
 
 # 任务超时时间（秒）
 TASK_TIMEOUT = 60
 
+# 网关任务结果存储：经网关提交的任务结果保存在网关，已完成任务的查询不再访问设备
+RESULT_STORE_MAX_PER_DEVICE = 1000          # 每台设备最多保留的任务记录数
+RESULT_STORE_TTL = 24 * 3600                # 记录有效期（秒）
+RESULT_STORE_SPILL_DIR = "task_results"     # 大结果落盘目录，留空则全部保存在内存
+RESULT_STORE_SPILL_BYTES = 64 * 1024        # 结果序列化后超过该字节数时落盘
+
+# 设备容量自动调速：按设备、操作学习服务时间，以 AIMD 调整每台设备的在途任务窗口与下发节奏
+CAPACITY_AUTOTUNE = True          # False 时只学习模型、不限制下发
+CAPACITY_INITIAL_WINDOW = 2       # 初始在途任务窗口
+CAPACITY_MAX_WINDOW = 4           # 在途任务窗口上限（设备端串行执行，过大只会增加排队）
+CAPACITY_DEGRADE_RATIO = 2.0      # 服务时间超过基线该倍数时告警并减小窗口
+CAPACITY_STATUS_INTERVAL = 10     # 检查设备队列积压（task_queue_size）的间隔（秒）
+
+# 准入控制：突发流量时限制网关同时处理的请求数与每台设备的队列深度，超出时快速返回 429（带 Retry-After）；
+# 健康检查、设备状态、任务查询等只读接口不受限制
+ADMISSION_ENABLED = True
+ADMISSION_MAX_CONCURRENT = 32         # 同时处理的请求数（含等待设备完成的请求）
+ADMISSION_MAX_QUEUE = 200             # 排队等待的请求数上限，超出直接返回 429
+ADMISSION_MAX_PER_DEVICE = 10         # 每台设备的队列深度上限（网关中该设备的请求 + 设备上未完成的任务）；0 表示不限制
+ADMISSION_QUEUE_TIMEOUT = 5           # 发消息、群管理等交互请求的排队时限（秒），超过即丢弃
+ADMISSION_BULK_QUEUE_TIMEOUT = 30     # 广播、群发、立即执行定时任务等批量请求的排队时限（秒）
+ADMISSION_BULK_SHARE = 0.5            # 批量请求最多占用的排队比例，过载时先拒绝批量请求
+
+# 多租户：按 API Key（请求头 X-API-Key 或 Authorization: Bearer）识别租户，租户只能访问分配给自己的设备；
+# 准入队列与设备下发队列按租户权重公平排队，并按租户限制并发、速率与每日操作数；为空则不启用（不校验 API Key）
+TENANTS = {
+    # "team_a": {
+    #     "name": "销售一组",
+    #     "api_key": "change-me",
+    #     "devices": ["device_1"],      # "*" 为全部设备
+    #     "weight": 2,                  # 公平排队权重，繁忙时按权重比例分享处理能力
+    #     "max_concurrent": 8,          # 同时处理的请求数，0 不限制
+    #     "max_queue": 50,              # 排队等待的请求数，0 不限制
+    #     "rate_per_minute": 120,       # 每分钟操作数（有副作用的请求与群发的每条消息），0 不限制
+    #     "daily_quota": 5000,          # 每日操作数，本地时间零点重置，0 不限制
+    # },
+}
+TENANT_ADMIN_KEY = ""                     # 管理员 API Key：访问全部设备与管理接口，不受配额限制
+TENANT_USAGE_STORE = "tenant_usage.json"  # 租户用量持久化文件（重启后当日配额延续），留空则不持久化
+
+# 聊天会话合并窗口（秒）：同一设备上连续提交的、针对同一聊天的操作
+# 在窗口内合并为一个设备端会话任务，只导航一次；0 表示不合并
+SESSION_MERGE_WINDOW = 0.3
+
+# 单个合并会话最多包含的动作数，达到后立即下发
+SESSION_MAX_ACTIONS = 20
+
+# 群成员缓存有效期（秒）：邀请/移除成功后直接更新缓存，过期后重新从设备采集；0 表示不缓存
+GROUP_CACHE_TTL = 600
+
+# 全设备联系人索引：合并各设备采集的联系人列表，按名称/备注/拼音首字母检索并选择发送设备
+CONTACT_INDEX_STORE = "contact_index.json"    # 索引持久化文件，留空则不持久化
+CONTACT_INDEX_REFRESH_INTERVAL = 6 * 3600     # 已采集过的设备超过该秒数后在后台重新采集（逐台进行）；0 表示不自动刷新
+
+# 幂等键：有副作用的接口（发消息、建群、群管理、广播等）携带 Idempotency-Key 重试时返回首次结果
+IDEMPOTENCY_TTL = 24 * 3600     # 幂等键有效期（秒）
+IDEMPOTENCY_MAX_KEYS = 10000    # 最多保留的幂等键数量
+
+# 响应压缩：不小于该字节数的 JSON/msgpack 响应按 Accept-Encoding 以 br 或 gzip 压缩
+COMPRESS_MIN_SIZE = 1024
+
+# 事件推送（Webhook）：任务提交/完成、设备上线/离线、新消息等事件按订阅批量推送到对方地址，
+# 失败按指数退避重试，未送达的事件保存在发件箱中，重启后继续推送
+WEBHOOK_STORE = "webhooks.json"             # 订阅持久化文件，留空则不持久化
+WEBHOOK_OUTBOX_DIR = "webhook_outbox"       # 发件箱目录（每个订阅一个子目录），留空则只保存在内存
+WEBHOOK_BATCH_SIZE = 100                    # 每次推送最多的事件数
+WEBHOOK_BATCH_INTERVAL = 1.0                # 攒批等待（秒）：首个事件到达后最多等待该时长再推送
+WEBHOOK_TIMEOUT = 10                        # 推送请求超时（秒）
+WEBHOOK_RETRY_MAX_SECONDS = 300             # 推送失败后重试间隔的上限（秒）
+WEBHOOK_MAX_OUTBOX = 100000                 # 每个订阅最多积压的事件数，超出时丢弃最早的
+EVENT_DEVICE_PROBE_INTERVAL = 60            # 有设备上线/离线订阅时探测设备状态的间隔（秒）；0 表示不探测
+EVENT_TASK_WATCH_SECONDS = 600              # 有任务完成订阅时，网关在后台跟踪未完成任务的最长时间（秒），超过后发布 task.timeout
+
+# 定时任务调度
+SCHEDULER_STORE = "scheduled_jobs.json"   # 任务持久化文件，留空则不持久化
+SCHEDULER_SPREAD_SECONDS = 120            # 周期任务启动时间打散窗口（秒），按 (设备, 任务) 固定偏移
+SCHEDULER_MISSED_GRACE = 60               # 晚于计划时间超过该秒数视为错过执行
+SCHEDULER_FINISHED_RETENTION = 24 * 3600  # 一次性任务执行（或错过）后保留该秒数供查询结果，之后删除
+
+# 模板群发
+TEMPLATE_STORE = "message_templates.json"   # 消息模板持久化文件，留空则不持久化
+CAMPAIGN_SPOOL_DIR = "campaigns"            # 上传的收件人文件暂存目录（群发结束后删除）
+CAMPAIGN_MAX_UPLOAD_MB = 200                # 单次上传上限（MB）
+CAMPAIGN_QUEUE_SIZE = 100                   # 每台设备在内存中保留的待发送消息数，超出部分写入该设备的溢出文件
+CAMPAIGN_SEND_INTERVAL = 1.0                # 同一设备相邻两条群发消息的间隔（秒）
+
+# 性能剖析（/debug/*）：事件循环延迟与慢回调监控、按路由耗时统计、按需采样剖析
+# 开销很低，可在生产环境开启；关闭时 /debug/* 接口返回 404
+PROFILING_ENABLED = False
+PROFILING_LOOP_INTERVAL = 0.5       # 事件循环心跳间隔（秒）
+PROFILING_SLOW_THRESHOLD = 0.2      # 事件循环被阻塞超过该秒数时记录调用栈
+PROFILING_MAX_SECONDS = 60          # 单次采样剖析最长时长（秒）
+
+# 任务画面录制（调试，需 ADB）：任务执行期间经 adb 连续截屏，按感知哈希去重、分块增量写入
+# 每个任务一个段文件，可用 /api/tasks/{task_id}/frames 按时间轴回看
+SCREEN_CAPTURE_ENABLED = False          # 所有设备开启；也可用 POST /api/devices/{device_id}/capture 按设备开启
+SCREEN_CAPTURE_DIR = "screen_frames"    # 段文件目录
+SCREEN_CAPTURE_INTERVAL = 0.5           # 相邻两次截屏的最小间隔（秒），实际还受截屏耗时限制
+SCREEN_CAPTURE_SCALE = 2                # 保存时缩小的倍数（1 为原始分辨率）
+SCREEN_CAPTURE_DEDUP_DISTANCE = 2       # 感知哈希（256 位）距离不超过该值的帧只记录引用
+SCREEN_CAPTURE_KEYFRAME_INTERVAL = 30   # 每保存多少帧插入一个完整关键帧
+SCREEN_CAPTURE_MAX_SECONDS = 120        # 单个任务最长录制时间（秒）
+SCREEN_CAPTURE_MAX_MB = 500             # 段文件总大小上限（MB），超出时删除最早的段
+
 # 服务端API端口
 SERVER_PORT = 8080
 
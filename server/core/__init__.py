@@ -1,5 +1,54 @@
 # -*- coding: utf-8 -*-
+from .admission import AdmissionController, AdmissionRejected
+from .campaign import Campaign, CampaignRunner
+from .capacity import CapacityController
+from .contact_index import ContactIndex
 from .device_client import DeviceClient
 from .device_manager import DeviceManager
+from .events import EventBus, MessageTracker, Subscription
+from .group_cache import GroupCache
+from .idempotency import IdempotencyConflict, IdempotencyStore
+from .pipeline import PipelineTask, TaskPipeline
+from .profiling import LoopMonitor, RouteStats, StackSampler
+from .result_store import ResultStore, TaskRecord
+from .results import TaskResult
+from .scheduler import Job, Scheduler
+from .screen_capture import ScreenRecorder
+from .session_batcher import SessionBatcher
+from .templates import MessageTemplate, TemplateError, TemplateRegistry
+from .tenants import QuotaExceeded, Tenant, TenantRegistry
 
-__all__ = ["DeviceClient", "DeviceManager"]
+__all__ = [
+    "AdmissionController",
+    "AdmissionRejected",
+    "Campaign",
+    "CampaignRunner",
+    "CapacityController",
+    "ContactIndex",
+    "DeviceClient",
+    "DeviceManager",
+    "EventBus",
+    "GroupCache",
+    "IdempotencyConflict",
+    "IdempotencyStore",
+    "Job",
+    "LoopMonitor",
+    "MessageTemplate",
+    "MessageTracker",
+    "PipelineTask",
+    "QuotaExceeded",
+    "ResultStore",
+    "RouteStats",
+    "Scheduler",
+    "ScreenRecorder",
+    "SessionBatcher",
+    "StackSampler",
+    "Subscription",
+    "TaskPipeline",
+    "TaskRecord",
+    "TaskResult",
+    "TemplateError",
+    "TemplateRegistry",
+    "Tenant",
+    "TenantRegistry",
+]
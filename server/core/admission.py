@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+"""
+网关准入控制与过载保护
+
+突发流量下，不加限制地接收请求只会让阻塞的处理函数与手机上的任务队列无限增长，所有请求
+一起变慢。准入控制在 HTTP 层限制进入网关的请求，超出能力的请求快速返回 429：
+
+    - 优先级：critical（健康检查、设备状态、任务查询等只读接口）不受限制，总能通过；
+      interactive（发消息、群管理等）优先于 bulk（广播、群发、定时任务）
+    - 全局并发：同时处理的请求数不超过 max_concurrent，其余按优先级、到达顺序排队；
+      排队数超过 max_queue 时直接拒绝，bulk 只能使用其中 bulk_share 的比例
+    - 每台设备：设备队列深度（网关中该设备的请求数 + 设备上未完成的任务数）超过
+      max_per_device 时直接拒绝，不再往已经排满的手机上堆任务
+    - 排队时限（SLO）：每个请求带截止时间（按优先级配置，客户端可用 X-Queue-Timeout 缩短），
+      排队超过截止时间的请求直接丢弃，不再占用处理能力
+    - Retry-After：按设备学习到的服务时间或全局平均处理时间估算
+    - 多租户：同一优先级内按租户权重公平排队（SFQ），大批量的租户不会挤占其他租户；
+      租户可单独限制同时处理与排队的请求数（share 提供权重与上限）
+
+使用示例:
+    admission = AdmissionController(max_concurrent=32, max_per_device=10)
+    try:
+        ticket = await admission.admit(PRIORITY_INTERACTIVE, device_id="device_1", tenant="team_a")
+    except AdmissionRejected as e:
+        return JSONResponse(status_code=429, headers={"Retry-After": str(e.retry_after)}, ...)
+    try:
+        ...
+    finally:
+        admission.release(ticket)
+"""
+import math
+import time
+import heapq
+import asyncio
+import itertools
+from typing import Callable, Optional
+
+from .tenants import FairShare
+
+PRIORITY_CRITICAL = "critical"
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BULK = "bulk"
+PRIORITIES = (PRIORITY_CRITICAL, PRIORITY_INTERACTIVE, PRIORITY_BULK)
+
+REASON_OVERLOADED = "overloaded"        # 全局排队已满
+REASON_DEVICE_BUSY = "device_busy"      # 设备队列已满
+REASON_DEADLINE = "deadline"            # 排队超过截止时间
+REASON_TENANT_LIMIT = "tenant_limit"    # 租户排队已满
+
+# backlog(device_id)：设备上未完成的任务数
+BacklogFunc = Callable[[str], int]
+# drain(device_id, queued)：设备处理完积压与 queued 个新任务的预计秒数（未知时为 0）
+DrainFunc = Callable[[str, int], float]
+# share(tenant)：租户的 (权重, 并发上限, 排队上限)，上限 0 表示不限制
+TenantShareFunc = Callable[[str], tuple[float, int, int]]
+
+
+class AdmissionRejected(Exception):
+    """请求未被接纳；retry_after 为建议的重试等待（秒）"""
+
+    def __init__(self, reason: str, message: str, retry_after: int):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """已接纳的请求，处理结束后须 release"""
+
+    __slots__ = ("priority", "device_id", "tenant", "admitted_at", "waited")
+
+    def __init__(self, priority: str, device_id: str, waited: float, tenant: str = ""):
+        self.priority = priority
+        self.device_id = device_id
+        self.tenant = tenant
+        self.admitted_at = time.monotonic()
+        self.waited = waited
+
+
+class _Counters:
+    __slots__ = ("admitted", "queued", "rejected", "wait_ewma")
+
+    def __init__(self):
+        self.admitted = 0
+        self.queued = 0                 # 曾排队等待的请求数
+        self.rejected = {REASON_OVERLOADED: 0, REASON_DEVICE_BUSY: 0, REASON_DEADLINE: 0, REASON_TENANT_LIMIT: 0}
+        self.wait_ewma = 0.0            # 排队等待时间 EWMA（秒）
+
+
+class _TenantState(_Counters):
+    __slots__ = ("active", "waiting", "weight", "max_concurrent", "max_queue")
+
+    def __init__(self, share: tuple[float, int, int]):
+        super().__init__()
+        self.active = 0
+        self.waiting = 0
+        self.weight, self.max_concurrent, self.max_queue = share
+
+    def full(self) -> bool:
+        return 0 < self.max_concurrent <= self.active
+
+
+class AdmissionController:
+    """全局与每设备的准入限制（在事件循环中使用）"""
+
+    def __init__(
+        self,
+        max_concurrent: int = 32,
+        max_queue: int = 200,
+        max_per_device: int = 10,
+        queue_timeout: Optional[dict] = None,
+        bulk_share: float = 0.5,
+        backlog: Optional[BacklogFunc] = None,
+        drain: Optional[DrainFunc] = None,
+        share: Optional[TenantShareFunc] = None,
+    ):
+        """
+        Args:
+            max_concurrent: 同时处理的请求数（critical 不计入）
+            max_queue: 等待处理的请求数上限
+            max_per_device: 每台设备的队列深度上限；0 表示不限制
+            queue_timeout: 各优先级的排队时限（秒），如 {"interactive": 5, "bulk": 30}
+            bulk_share: bulk 请求最多占用的排队比例
+            backlog: 设备上未完成的任务数，计入设备队列深度
+            drain: 设备积压的预计处理时间，用于设备繁忙时的 Retry-After
+            share: 租户的公平排队权重与并发、排队上限，为空则所有请求同权重、不限制
+        """
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.max_per_device = max_per_device
+        self.queue_timeout = {PRIORITY_INTERACTIVE: 5.0, PRIORITY_BULK: 30.0, **(queue_timeout or {})}
+        self.bulk_share = bulk_share
+        self.backlog = backlog
+        self.drain = drain
+        self.share = share
+        self._active = 0
+        # (优先级, 公平排队标签, 序号, 截止时间, future, 租户)
+        self._waiters: list[tuple[int, float, int, float, asyncio.Future, str]] = []
+        self._waiting = {PRIORITY_INTERACTIVE: 0, PRIORITY_BULK: 0}
+        self._devices: dict[str, int] = {}          # 设备 -> 网关中的请求数（处理中 + 排队）
+        self._seq = itertools.count()
+        self._service_ewma = 0.0                    # 已接纳请求的平均处理时间（秒）
+        self._counters = {p: _Counters() for p in (PRIORITY_INTERACTIVE, PRIORITY_BULK)}
+        self._fair = {p: FairShare() for p in (PRIORITY_INTERACTIVE, PRIORITY_BULK)}
+        self._tenants: dict[str, _TenantState] = {}
+
+    async def admit(
+        self, priority: str, device_id: str = "", timeout: Optional[float] = None, tenant: str = ""
+    ) -> Ticket:
+        """
+        接纳请求：有空闲时立即返回，否则排队直到轮到或超过截止时间
+
+        Args:
+            timeout: 客户端要求的排队时限（秒），只能比该优先级的配置更短
+            tenant: 租户，用于公平排队与租户上限
+
+        Raises:
+            AdmissionRejected: 排队已满、租户排队已满、设备繁忙或排队超时
+        """
+        if priority == PRIORITY_CRITICAL:
+            return Ticket(priority, "", 0.0, tenant)
+        counters = self._counters[priority]
+        state = self._tenant(tenant)
+        if device_id and self.max_per_device > 0:
+            depth = self._devices.get(device_id, 0) + (self.backlog(device_id) if self.backlog else 0)
+            if depth >= self.max_per_device:
+                drain = self.drain(device_id, self._devices.get(device_id, 0) + 1) if self.drain else 0.0
+                self._reject(priority, REASON_DEVICE_BUSY, state)
+                raise AdmissionRejected(
+                    REASON_DEVICE_BUSY, f"设备队列已满: {device_id}（深度 {depth}）", self._retry_after(drain)
+                )
+        waiting = sum(self._waiting.values())
+        if self._active < self.max_concurrent and not waiting and not state.full():
+            return self._enter(priority, device_id, 0.0, tenant)
+
+        if 0 < state.max_queue <= state.waiting:
+            self._reject(priority, REASON_TENANT_LIMIT, state)
+            raise AdmissionRejected(
+                REASON_TENANT_LIMIT, f"租户排队已满: {tenant}（{state.waiting}）", self._retry_after(self._queue_seconds(waiting))
+            )
+        limit = self.max_queue if priority == PRIORITY_INTERACTIVE else int(self.max_queue * self.bulk_share)
+        if waiting >= limit:
+            self._reject(priority, REASON_OVERLOADED, state)
+            raise AdmissionRejected(REASON_OVERLOADED, "网关繁忙，请稍后重试", self._retry_after(self._queue_seconds(waiting)))
+
+        slo = self.queue_timeout.get(priority, 5.0)
+        slo = min(slo, timeout) if timeout is not None and timeout > 0 else slo
+        start = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        rank = PRIORITIES.index(priority)
+        tag = self._fair[priority].tag(tenant, state.weight)
+        heapq.heappush(self._waiters, (rank, tag, next(self._seq), start + slo, future, tenant))
+        self._waiting[priority] += 1
+        state.waiting += 1
+        counters.queued += 1
+        state.queued += 1
+        if device_id:
+            self._devices[device_id] = self._devices.get(device_id, 0) + 1
+        self._wake()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=slo)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # 客户端断开：已被唤醒的归还名额
+            if future.done() and not future.cancelled():
+                self._active -= 1
+                state.active -= 1
+                self._wake()
+            future.cancel()
+            raise
+        finally:
+            self._waiting[priority] -= 1
+            state.waiting -= 1
+            if device_id:
+                self._leave_device(device_id)
+        if future.done() and not future.cancelled():
+            # _wake 已为本请求占用并发名额
+            self._active -= 1
+            state.active -= 1
+            return self._enter(priority, device_id, time.monotonic() - start, tenant)
+        future.cancel()
+        self._reject(priority, REASON_DEADLINE, state)
+        raise AdmissionRejected(
+            REASON_DEADLINE, f"排队超过 {slo:g} 秒，已丢弃", self._retry_after(self._queue_seconds(sum(self._waiting.values())))
+        )
+
+    def release(self, ticket: Ticket) -> None:
+        """请求处理结束（无论成功与否）"""
+        if ticket.priority == PRIORITY_CRITICAL:
+            return
+        elapsed = time.monotonic() - ticket.admitted_at
+        self._service_ewma += 0.1 * (elapsed - self._service_ewma) if self._service_ewma else elapsed
+        self._active -= 1
+        self._tenant(ticket.tenant).active -= 1
+        if ticket.device_id:
+            self._leave_device(ticket.device_id)
+        self._wake()
+
+    def tenant_stats(self, tenant: str) -> dict:
+        """租户在准入控制中的状态与计数"""
+        state = self._tenant(tenant)
+        return {
+            "active": state.active,
+            "waiting": state.waiting,
+            "weight": state.weight,
+            "max_concurrent": state.max_concurrent,
+            "max_queue": state.max_queue,
+            "admitted": state.admitted,
+            "queued": state.queued,
+            "rejected": dict(state.rejected),
+            "avg_wait_seconds": round(state.wait_ewma, 3),
+        }
+
+    def stats(self) -> dict:
+        return {
+            "active": self._active,
+            "max_concurrent": self.max_concurrent,
+            "waiting": dict(self._waiting),
+            "max_queue": self.max_queue,
+            "avg_service_seconds": round(self._service_ewma, 3),
+            "devices": {
+                device_id: {
+                    "requests": count,
+                    "backlog": self.backlog(device_id) if self.backlog else 0,
+                    "max_depth": self.max_per_device,
+                }
+                for device_id, count in self._devices.items()
+            },
+            "priorities": {
+                priority: {
+                    "admitted": c.admitted,
+                    "queued": c.queued,
+                    "rejected": dict(c.rejected),
+                    "avg_wait_seconds": round(c.wait_ewma, 3),
+                }
+                for priority, c in self._counters.items()
+            },
+            "tenants": {tenant: self.tenant_stats(tenant) for tenant in self._tenants if tenant},
+        }
+
+    # ---------------- 内部 ----------------
+
+    def _enter(self, priority: str, device_id: str, waited: float, tenant: str) -> Ticket:
+        self._active += 1
+        if device_id:
+            self._devices[device_id] = self._devices.get(device_id, 0) + 1
+        state = self._tenant(tenant)
+        state.active += 1
+        for counters in (self._counters[priority], state):
+            counters.admitted += 1
+            counters.wait_ewma += 0.1 * (waited - counters.wait_ewma)
+        return Ticket(priority, device_id, waited, tenant)
+
+    def _wake(self) -> None:
+        """
+        按优先级、公平排队标签唤醒排队的请求；已超过截止时间或已放弃的直接跳过，
+        租户已达并发上限的留在队列中，等该租户有请求结束时再唤醒
+
+        超过截止时间的只出队、不取消（取消会让等待方收到 CancelledError），由等待方的超时分支拒绝
+        """
+        now = time.monotonic()
+        held = []
+        while self._waiters and self._active < self.max_concurrent:
+            entry = heapq.heappop(self._waiters)
+            rank, tag, _, deadline, future, tenant = entry
+            if future.done():
+                continue
+            if deadline <= now:
+                continue
+            state = self._tenant(tenant)
+            if state.full():
+                held.append(entry)
+                continue
+            self._active += 1           # 为被唤醒的请求预占名额，避免被新到的请求抢走
+            state.active += 1
+            self._fair[PRIORITIES[rank]].served(tag)
+            future.set_result(None)
+        for entry in held:
+            heapq.heappush(self._waiters, entry)
+
+    def _tenant(self, tenant: str) -> _TenantState:
+        state = self._tenants.get(tenant)
+        if state is None:
+            state = self._tenants[tenant] = _TenantState(self.share(tenant) if self.share and tenant else (1.0, 0, 0))
+        return state
+
+    def _leave_device(self, device_id: str) -> None:
+        count = self._devices.get(device_id, 0) - 1
+        if count > 0:
+            self._devices[device_id] = count
+        else:
+            self._devices.pop(device_id, None)
+
+    def _reject(self, priority: str, reason: str, state: _TenantState) -> None:
+        self._counters[priority].rejected[reason] += 1
+        state.rejected[reason] += 1
+
+    def _queue_seconds(self, waiting: int) -> float:
+        return (waiting + 1) * self._service_ewma / self.max_concurrent
+
+    @staticmethod
+    def _retry_after(seconds: float) -> int:
+        return max(1, min(300, math.ceil(seconds)))
@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+"""
+模板群发
+
+上传的收件人变量行（CSV 或 NDJSON）先流式写入本地暂存文件，再由后台流水线逐行读取、
+渲染模板并放入各设备的发送队列，整个过程不把收件人列表载入内存：
+
+    暂存文件 --逐行读取--> 渲染模板 --> 设备队列 --> 设备发送协程（逐条发送并等待结果）
+
+每台设备的队列在内存中最多保留 queue_size 条，超出的部分按顺序追加到该设备的溢出文件，
+发送协程取完内存中的消息后再从溢出文件补充。读取从不等待某一台设备，慢设备不会挡住其他设备，
+10 万行的群发内存占用仍与几百行相同。
+
+每行需包含 contact（联系人）列，可选 device_id 列指定发送设备（否则使用群发的默认设备；
+均未指定时按联系人索引选择认识该联系人的设备），其余列作为模板变量。
+属于某个租户的群发只能使用该租户的设备，发送时按租户计费并参与公平排队。
+
+使用示例:
+    runner = CampaignRunner(send, queue_size=100, send_interval=1.0)
+    campaign = Campaign(campaign_id="", template_id="welcome", app_type="wework",
+                        device_id="device_1", fmt="csv", path="campaigns/xxx.csv")
+    runner.start(campaign, template)     # 需在事件循环中调用
+"""
+import os
+import csv
+import json
+import time
+import uuid
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Awaitable, Callable, Iterator, Optional
+
+from .templates import MessageTemplate, TemplateError
+
+logger = logging.getLogger(__name__)
+
+ROW_FORMATS = ("csv", "ndjson")
+
+# send(device_id, app_type, contact, message, tenant_id) -> 与 send_message 接口 data 相同结构的结果
+SendFunc = Callable[[str, str, str, str, str], Awaitable[dict]]
+# route(app_type, contact, device_ids) -> 认识该联系人的设备（限定在 device_ids 中，None 为不限），无则为空
+RouteFunc = Callable[[str, str, Optional[list]], str]
+
+
+async def spool_upload(chunks: AsyncIterator[bytes], path: str, max_bytes: int) -> int:
+    """
+    把上传的请求体流式写入暂存文件
+
+    Returns:
+        写入的字节数
+
+    Raises:
+        ValueError: 超过 max_bytes（已写入的部分会被删除）
+    """
+    size = 0
+    try:
+        with open(path, "wb") as f:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ValueError(f"上传内容超过上限 {max_bytes // (1024 * 1024)}MB")
+                f.write(chunk)
+    except BaseException:
+        _remove(path)
+        raise
+    return size
+
+
+def read_csv_header(path: str) -> list[str]:
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        return next(csv.reader(f), [])
+
+
+def iter_rows(path: str, fmt: str) -> Iterator[tuple[int, Optional[dict], str]]:
+    """逐行读取暂存文件，产出 (行号, 变量行, 错误信息)"""
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        if fmt == "csv":
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row, ""
+            return
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_no, None, f"JSON 解析失败: {e}"
+                continue
+            if isinstance(row, dict):
+                yield line_no, row, ""
+            else:
+                yield line_no, None, "每行须为 JSON 对象"
+
+
+@dataclass
+class Campaign:
+    """一次模板群发"""
+    campaign_id: str
+    template_id: str
+    app_type: str
+    device_id: str          # 行中未指定 device_id 时使用
+    fmt: str
+    path: str               # 暂存文件
+    status: str = "pending"  # pending / running / completed / cancelled / failed
+    rows: int = 0
+    sent: int = 0
+    failed: int = 0
+    skipped: int = 0        # 渲染失败、缺少联系人或设备的行
+    devices: dict = field(default_factory=dict)
+    errors: deque = field(default_factory=lambda: deque(maxlen=20))
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    cancelled: bool = False
+    tenant_id: str = ""                     # 发起群发的租户
+    allowed_devices: Optional[frozenset] = None   # 租户可用的设备，None 为全部设备
+
+    def device_counter(self, device_id: str) -> dict:
+        return self.devices.setdefault(device_id, {"queued": 0, "sent": 0, "failed": 0})
+
+    def add_error(self, line_no: int, contact: str, error: str) -> None:
+        self.errors.append({"row": line_no, "contact": contact, "error": error})
+
+    def to_dict(self) -> dict:
+        return {
+            "campaign_id": self.campaign_id,
+            "template_id": self.template_id,
+            "app_type": self.app_type,
+            "device_id": self.device_id,
+            "tenant_id": self.tenant_id,
+            "format": self.fmt,
+            "status": self.status,
+            "rows": self.rows,
+            "sent": self.sent,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "devices": self.devices,
+            "recent_errors": list(self.errors),
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class _DeviceLane:
+    """
+    单台设备的发送队列：内存中最多 capacity 条，超出的按顺序写入溢出文件
+
+    溢出文件中有未读消息时，新消息也写入文件，保证先进先出；内存取空后从文件按顺序补充。
+    """
+
+    def __init__(self, capacity: int, spool_path: str):
+        self.capacity = capacity
+        self.spool_path = spool_path
+        self._buffer: deque = deque()
+        self._spooled = 0               # 溢出文件中未读的消息数
+        self._writer = None
+        self._reader = None
+        self._closed = False
+        self._ready = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._buffer) + self._spooled
+
+    def put(self, item: tuple) -> None:
+        if self._spooled == 0 and len(self._buffer) < self.capacity:
+            self._buffer.append(item)
+        else:
+            if self._writer is None:
+                self._writer = open(self.spool_path, "ab")
+            self._writer.write(json.dumps(item, ensure_ascii=False).encode("utf-8") + b"\n")
+            self._spooled += 1
+        self._ready.set()
+
+    def close(self) -> None:
+        """不再有新消息，发送协程取完后结束"""
+        self._closed = True
+        self._ready.set()
+
+    async def get(self) -> Optional[tuple]:
+        """取下一条消息，队列已关闭且取完时返回 None"""
+        while True:
+            if not self._buffer and self._spooled:
+                self._refill()
+            if self._buffer:
+                return self._buffer.popleft()
+            if self._closed:
+                return None
+            self._ready.clear()
+            await self._ready.wait()
+
+    def _refill(self) -> None:
+        self._writer.flush()
+        if self._reader is None:
+            self._reader = open(self.spool_path, "rb")
+        while self._spooled and len(self._buffer) < self.capacity:
+            self._buffer.append(tuple(json.loads(self._reader.readline())))
+            self._spooled -= 1
+
+    def discard(self) -> None:
+        """关闭并删除溢出文件"""
+        for f in (self._writer, self._reader):
+            if f is not None:
+                f.close()
+        self._writer = self._reader = None
+        self._buffer.clear()
+        self._spooled = 0
+        _remove(self.spool_path)
+
+
+class CampaignRunner:
+    """群发流水线（在事件循环中运行）"""
+
+    def __init__(
+        self,
+        send: SendFunc,
+        is_known_device: Callable[[str], bool] = lambda _: True,
+        route: RouteFunc = lambda app_type, contact, device_ids: "",
+        queue_size: int = 100,
+        send_interval: float = 0,
+        max_campaigns: int = 100,
+    ):
+        """
+        Args:
+            send: 发送单条消息的协程函数（应等待发送完成，以免设备端任务队列堆积）
+            is_known_device: 校验行中的 device_id 是否已注册
+            route: 行与群发均未指定设备时，按 (app_type, contact, 可用设备) 选择发送设备，返回空表示无可用设备
+            queue_size: 每台设备在内存中保留的待发送消息数，超出部分写入该设备的溢出文件
+            send_interval: 同一设备相邻两条消息的间隔（秒）
+            max_campaigns: 最多保留的群发记录数（超出时淘汰最早结束的）
+        """
+        self.send = send
+        self.is_known_device = is_known_device
+        self.route = route
+        self.queue_size = max(1, queue_size)
+        self.send_interval = send_interval
+        self.max_campaigns = max_campaigns
+        self._campaigns: "OrderedDict[str, Campaign]" = OrderedDict()
+
+    def start(self, campaign: Campaign, template: MessageTemplate) -> Campaign:
+        campaign.campaign_id = campaign.campaign_id or uuid.uuid4().hex[:12]
+        self._campaigns[campaign.campaign_id] = campaign
+        self._trim()
+        asyncio.ensure_future(self._run(campaign, template))
+        return campaign
+
+    def get(self, campaign_id: str) -> Optional[Campaign]:
+        return self._campaigns.get(campaign_id)
+
+    def list(self) -> list[Campaign]:
+        return list(reversed(self._campaigns.values()))
+
+    def cancel(self, campaign_id: str) -> bool:
+        campaign = self._campaigns.get(campaign_id)
+        if campaign is None or campaign.finished_at is not None:
+            return False
+        campaign.cancelled = True
+        return True
+
+    def _trim(self) -> None:
+        finished = [c.campaign_id for c in self._campaigns.values() if c.finished_at is not None]
+        for campaign_id in finished[:max(0, len(self._campaigns) - self.max_campaigns)]:
+            del self._campaigns[campaign_id]
+
+    async def _run(self, campaign: Campaign, template: MessageTemplate) -> None:
+        campaign.status = "running"
+        lanes: dict[str, _DeviceLane] = {}
+        workers: list[asyncio.Task] = []
+        try:
+            for line_no, row, error in iter_rows(campaign.path, campaign.fmt):
+                if campaign.cancelled:
+                    break
+                campaign.rows += 1
+                if campaign.rows % 200 == 0:
+                    await asyncio.sleep(0)   # 连续读取时让出事件循环
+                contact = str((row or {}).get("contact") or "").strip()
+                device_id = str((row or {}).get("device_id") or campaign.device_id or "")
+                if not error and not contact:
+                    error = "缺少 contact"
+                if not error and not device_id:
+                    allowed = sorted(campaign.allowed_devices) if campaign.allowed_devices is not None else None
+                    device_id = self.route(campaign.app_type, contact, allowed)
+                    if not device_id:
+                        error = "缺少 device_id，且没有已知该联系人的设备"
+                if not error and device_id not in lanes:
+                    if campaign.allowed_devices is not None and device_id not in campaign.allowed_devices:
+                        error = f"设备不属于本租户: {device_id}"
+                    elif not self.is_known_device(device_id):
+                        error = f"设备不存在: {device_id}"
+                if not error:
+                    try:
+                        message = template.render(row)
+                    except TemplateError as e:
+                        error = str(e)
+                if error:
+                    campaign.skipped += 1
+                    campaign.add_error(line_no, contact, error)
+                    continue
+
+                lane = lanes.get(device_id)
+                if lane is None:
+                    lane = lanes[device_id] = _DeviceLane(self.queue_size, f"{campaign.path}.{len(lanes)}.lane")
+                    workers.append(asyncio.ensure_future(self._worker(campaign, device_id, lane)))
+                campaign.device_counter(device_id)["queued"] += 1
+                lane.put((line_no, contact, message))
+
+            for lane in lanes.values():
+                lane.close()
+            await asyncio.gather(*workers)
+            campaign.status = "cancelled" if campaign.cancelled else "completed"
+        except Exception as e:
+            logger.error(f"群发异常终止: {campaign.campaign_id} - {e}")
+            campaign.status = "failed"
+            campaign.add_error(0, "", str(e))
+            campaign.cancelled = True
+            for worker in workers:
+                worker.cancel()
+        finally:
+            campaign.finished_at = time.time()
+            for lane in lanes.values():
+                lane.discard()
+            _remove(campaign.path)
+            logger.info(
+                f"群发结束: {campaign.campaign_id} {campaign.status} "
+                f"行数={campaign.rows} 成功={campaign.sent} 失败={campaign.failed} 跳过={campaign.skipped}"
+            )
+
+    async def _worker(self, campaign: Campaign, device_id: str, lane: _DeviceLane) -> None:
+        counter = campaign.device_counter(device_id)
+        while True:
+            item = await lane.get()
+            if item is None or campaign.cancelled:
+                return      # 取消后不再发送，队列与溢出文件在群发结束时删除
+            line_no, contact, message = item
+            try:
+                result = await self.send(device_id, campaign.app_type, contact, message, campaign.tenant_id)
+                ok = bool(result.get("success"))
+                error = "" if ok else str(result.get("message") or "发送失败")
+            except Exception as e:
+                ok, error = False, str(e)
+            if ok:
+                campaign.sent += 1
+                counter["sent"] += 1
+            else:
+                campaign.failed += 1
+                counter["failed"] += 1
+                campaign.add_error(line_no, contact, error)
+            if self.send_interval > 0:
+                await asyncio.sleep(self.send_interval)
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
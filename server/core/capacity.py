@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""
+设备容量模型与自动调速
+
+设备端任务串行执行，每台手机能承受的发送速率不同，也会随发热、网络、应用状态变化。
+网关从任务结果中学习每台设备、每种操作的服务时间（设备端执行耗时，不含排队），
+并据此自动调整下发：
+
+    - 服务时间模型：按 (设备, 操作) 维护服务时间的 EWMA 均值与偏差，以及缓慢跟随的基线
+    - 并发窗口（AIMD）：每台设备已下发未完成的任务数不超过窗口；任务正常完成时窗口
+      加性增长（+1/窗口），出现拥塞信号时减半：
+        · 服务时间均值超过基线 degrade_ratio 倍（设备变慢）
+        · 任务超时未完成
+        · 设备队列中有不经网关提交的积压（status 的 task_queue_size 大于网关在途数）
+    - 节奏：相邻两次下发至少间隔「预测服务时间 / 窗口」，避免突发
+    - 设备变慢、超时或出现外部积压时输出告警，并在容量接口中标记
+
+每台有在途任务的设备只有一个轮询协程，按提交顺序查询最早的在途任务（设备 FIFO 执行），
+完成后经 ResultStore 回调进入模型。
+
+使用示例:
+    controller = CapacityController(poll=..., status=...)
+    await controller.acquire("device_1", "send_message")
+    resp = client.send_message(...)
+    controller.dispatched("device_1", "send_message", resp["data"]["task_id"])
+"""
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from .result_store import STATUS_SUCCESS, TaskRecord
+
+logger = logging.getLogger(__name__)
+
+# poll(device_id, task_id)：查询任务结果（阻塞调用，在线程池中执行；完成时应写入 ResultStore）
+PollFunc = Callable[[str, str], dict]
+# status(device_id)：设备状态（含 task_queue_size，阻塞调用）
+StatusFunc = Callable[[str], dict]
+
+
+class OpStats:
+    """单个 (设备, 操作) 的服务时间模型"""
+
+    __slots__ = ("mean", "dev", "baseline", "count", "failures", "fail_rate")
+
+    ALPHA = 0.2          # 均值 EWMA 系数
+    BETA = 0.25          # 偏差 EWMA 系数
+    BASELINE_ALPHA = 0.02
+
+    def __init__(self):
+        self.mean = 0.0
+        self.dev = 0.0
+        self.baseline = 0.0
+        self.count = 0
+        self.failures = 0
+        self.fail_rate = 0.0
+
+    def observe(self, seconds: Optional[float], success: bool, degraded: bool) -> None:
+        self.count += 1
+        self.failures += not success
+        self.fail_rate += self.ALPHA * ((not success) - self.fail_rate)
+        if seconds is None:
+            return
+        if self.mean == 0.0:
+            self.mean, self.dev, self.baseline = seconds, seconds / 2, seconds
+            return
+        self.dev += self.BETA * (abs(seconds - self.mean) - self.dev)
+        self.mean += self.ALPHA * (seconds - self.mean)
+        # 变慢期间基线只以 1/5 速度跟随：短时变慢会告警，长期变慢最终成为新的基线
+        alpha = self.BASELINE_ALPHA / 5 if degraded else self.BASELINE_ALPHA
+        self.baseline += alpha * (self.mean - self.baseline)
+
+    def to_dict(self) -> dict:
+        return {
+            "mean_seconds": round(self.mean, 3),
+            "dev_seconds": round(self.dev, 3),
+            "baseline_seconds": round(self.baseline, 3),
+            "count": self.count,
+            "failures": self.failures,
+            "fail_rate": round(self.fail_rate, 3),
+        }
+
+
+class _DeviceState:
+    def __init__(self, window: float):
+        self.window = window
+        self.inflight: "OrderedDict[str, tuple[str, float]]" = OrderedDict()   # task_id -> (op, 下发时间)
+        self.reserved = 0
+        self.last_dispatch = 0.0
+        self.last_completion = 0.0
+        self.last_decrease = 0.0
+        self.ops: dict[str, OpStats] = {}
+        self.warning = ""
+        self.external_backlog = 0
+        self.changed: Optional[asyncio.Event] = None
+        self.poller: Optional[asyncio.Task] = None
+
+    def predict(self, op: str) -> float:
+        stats = self.ops.get(op)
+        if stats is not None and stats.mean > 0:
+            return stats.mean
+        known = [s.mean for s in self.ops.values() if s.mean > 0]
+        return sum(known) / len(known) if known else 0.0
+
+
+class CapacityController:
+    """按设备学习服务时间并自动调整并发窗口与下发节奏（在事件循环中使用）"""
+
+    def __init__(
+        self,
+        poll: PollFunc,
+        status: StatusFunc,
+        initial_window: float = 2,
+        max_window: float = 4,
+        degrade_ratio: float = 2.0,
+        task_timeout: float = 60,
+        poll_interval: float = 2.0,
+        status_interval: float = 10.0,
+        autotune: bool = True,
+    ):
+        """
+        Args:
+            poll: 查询任务结果的函数
+            status: 查询设备状态的函数
+            initial_window: 初始并发窗口
+            max_window: 并发窗口上限
+            degrade_ratio: 服务时间均值超过基线该倍数时视为设备变慢
+            task_timeout: 在途任务超过该秒数未完成视为超时
+            poll_interval: 在途任务的最长轮询间隔（秒）
+            status_interval: 检查设备队列积压的间隔（秒）
+            autotune: 为 False 时只学习模型、不限制下发
+        """
+        self.poll = poll
+        self.status = status
+        self.initial_window = max(1.0, initial_window)
+        self.max_window = max(self.initial_window, max_window)
+        self.degrade_ratio = degrade_ratio
+        self.task_timeout = task_timeout
+        self.poll_interval = poll_interval
+        self.status_interval = status_interval
+        self.autotune = autotune
+        self._devices: dict[str, _DeviceState] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def start(self) -> None:
+        """记录事件循环（需在事件循环中调用），之后线程池中的完成回调转入事件循环处理"""
+        self._loop = asyncio.get_running_loop()
+
+    # ---------------- 下发 ----------------
+
+    async def acquire(self, device_id: str, op: str) -> None:
+        """等待设备有空闲窗口且到达下发节奏后返回（占用一个窗口，下发后须调用 dispatched）"""
+        state = self._state(device_id)
+        if state.changed is None:
+            state.changed = asyncio.Event()
+        while self.autotune:
+            free = len(state.inflight) + state.reserved < int(state.window)
+            gap = state.last_dispatch + state.predict(op) / state.window - time.monotonic()
+            if free and gap <= 0:
+                break
+            state.changed.clear()
+            try:
+                await asyncio.wait_for(state.changed.wait(), timeout=gap if free else None)
+            except asyncio.TimeoutError:
+                pass
+        state.reserved += 1
+        state.last_dispatch = time.monotonic()
+
+    def dispatched(self, device_id: str, op: str, task_id: str) -> None:
+        """acquire 后的下发已完成；task_id 为空表示提交失败，释放窗口"""
+        state = self._state(device_id)
+        state.reserved = max(0, state.reserved - 1)
+        if task_id:
+            state.inflight[task_id] = (op, time.monotonic())
+            if state.poller is None or state.poller.done():
+                state.poller = asyncio.ensure_future(self._poll_loop(device_id, state))
+        self._notify(state)
+
+    # ---------------- 观测 ----------------
+
+    def observe(self, record: TaskRecord) -> None:
+        """ResultStore 完成回调：记录服务时间（可在任意线程调用）"""
+        args = (record.device_id, record.task_id, record.op,
+                record.service_ms / 1000 if record.service_ms else None, record.status == STATUS_SUCCESS)
+        loop = self._loop
+        if loop is not None and loop.is_running():
+            loop.call_soon_threadsafe(self._complete, *args)
+        else:
+            self._complete(*args)
+
+    def _complete(self, device_id: str, task_id: str, op: str, service: Optional[float], success: bool) -> None:
+        state = self._state(device_id)
+        now = time.monotonic()
+        entry = state.inflight.pop(task_id, None)
+        if entry is not None:
+            op = entry[0]
+            if service is None:
+                # 旧版 APK 不返回执行耗时：设备 FIFO 串行执行，用与上一次完成的间隔近似
+                service = now - max(entry[1], state.last_completion)
+        state.last_completion = now
+        stats = state.ops.setdefault(op or "unknown", OpStats())
+        was_degraded = self._is_degraded(stats)
+        stats.observe(service, success, was_degraded)
+        degraded = self._is_degraded(stats)
+        if degraded:
+            self._decrease(device_id, state, f"{op} 服务时间 {stats.mean:.1f}s，基线 {stats.baseline:.1f}s")
+        elif entry is not None:
+            state.window = min(self.max_window, state.window + 1 / state.window)
+            if state.warning and state.external_backlog == 0:
+                logger.info(f"设备已恢复: {device_id}")
+                state.warning = ""
+        self._notify(state)
+
+    def _is_degraded(self, stats: OpStats) -> bool:
+        return stats.count >= 5 and stats.baseline > 0 and stats.mean > stats.baseline * self.degrade_ratio
+
+    def _decrease(self, device_id: str, state: _DeviceState, reason: str) -> None:
+        """窗口减半（同一轮服务时间内只减一次）"""
+        now = time.monotonic()
+        if now - state.last_decrease < max(1.0, state.predict("")):
+            return
+        state.last_decrease = now
+        state.window = max(1.0, state.window / 2)
+        if not state.warning:
+            logger.warning(f"设备容量下降: {device_id} - {reason}，并发窗口降为 {state.window:.1f}")
+        state.warning = reason
+
+    # ---------------- 轮询 ----------------
+
+    async def _poll_loop(self, device_id: str, state: _DeviceState) -> None:
+        loop = asyncio.get_running_loop()
+        last_status = time.monotonic()
+        while state.inflight:
+            task_id, (op, dispatched_at) = next(iter(state.inflight.items()))
+            if time.monotonic() - dispatched_at > self.task_timeout:
+                state.inflight.pop(task_id, None)
+                self._decrease(device_id, state, f"任务超时未完成: {op} {task_id}")
+                self._notify(state)
+                continue
+            try:
+                await loop.run_in_executor(None, self.poll, device_id, task_id)
+            except Exception as e:
+                logger.warning(f"轮询任务结果失败: {device_id} {task_id} - {e}")
+            if time.monotonic() - last_status >= self.status_interval and state.inflight:
+                last_status = time.monotonic()
+                await self._check_backlog(device_id, state)
+            if state.inflight:
+                wait = state.predict(next(iter(state.inflight.values()))[0]) / 2
+                await asyncio.sleep(min(self.poll_interval, max(0.5, wait)))
+
+    async def _check_backlog(self, device_id: str, state: _DeviceState) -> None:
+        try:
+            status = await asyncio.get_running_loop().run_in_executor(None, self.status, device_id)
+        except Exception:
+            return
+        queue_size = status.get("task_queue_size") if isinstance(status, dict) else None
+        if not isinstance(queue_size, int):
+            return
+        # 设备队列不含正在执行的任务
+        state.external_backlog = max(0, queue_size - max(0, len(state.inflight) - 1))
+        if state.external_backlog > 0:
+            self._decrease(device_id, state, f"设备队列有 {state.external_backlog} 个非网关提交的积压任务")
+
+    # ---------------- 查询 ----------------
+
+    def load(self, device_id: str) -> float:
+        """设备当前负载（在途任务数 / 窗口，变慢的设备额外加 1），用于在多台设备间选择"""
+        state = self._devices.get(device_id)
+        if state is None:
+            return 0.0
+        return (len(state.inflight) + state.reserved) / state.window + bool(state.warning)
+
+    def backlog(self, device_id: str) -> int:
+        """设备上尚未完成的任务数：网关已下发/正在下发的，加上不经网关提交的积压"""
+        state = self._devices.get(device_id)
+        if state is None:
+            return 0
+        return len(state.inflight) + state.reserved + state.external_backlog
+
+    def drain_seconds(self, device_id: str, queued: int = 0) -> float:
+        """按学习到的服务时间估算设备处理完现有积压与 queued 个新任务所需的秒数（未知时为 0）"""
+        state = self._devices.get(device_id)
+        if state is None:
+            return 0.0
+        return (self.backlog(device_id) + queued) * state.predict("") / state.window
+
+    def stats(self, device_id: Optional[str] = None) -> dict:
+        """各设备（或指定设备）的容量模型与当前窗口"""
+        ids = [device_id] if device_id is not None else list(self._devices)
+        result = {}
+        for did in ids:
+            state = self._devices.get(did)
+            if state is None:
+                continue
+            busy = [s for s in state.ops.values() if s.mean > 0]
+            mean = sum(s.mean for s in busy) / len(busy) if busy else 0.0
+            result[did] = {
+                "window": round(state.window, 2),
+                "limit": int(state.window),
+                "inflight": len(state.inflight),
+                "pace_seconds": round(mean / state.window, 3),
+                "est_per_minute": round(60 / mean, 1) if mean > 0 else None,
+                "degraded": bool(state.warning),
+                "warning": state.warning,
+                "external_backlog": state.external_backlog,
+                "ops": {op: s.to_dict() for op, s in state.ops.items()},
+            }
+        return result
+
+    def _state(self, device_id: str) -> _DeviceState:
+        state = self._devices.get(device_id)
+        if state is None:
+            state = self._devices[device_id] = _DeviceState(self.initial_window)
+        return state
+
+    @staticmethod
+    def _notify(state: _DeviceState) -> None:
+        if state.changed is not None:
+            state.changed.set()
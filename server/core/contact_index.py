@@ -0,0 +1,473 @@
+# -*- coding: utf-8 -*-
+"""
+全设备联系人索引
+
+要知道哪台设备（哪个账号）有某个客户，原本只能逐台调用 get_contact_list，每台需数分钟。
+网关把各设备采集到的联系人列表合并为一个内存倒排索引，按名称、备注、拼音首字母
+（及全拼）检索，毫秒级返回，并可按「哪些设备认识该联系人」选择发送设备。
+
+    - 索引：按字符建倒排表（字符 -> 联系人），查询时取查询串各字符倒排表的交集，
+      再逐个校验子串，联系人数增长时查询耗时只与候选数有关
+    - 增量刷新：设备重新采集后只对比新旧列表，增删有变化的联系人；发送/读取消息成功时
+      把该联系人记为设备已知（learn），不等下一次采集
+    - 拼音：安装 pypinyin 时索引首字母与全拼（正确处理多音字、生僻字）；未安装时按 GBK
+      一级汉字区位推算首字母，不支持全拼
+    - 持久化：各设备的列表保存到本地 JSON 文件，重启后重建索引，无需重新采集；
+      采集更新后延迟 save_delay 秒合并写入，在线程池中写临时文件再替换，不阻塞事件循环
+
+使用示例:
+    index = ContactIndex(store_path="contact_index.json")
+    index.update("device_1", "wework", ["张三", {"name": "李四", "remark": "VIP客户"}])
+    index.search("zs")                  # [{"name": "张三", "devices": ["device_1"], ...}]
+    index.locate("李四", "wework")       # ["device_1"]
+"""
+import os
+import json
+import time
+import heapq
+import asyncio
+import logging
+import threading
+from typing import Collection, Iterable, Optional, Union
+
+try:
+    from pypinyin import lazy_pinyin
+except ImportError:  # 可选依赖
+    lazy_pinyin = None
+
+logger = logging.getLogger(__name__)
+
+# 设备端返回的联系人：名称字符串，或含 name / remark 的对象
+ContactItem = Union[str, dict]
+
+# GBK 一级汉字按拼音排序，各首字母的起始编码（无 I、U、V 开头的拼音）
+_GBK_INITIALS = (
+    (0xB0A1, "a"), (0xB0C5, "b"), (0xB2C1, "c"), (0xB4EE, "d"), (0xB6EA, "e"), (0xB7A2, "f"),
+    (0xB8C1, "g"), (0xB9FE, "h"), (0xBBF7, "j"), (0xBFA6, "k"), (0xC0AC, "l"), (0xC2E8, "m"),
+    (0xC4C3, "n"), (0xC5B6, "o"), (0xC5BE, "p"), (0xC6DA, "q"), (0xC8BB, "r"), (0xC8F6, "s"),
+    (0xCBFA, "t"), (0xCDDA, "w"), (0xCEF4, "x"), (0xD1B9, "y"), (0xD4D1, "z"),
+)
+_GBK_LEVEL1_END = 0xD7F9
+
+
+def _gbk_initial(ch: str) -> str:
+    try:
+        raw = ch.encode("gbk")
+    except UnicodeEncodeError:
+        return ""
+    if len(raw) != 2:
+        return ""
+    code = (raw[0] << 8) | raw[1]
+    if not _GBK_INITIALS[0][0] <= code <= _GBK_LEVEL1_END:
+        return ""
+    initial = ""
+    for start, letter in _GBK_INITIALS:
+        if code < start:
+            break
+        initial = letter
+    return initial
+
+
+def pinyin_keys(text: str) -> tuple[str, str]:
+    """
+    名称的拼音检索键
+
+    Returns:
+        (首字母, 全拼)，均为小写；英文、数字原样保留，其它字符忽略；未安装 pypinyin 时全拼为空
+    """
+    if lazy_pinyin is not None:
+        syllables = [s.lower() for s in lazy_pinyin(text, errors=lambda s: [c for c in s if c.isalnum()])]
+        return "".join(s[:1] for s in syllables), "".join(syllables)
+    initials = []
+    for ch in text:
+        if ch.isascii():
+            if ch.isalnum():
+                initials.append(ch.lower())
+        else:
+            initials.append(_gbk_initial(ch))
+    return "".join(initials), ""
+
+
+def _normalize(text: str) -> str:
+    return "".join(str(text).split()).lower()
+
+
+class ContactEntry:
+    """索引中的一个联系人（同一应用下按名称合并，devices 为认识该联系人的设备）"""
+
+    __slots__ = ("name", "app_type", "remark", "initials", "pinyin", "devices", "name_key", "remark_key")
+
+    def __init__(self, name: str, app_type: str, remark: str = ""):
+        self.name = name
+        self.app_type = app_type
+        self.name_key = _normalize(name)
+        self.initials, self.pinyin = pinyin_keys(name)
+        self.devices: dict[str, float] = {}     # device_id -> 最近一次确认的时间
+        self.set_remark(remark)
+
+    def set_remark(self, remark: str) -> None:
+        self.remark = remark
+        self.remark_key = _normalize(remark)
+
+    def keys(self) -> list[str]:
+        """参与检索的字符串（已规范化）"""
+        return [k for k in (self.name_key, self.remark_key, self.initials, self.pinyin) if k]
+
+    def prefixes(self) -> set[str]:
+        """各检索键的首字符（前缀匹配只可能出现在这些联系人中）"""
+        return {k[0] for k in self.keys()}
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "app_type": self.app_type,
+            "remark": self.remark,
+            "initials": self.initials,
+            "devices": sorted(self.devices, key=self.devices.get, reverse=True),
+        }
+
+
+class _DeviceContacts:
+    """一台设备在一个应用下的联系人来源"""
+
+    __slots__ = ("listed", "learned", "refreshed_at")
+
+    def __init__(self):
+        self.listed: dict[str, str] = {}        # 最近一次采集的联系人 -> 备注
+        self.learned: dict[str, float] = {}     # 收发消息时确认过的联系人 -> 时间
+        self.refreshed_at = 0.0
+
+    def names(self) -> set[str]:
+        return set(self.listed) | set(self.learned)
+
+
+class ContactIndex:
+    """全设备联系人倒排索引（在事件循环中使用，不加锁）"""
+
+    def __init__(self, store_path: Optional[str] = None, save_delay: float = 2.0):
+        """
+        Args:
+            store_path: 各设备联系人列表的持久化文件，为空则不持久化
+            save_delay: 更新后延迟写入的秒数，期间的多次更新只写一次
+        """
+        self.store_path = store_path
+        self.save_delay = save_delay
+        self._save_timer: Optional[asyncio.TimerHandle] = None
+        self._saving: Optional[asyncio.Future] = None
+        self._write_lock = threading.Lock()
+        self._save_seq = 0          # 快照序号，较旧的快照不覆盖较新的
+        self._written_seq = 0
+        self._entries: dict[tuple[str, str], ContactEntry] = {}        # (app_type, name) -> 联系人
+        self._postings: dict[str, set[tuple[str, str]]] = {}           # 字符 -> 联系人键
+        self._prefixes: dict[str, set[tuple[str, str]]] = {}           # 名称/拼音首字符 -> 联系人键
+        self._sources: dict[tuple[str, str], _DeviceContacts] = {}     # (device_id, app_type) -> 来源
+        self._dirty = False
+        self._load()
+
+    # ---------------- 写入 ----------------
+
+    def update(self, device_id: str, app_type: str, contacts: Iterable[ContactItem]) -> dict:
+        """
+        用设备最新采集的联系人列表增量更新索引
+
+        只处理与上次采集相比新增、消失或备注变化的联系人；收发消息时确认过的联系人不因
+        本次列表中没有而移除（设备端采集只覆盖通讯录前几屏）。
+
+        Returns:
+            {"added": 新增数, "removed": 移除数, "total": 本设备联系人数}
+        """
+        listed = {}
+        for item in contacts:
+            name, remark = _parse_contact(item)
+            if name:
+                listed[name] = remark or listed.get(name, "")
+        source = self._sources.setdefault((device_id, app_type), _DeviceContacts())
+        before = source.names()
+        now = time.time()
+        for name, remark in listed.items():
+            if name not in before or source.listed.get(name) != remark:
+                self._link(device_id, app_type, name, remark, now)
+            else:
+                self._entries[(app_type, name)].devices[device_id] = now
+        gone = set(source.listed) - set(listed) - set(source.learned)
+        for name in gone:
+            self._unlink(device_id, app_type, name)
+        added = len(set(listed) - before)
+        source.listed = listed
+        source.refreshed_at = now
+        self._dirty = True
+        self.schedule_save()
+        logger.info(f"联系人索引已更新: {device_id} {app_type} 新增={added} 移除={len(gone)} 共={len(source.names())}")
+        return {"added": added, "removed": len(gone), "total": len(source.names())}
+
+    def learn(self, device_id: str, app_type: str, name: str) -> None:
+        """记录设备认识该联系人（发送/读取消息成功时调用）"""
+        name = str(name).strip()
+        if not name:
+            return
+        source = self._sources.setdefault((device_id, app_type), _DeviceContacts())
+        known = name in source.listed or name in source.learned
+        source.learned[name] = time.time()
+        if known:
+            self._entries[(app_type, name)].devices[device_id] = source.learned[name]
+            return
+        self._link(device_id, app_type, name, "", source.learned[name])
+        self._dirty = True
+        self.schedule_save()
+
+    def remove_device(self, device_id: str) -> int:
+        """移除设备的全部联系人，返回移除的关联数"""
+        count = 0
+        for device, app_type in [k for k in self._sources if k[0] == device_id]:
+            for name in self._sources.pop((device, app_type)).names():
+                self._unlink(device_id, app_type, name)
+                count += 1
+        if count:
+            self._dirty = True
+            self.schedule_save()
+        return count
+
+    # ---------------- 查询 ----------------
+
+    def search(
+        self,
+        q: str,
+        app_type: Optional[str] = None,
+        device_id: Optional[str] = None,
+        limit: int = 20,
+        devices: Optional[Collection[str]] = None,
+    ) -> list[dict]:
+        """
+        按名称、备注、拼音首字母或全拼检索（不区分大小写、忽略空白）
+
+        结果按匹配程度排序：名称完全一致 > 名称前缀 > 拼音前缀 > 备注 > 其它子串。
+        先只在「名称/拼音/备注以查询首字符开头」的联系人中找前缀匹配，足够 limit 条时不再
+        扫描全部候选；单字查询的候选往往占索引很大比例，只做前缀匹配。
+        devices 限定只检索这些设备认识的联系人，结果中也只列出这些设备。
+        """
+        query = _normalize(q)
+        if not query:
+            return []
+        postings = sorted((self._postings.get(ch, set()) for ch in set(query)), key=len)
+        if not postings[0]:
+            return []
+        prefixed = self._prefixes.get(query[0], set())
+        matches = self._match(prefixed.intersection(*postings), query, app_type, device_id, devices)
+        if len(query) > 1 and sum(m[0] <= _RANK_PINYIN for m in matches) < limit:
+            matches = self._match(set.intersection(*postings), query, app_type, device_id, devices)
+        top = heapq.nsmallest(limit, matches)
+        results = [{**self._entries[m[3]].to_dict(), "match": _RANK_LABELS[m[0]]} for m in top]
+        if devices is not None:
+            for item in results:
+                item["devices"] = [d for d in item["devices"] if d in devices]
+        return results
+
+    def _match(
+        self, keys: set, query: str, app_type: Optional[str], device_id: Optional[str],
+        devices: Optional[Collection[str]] = None,
+    ) -> list[tuple]:
+        entries = self._entries
+        matches = []
+        for key in keys:
+            entry = entries[key]
+            if app_type is not None and key[0] != app_type:
+                continue
+            if device_id is not None and device_id not in entry.devices:
+                continue
+            if devices is not None and not any(d in devices for d in entry.devices):
+                continue
+            rank = _rank(entry, query)
+            if rank is not None:
+                matches.append((rank, len(entry.name), entry.name, key))
+        return matches
+
+    def locate(self, name: str, app_type: str) -> list[str]:
+        """认识该联系人（名称完全一致）的设备，最近确认的在前"""
+        entry = self._entries.get((app_type, str(name).strip()))
+        if entry is None:
+            return []
+        return sorted(entry.devices, key=entry.devices.get, reverse=True)
+
+    def due(self, max_age: float) -> list[tuple[str, str]]:
+        """超过 max_age 秒未重新采集的 (设备, 应用)，最久未采集的在前；从未采集过的不列出"""
+        deadline = time.time() - max_age
+        due = [(s.refreshed_at, key) for key, s in self._sources.items() if 0 < s.refreshed_at < deadline]
+        return [key for _, key in sorted(due)]
+
+    def stats(self, devices: Optional[Collection[str]] = None) -> dict:
+        """索引统计；devices 限定只统计这些设备的联系人（不含全局的倒排表规模）"""
+        sources = {k: s for k, s in self._sources.items() if devices is None or k[0] in devices}
+        if devices is None:
+            contacts = len(self._entries)
+        else:
+            contacts = len({(app_type, name) for (_, app_type), s in sources.items() for name in s.names()})
+        data = {
+            "contacts": contacts,
+            "devices": len({device_id for device_id, _ in sources}),
+            "pinyin": "pypinyin" if lazy_pinyin is not None else "gbk",
+            "sources": [
+                {"device_id": device_id, "app_type": app_type, "listed": len(s.listed),
+                 "learned": len(s.learned), "refreshed_at": s.refreshed_at or None}
+                for (device_id, app_type), s in sources.items()
+            ],
+        }
+        if devices is None:
+            data["postings"] = len(self._postings)
+        return data
+
+    # ---------------- 持久化 ----------------
+
+    def schedule_save(self) -> None:
+        """
+        延迟 save_delay 秒后在线程池中写入持久化文件（需在事件循环中调用，否则立即同步写入）
+
+        写入前在事件循环中复制各设备的列表，写入期间索引可继续更新；上一次写入未完成时顺延。
+        """
+        if not self.store_path:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.save()
+            return
+        if self._save_timer is None:
+            self._save_timer = loop.call_later(self.save_delay, self._save_in_background)
+
+    def save(self, force: bool = False) -> None:
+        """有未保存的变化时立即写入持久化文件（同步，用于关闭时）"""
+        if self._save_timer is not None:
+            self._save_timer.cancel()
+            self._save_timer = None
+        if not self.store_path or not (self._dirty or force):
+            return
+        seq, data = self._snapshot()
+        if not self._write(seq, data):
+            self._dirty = True
+
+    def _save_in_background(self) -> None:
+        self._save_timer = None
+        if not self._dirty:
+            return
+        if self._saving is not None and not self._saving.done():
+            self.schedule_save()
+            return
+        seq, data = self._snapshot()
+        self._saving = asyncio.get_running_loop().run_in_executor(None, self._write, seq, data)
+        self._saving.add_done_callback(self._saved)
+
+    def _saved(self, future: asyncio.Future) -> None:
+        if future.cancelled() or future.exception() is not None or not future.result():
+            self._dirty = True
+
+    def _snapshot(self) -> tuple[int, list]:
+        """复制当前各设备的列表并清除未保存标记"""
+        self._save_seq += 1
+        self._dirty = False
+        return self._save_seq, [
+            {"device_id": device_id, "app_type": app_type, "refreshed_at": s.refreshed_at,
+             "listed": dict(s.listed), "learned": dict(s.learned)}
+            for (device_id, app_type), s in self._sources.items()
+        ]
+
+    def _write(self, seq: int, data: list) -> bool:
+        """写临时文件后替换（可在线程池中执行）"""
+        tmp_path = f"{self.store_path}.tmp"
+        with self._write_lock:
+            if seq < self._written_seq:
+                return True
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(tmp_path, self.store_path)
+                self._written_seq = seq
+                return True
+            except OSError as e:
+                logger.error(f"保存联系人索引失败: {self.store_path} - {e}")
+                return False
+
+    def _load(self) -> None:
+        if not self.store_path or not os.path.exists(self.store_path):
+            return
+        try:
+            with open(self.store_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for item in data:
+                device_id, app_type = item["device_id"], item["app_type"]
+                source = self._sources.setdefault((device_id, app_type), _DeviceContacts())
+                source.listed = dict(item.get("listed") or {})
+                source.learned = dict(item.get("learned") or {})
+                source.refreshed_at = item.get("refreshed_at") or 0.0
+                for name, remark in source.listed.items():
+                    self._link(device_id, app_type, name, remark, source.refreshed_at)
+                for name, seen_at in source.learned.items():
+                    self._link(device_id, app_type, name, source.listed.get(name, ""), seen_at)
+            logger.info(f"已加载联系人索引: {len(self._entries)} 个联系人 ({self.store_path})")
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            logger.error(f"加载联系人索引失败: {self.store_path} - {e}")
+
+    # ---------------- 内部 ----------------
+
+    def _link(self, device_id: str, app_type: str, name: str, remark: str, seen_at: float) -> None:
+        key = (app_type, name)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = ContactEntry(name, app_type, remark)
+            self._index(key, entry)
+        elif remark and remark != entry.remark:
+            self._unindex(key, entry)
+            entry.set_remark(remark)
+            self._index(key, entry)
+        entry.devices[device_id] = max(seen_at, entry.devices.get(device_id, 0.0))
+
+    def _unlink(self, device_id: str, app_type: str, name: str) -> None:
+        key = (app_type, name)
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        entry.devices.pop(device_id, None)
+        if not entry.devices:
+            self._unindex(key, entry)
+            del self._entries[key]
+
+    def _index(self, key: tuple[str, str], entry: ContactEntry) -> None:
+        for ch in set("".join(entry.keys())):
+            self._postings.setdefault(ch, set()).add(key)
+        for ch in entry.prefixes():
+            self._prefixes.setdefault(ch, set()).add(key)
+
+    def _unindex(self, key: tuple[str, str], entry: ContactEntry) -> None:
+        for table, chars in ((self._postings, set("".join(entry.keys()))), (self._prefixes, entry.prefixes())):
+            for ch in chars:
+                keys = table.get(ch)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del table[ch]
+
+
+_RANK_LABELS = ("exact", "prefix", "pinyin", "remark", "contains")
+_RANK_PINYIN = 2
+
+
+def _rank(entry: ContactEntry, query: str) -> Optional[int]:
+    """匹配程度（越小越靠前），不匹配时返回 None"""
+    name = entry.name_key
+    if name == query:
+        return 0
+    if name.startswith(query):
+        return 1
+    if entry.initials.startswith(query) or (entry.pinyin and entry.pinyin.startswith(query)):
+        return 2
+    if entry.remark_key and query in entry.remark_key:
+        return 3
+    if query in name or query in entry.initials or (entry.pinyin and query in entry.pinyin):
+        return 4
+    return None
+
+
+def _parse_contact(item: ContactItem) -> tuple[str, str]:
+    if isinstance(item, dict):
+        name = item.get("name") or item.get("nickname") or ""
+        remark = item.get("remark") or ""
+        return str(name).strip(), str(remark).strip()
+    return str(item).strip(), ""
@@ -11,9 +11,14 @@ Android设备API客户端
     messages = client.read_messages("张三", count=5)
 """
 import time
+import uuid
 import logging
 from typing import Optional, Literal
 import requests
+from requests.adapters import BaseAdapter
+
+from .results import TaskResult
+from .result_store import ResultStore
 
 AppType = Literal["wechat", "wework"]
 
@@ -28,16 +33,45 @@ class DeviceClient:
     驱动AccessibilityService执行自动化操作。
     """
 
-    def __init__(self, api_base: str, timeout: int = 60):
+    def __init__(
+        self,
+        api_base: str,
+        timeout: int = 60,
+        device_id: str = "",
+        result_store: Optional[ResultStore] = None,
+        transport: Optional[BaseAdapter] = None,
+    ):
         """
         Args:
             api_base: Android设备HTTP服务器地址，如 http://192.168.1.100:9527
             timeout: 单次请求与任务轮询的超时时间（秒），建议 ≥30，避免 get_contact_list 等耗时接口读超时
+            device_id: 设备标识，用于结果存储中区分设备（默认使用 api_base）
+            result_store: 任务结果存储；提供时登记提交的任务，已完成任务的结果不再向设备查询
+            transport: requests 传输适配器（如录制/回放，见 transport.py），默认直接访问设备
         """
         self.api_base = api_base.rstrip("/")
         self.timeout = timeout
-        self.session = requests.Session()
-        self.session.headers.update({"Content-Type": "application/json"})
+        self.device_id = device_id or self.api_base
+        self.result_store = result_store
+        self.transport = transport
+        self._session: Optional[requests.Session] = None
+
+    @property
+    def session(self) -> requests.Session:
+        """HTTP 会话（连接池），首次请求时创建"""
+        if self._session is None:
+            self._session = requests.Session()
+            self._session.headers.update({"Content-Type": "application/json"})
+            if self.transport is not None:
+                self._session.mount("http://", self.transport)
+                self._session.mount("https://", self.transport)
+        return self._session
+
+    def close(self) -> None:
+        """关闭连接池；之后再次调用接口会重新创建会话"""
+        session, self._session = self._session, None
+        if session is not None:
+            session.close()
 
     # ================================================================
     # 状态查询
@@ -190,6 +224,39 @@ class DeviceClient:
                 return self._wait_for_result(task_id)
         return resp
 
+    # ================================================================
+    # 聊天会话
+    # ================================================================
+
+    def chat_session(
+        self,
+        contact: str,
+        actions: list,
+        wait: bool = True,
+        app_type: AppType = "wework",
+    ) -> dict:
+        """
+        聊天会话：设备端只搜索、打开一次聊天窗口，再按顺序执行多个动作
+
+        Args:
+            contact: 联系人或群组名称
+            actions: 动作列表，如 [{"type": "send", "message": "你好"},
+                     {"type": "read", "count": 5}, {"type": "group_members"}]
+            wait: 是否等待执行完成
+            app_type: 目标应用 "wechat" | "wework"
+        """
+        resp = self._post("/api/chat_session", {
+            "contact": contact,
+            "actions": actions,
+            "app_type": app_type,
+        })
+
+        if wait and resp.get("success"):
+            task_id = resp.get("data", {}).get("task_id", "")
+            if task_id:
+                return self._wait_for_result(task_id)
+        return resp
+
     def get_contact_list(self, app_type: AppType = "wework") -> dict:
         """
         获取联系人列表（通讯录当前页可见项）
@@ -213,8 +280,25 @@ class DeviceClient:
         return resp.get("data", "")
 
     def get_task_result(self, task_id: str) -> dict:
-        """查询任务执行结果"""
-        return self._get(f"/api/task_result/{task_id}")
+        """查询任务执行结果（有结果存储时，已完成的任务直接从存储返回）"""
+        store = self.result_store
+        if store is not None:
+            cached = store.result(task_id)
+            if cached is not None:
+                return {"success": True, "message": "ok", "data": cached}
+        resp = self._get(f"/api/task_result/{task_id}")
+        if store is not None:
+            data = resp.get("data")
+            if isinstance(data, dict) and data.get("success") is not None:
+                result = TaskResult.from_device(data).model_dump()
+                store.complete(self.device_id, task_id, result)
+                return {**resp, "data": result}
+            store.mark_checked(task_id)
+        return resp
+
+    def wait_for_task(self, task_id: str) -> dict:
+        """轮询等待已提交的任务完成（用于 wait=False 提交后再取结果）"""
+        return self._wait_for_result(task_id)
 
     # ================================================================
     # 内部方法
@@ -231,8 +315,18 @@ class DeviceClient:
         timeout: Optional[int] = None,
         retries: Optional[int] = None,
     ) -> dict:
-        """发送POST请求（使用 self.timeout）"""
-        return self._request("post", path, data, timeout=timeout, retries=retries)
+        """发送POST请求（使用 self.timeout）；提交成功的任务登记到结果存储"""
+        resp = self._request("post", path, data, timeout=timeout, retries=retries)
+        if self.result_store is not None and resp.get("success"):
+            # get_contact_list 等同步接口的 data 为结果本身（如列表），没有 task_id
+            result = resp.get("data")
+            task_id = result.get("task_id", "") if isinstance(result, dict) else ""
+            if task_id:
+                self.result_store.track(
+                    self.device_id, data.get("app_type", ""), path.rsplit("/", 1)[-1], task_id,
+                    target=data.get("contact") or data.get("group_name") or "",
+                )
+        return resp
 
     def _request(
         self,
@@ -242,17 +336,23 @@ class DeviceClient:
         retries: Optional[int] = None,
         timeout: Optional[int] = None,
     ) -> dict:
-        """发送 HTTP 请求，超时或连接失败时自动重试，减轻偶发断线影响"""
+        """
+        发送 HTTP 请求，超时或连接失败时自动重试，减轻偶发断线影响
+
+        POST 请求每次调用生成一个 Idempotency-Key，重试时沿用，
+        设备端据此去重，避免超时重试导致任务重复提交（如消息发送两次）
+        """
         url = f"{self.api_base}{path}"
         last_error = None
         _timeout = timeout if timeout is not None else self.timeout
         _retries = retries if retries is not None else 2
+        headers = {"Idempotency-Key": uuid.uuid4().hex} if method == "post" else None
         for attempt in range(_retries):
             try:
                 if method == "get":
                     resp = self.session.get(url, timeout=_timeout)
                 else:
-                    resp = self.session.post(url, json=data, timeout=_timeout)
+                    resp = self.session.post(url, json=data, timeout=_timeout, headers=headers)
                 resp.raise_for_status()
                 return resp.json()
             except requests.ConnectionError as e:
@@ -277,13 +377,13 @@ class DeviceClient:
         return {"success": False, "message": str(last_error)}
 
     def _wait_for_result(self, task_id: str, poll_interval: float = 2.0) -> dict:
-        """轮询等待任务完成"""
+        """轮询等待任务完成；结果中的 data 在此解码一次（见 results.TaskResult）"""
         start_time = time.time()
         while time.time() - start_time < self.timeout:
             result = self.get_task_result(task_id)
             data = result.get("data", {})
             if isinstance(data, dict) and data.get("success") is not None:
-                return data
+                return TaskResult.from_device(data).model_dump()
             time.sleep(poll_interval)
 
         return {"success": False, "message": f"任务超时 ({self.timeout}s): {task_id}"}
@@ -4,10 +4,17 @@
 
 管理多台Android设备的连接和任务分发，
 支持多账号托管场景下的负载均衡和故障转移。
+
+注册设备只记录配置，DeviceClient 在首次使用时才创建；设置 idle_timeout 后，
+长时间未使用的客户端会被回收（关闭连接池），再次使用时重新创建。
 """
+import time
 import logging
-from typing import Optional
+import threading
+from typing import Collection, Optional
 from .device_client import DeviceClient
+from .result_store import ResultStore
+from .transport import TransportFactory
 
 logger = logging.getLogger(__name__)
 
@@ -28,38 +35,107 @@ class DeviceManager:
         online = manager.get_online_devices()
     """
 
-    def __init__(self):
+    def __init__(
+        self,
+        idle_timeout: float = 0,
+        result_store: Optional[ResultStore] = None,
+        transport: Optional[TransportFactory] = None,
+    ):
+        """
+        Args:
+            idle_timeout: 客户端空闲超过该秒数后回收；0 表示不回收
+            result_store: 各设备客户端共用的任务结果存储
+            transport: 按设备地址创建 requests 传输适配器（录制/回放），默认直接访问设备
+        """
+        self.idle_timeout = idle_timeout
+        self.result_store = result_store
+        self.transport = transport
         self._devices: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._last_evict = time.monotonic()
 
     def add_device(self, device_id: str, api_base: str, name: str = "", **kwargs):
         """
-        注册设备
+        注册设备（不建立连接，客户端在首次使用时创建）
 
         Args:
             device_id: 设备唯一标识
             api_base: 设备HTTP API地址
             name: 设备名称/备注
         """
-        client = DeviceClient(api_base)
         self._devices[device_id] = {
             "id": device_id,
             "name": name or device_id,
             "api_base": api_base,
-            "client": client,
+            "client": None,
+            "last_used": 0.0,
             **kwargs,
         }
-        logger.info(f"设备已注册: {device_id} ({api_base})")
+        logger.debug(f"设备已注册: {device_id} ({api_base})")
 
     def remove_device(self, device_id: str):
         """移除设备"""
-        if device_id in self._devices:
-            del self._devices[device_id]
+        device = self._devices.pop(device_id, None)
+        if device is not None:
+            if device["client"] is not None:
+                device["client"].close()
             logger.info(f"设备已移除: {device_id}")
 
+    def has_device(self, device_id: str) -> bool:
+        """设备是否已注册（不创建客户端）"""
+        return device_id in self._devices
+
     def get_device(self, device_id: str) -> Optional[DeviceClient]:
-        """获取指定设备的客户端"""
+        """获取指定设备的客户端（首次使用时创建）"""
         device = self._devices.get(device_id)
-        return device["client"] if device else None
+        if device is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            client = device["client"]
+            if client is None:
+                client = device["client"] = DeviceClient(
+                    device["api_base"], device_id=device_id, result_store=self.result_store,
+                    transport=self.transport(device["api_base"]) if self.transport else None,
+                )
+                logger.info(f"设备客户端已创建: {device_id} ({device['api_base']})")
+            device["last_used"] = now
+        if self.idle_timeout > 0 and now - self._last_evict > self.idle_timeout / 2:
+            self.evict_idle()
+        return client
+
+    def evict_idle(self, max_idle: Optional[float] = None) -> int:
+        """
+        回收空闲客户端
+
+        Args:
+            max_idle: 空闲秒数阈值，默认使用 idle_timeout
+
+        Returns:
+            回收的客户端数量
+        """
+        max_idle = self.idle_timeout if max_idle is None else max_idle
+        now = time.monotonic()
+        self._last_evict = now
+        evicted = []
+        with self._lock:
+            for device in self._devices.values():
+                if device["client"] is not None and now - device["last_used"] > max_idle:
+                    evicted.append(device["client"])
+                    device["client"] = None
+        # 正在使用旧引用的调用不受影响：close 后该客户端会按需重建会话
+        for client in evicted:
+            client.close()
+        if evicted:
+            logger.info(f"已回收 {len(evicted)} 个空闲设备客户端")
+        return len(evicted)
+
+    def stats(self) -> dict:
+        """已注册设备数与当前已创建的客户端数"""
+        return {
+            "registered": len(self._devices),
+            "active_clients": sum(d["client"] is not None for d in self._devices.values()),
+        }
 
     def get_all_devices(self) -> dict:
         """获取所有已注册设备"""
@@ -75,9 +151,9 @@ class DeviceManager:
     def get_online_devices(self) -> list[str]:
         """获取所有在线（可连接）的设备ID"""
         online = []
-        for device_id, device in self._devices.items():
-            client: DeviceClient = device["client"]
-            if client.is_ready():
+        for device_id in list(self._devices):
+            client = self.get_device(device_id)
+            if client is not None and client.is_ready():
                 online.append(device_id)
         return online
 
@@ -91,19 +167,22 @@ class DeviceManager:
         except Exception as e:
             return {"error": str(e)}
 
-    def broadcast_message(self, contact: str, message: str) -> dict:
+    def broadcast_message(self, contact: str, message: str, device_ids: Optional[Collection[str]] = None) -> dict:
         """
         向所有在线设备广播消息（每个设备都发送相同消息给指定联系人）
 
         Args:
             contact: 联系人名称
             message: 消息内容
+            device_ids: 只向其中的设备广播，为空则为全部在线设备
 
         Returns:
             各设备的执行结果
         """
         results = {}
         for device_id in self.get_online_devices():
+            if device_ids is not None and device_id not in device_ids:
+                continue
             client = self.get_device(device_id)
             if client:
                 results[device_id] = client.send_message(contact, message, wait=False)
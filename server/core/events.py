@@ -0,0 +1,682 @@
+# -*- coding: utf-8 -*-
+"""
+事件总线与 Webhook 推送
+
+集成方原本只能反复轮询 /api/tasks、/api/task_result 获知任务结果。网关内部产生的事件
+经事件总线按订阅推送到对方的 Webhook 地址，下游批量消费，不再轮询：
+
+    - 事件：task.submitted / task.completed / task.timeout（经网关提交的任务）、
+      device.online / device.offline（设备状态探测）、message.received（读消息结果中新出现的对方消息）
+    - 订阅：Webhook 地址 + 事件类型（支持 "task.*"、"*"）+ 可选的设备过滤，持久化到 JSON 文件
+    - 发件箱：每个订阅一个。事件先追加写入发件箱（分段 JSONL 文件 + 游标文件），推送成功后
+      前移游标、删除已送达的段；网关重启后从游标继续推送，对端故障期间事件不丢失
+    - 攒批：首个事件到达后最多等待 batch_interval 秒或攒满 batch_size 个，一次 POST 推送
+    - 压缩与签名：请求体不小于 compress_min_size 字节时 gzip 压缩（Content-Encoding: gzip）；
+      设置了 secret 的订阅带 X-Webhook-Signature: sha256=<HMAC-SHA256(secret, 未压缩的请求体)>
+    - 重试：推送失败（网络错误、非 2xx）按指数退避加随机抖动重试，对端返回 Retry-After 时按其等待；
+      积压超过 max_outbox 时丢弃最早的事件并计数
+    - 至少一次投递：重试可能重复推送同一批事件，接收方按事件 id 去重
+
+请求体:
+    {"subscription_id": "...", "batch_id": "...", "sent_at": 1700000000.0,
+     "events": [{"id": "...", "type": "task.completed", "time": 1700000000.0, "device_id": "device_1", "data": {...}}]}
+
+使用示例:
+    bus = EventBus(store_path="webhooks.json", outbox_dir="webhook_outbox")
+    bus.subscribe("https://example.com/hook", events=["task.*"], secret="s3cret")
+    bus.start()                                         # 在事件循环中调用
+    bus.publish("task.completed", {"task_id": "..."}, device_id="device_1")   # 可在任意线程调用
+"""
+import os
+import gzip
+import hmac
+import json
+import time
+import uuid
+import random
+import shutil
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import Any, Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+EVENT_TASK_SUBMITTED = "task.submitted"
+EVENT_TASK_COMPLETED = "task.completed"
+EVENT_TASK_TIMEOUT = "task.timeout"
+EVENT_DEVICE_ONLINE = "device.online"
+EVENT_DEVICE_OFFLINE = "device.offline"
+EVENT_MESSAGE_RECEIVED = "message.received"
+EVENT_PING = "webhook.ping"         # 只发给指定订阅的测试事件
+EVENT_TYPES = (
+    EVENT_TASK_SUBMITTED, EVENT_TASK_COMPLETED, EVENT_TASK_TIMEOUT,
+    EVENT_DEVICE_ONLINE, EVENT_DEVICE_OFFLINE, EVENT_MESSAGE_RECEIVED,
+)
+
+
+def _match(pattern: str, event_type: str) -> bool:
+    if pattern == "*" or pattern == event_type:
+        return True
+    return pattern.endswith(".*") and event_type.startswith(pattern[:-1])
+
+
+class Subscription:
+    """Webhook 订阅"""
+
+    def __init__(
+        self,
+        subscription_id: str,
+        url: str,
+        events: Optional[list[str]] = None,
+        device_ids: Optional[list[str]] = None,
+        secret: str = "",
+        description: str = "",
+        created_at: Optional[float] = None,
+        tenant_id: str = "",
+    ):
+        self.subscription_id = subscription_id
+        self.url = url
+        self.events = list(events or ["*"])
+        self.device_ids = list(device_ids or [])
+        self.secret = secret
+        self.description = description
+        self.created_at = created_at or time.time()
+        self.tenant_id = tenant_id          # 创建订阅的租户
+
+    def matches(self, event_type: str, device_id: str = "") -> bool:
+        if self.device_ids and device_id and device_id not in self.device_ids:
+            return False
+        return any(_match(p, event_type) for p in self.events)
+
+    def to_dict(self, with_secret: bool = False) -> dict:
+        return {
+            "subscription_id": self.subscription_id,
+            "url": self.url,
+            "events": self.events,
+            "device_ids": self.device_ids,
+            "secret": self.secret if with_secret else ("******" if self.secret else ""),
+            "description": self.description,
+            "created_at": self.created_at,
+            "tenant_id": self.tenant_id,
+        }
+
+
+# ================================================================
+# 发件箱：append 可在任意线程调用；peek / ack / drop 只由该订阅的推送协程（经线程池）调用
+# ================================================================
+
+class _MemoryOutbox:
+    """内存发件箱（未配置发件箱目录时使用，重启后丢失）"""
+
+    def __init__(self):
+        self._lines: deque[bytes] = deque()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._lines)
+
+    def append(self, line: bytes) -> int:
+        with self._lock:
+            self._lines.append(line)
+            return len(self._lines)
+
+    def peek(self, limit: int) -> tuple[list[bytes], Any]:
+        with self._lock:
+            lines = list(islice(self._lines, limit))
+        return lines, len(lines)
+
+    def ack(self, token: Any) -> None:
+        with self._lock:
+            for _ in range(min(token, len(self._lines))):
+                self._lines.popleft()
+
+    def drop(self, count: int) -> int:
+        lines, token = self.peek(count)
+        self.ack(token)
+        return len(lines)
+
+    def close(self) -> None:
+        pass
+
+
+class _FileOutbox:
+    """
+    磁盘发件箱：事件逐行追加到分段文件（00000001.jsonl …），cursor 文件记录第一条未送达事件的
+    (段号, 偏移)。送达后只前移游标，整段送达后删除该段，不重写文件
+    """
+
+    SEGMENT_BYTES = 4 * 1024 * 1024
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        segments = self._segments()
+        self._cursor = self._read_cursor(segments)
+        self._write_seg = max(segments[-1] if segments else 1, self._cursor[0])
+        self._file = self._open_segment(self._write_seg)
+        self._size = self._file.tell()
+        self._count = self._count_pending()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, line: bytes) -> int:
+        with self._lock:
+            if self._size >= self.SEGMENT_BYTES:
+                self._file.close()
+                self._write_seg += 1
+                self._file = self._open_segment(self._write_seg)
+                self._size = 0
+            # 写入操作系统缓存即返回：进程崩溃不丢，断电可能丢失最近的事件
+            self._file.write(line + b"\n")
+            self._file.flush()
+            self._size += len(line) + 1
+            self._count += 1
+            return self._count
+
+    def peek(self, limit: int) -> tuple[list[bytes], Any]:
+        """从游标起读取最多 limit 条事件；返回 (事件行, 送达后的游标)"""
+        with self._lock:
+            seg, offset = self._cursor
+            lines: list[bytes] = []
+            while len(lines) < limit:
+                try:
+                    with open(self._segment_path(seg), "rb") as f:
+                        f.seek(offset)
+                        for line in f:
+                            if not line.endswith(b"\n"):
+                                break
+                            lines.append(line[:-1])
+                            offset += len(line)
+                            if len(lines) >= limit:
+                                break
+                except FileNotFoundError:
+                    pass
+                if len(lines) >= limit or seg >= self._write_seg:
+                    break
+                seg, offset = seg + 1, 0
+            return lines, (seg, offset, len(lines))
+
+    def ack(self, token: Any) -> None:
+        seg, offset, count = token
+        with self._lock:
+            first = self._cursor[0]
+            self._cursor = (seg, offset)
+            self._count = max(0, self._count - count)
+            self._write_cursor()
+            for old in range(first, seg):
+                try:
+                    os.remove(self._segment_path(old))
+                except OSError:
+                    pass
+
+    def drop(self, count: int) -> int:
+        lines, token = self.peek(count)
+        self.ack(token)
+        return len(lines)
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+    # ---------------- 内部 ----------------
+
+    def _segment_path(self, seg: int) -> str:
+        return os.path.join(self.directory, f"{seg:08d}.jsonl")
+
+    def _segments(self) -> list[int]:
+        return sorted(int(name[:-6]) for name in os.listdir(self.directory)
+                      if name.endswith(".jsonl") and name[:-6].isdigit())
+
+    def _open_segment(self, seg: int):
+        path = self._segment_path(seg)
+        if os.path.exists(path):
+            # 上次进程在写入一行的中途退出时，截掉不完整的末行
+            with open(path, "rb+") as f:
+                data = f.read()
+                end = data.rfind(b"\n") + 1
+                if end != len(data):
+                    f.truncate(end)
+        return open(path, "ab")
+
+    def _read_cursor(self, segments: list[int]) -> tuple[int, int]:
+        try:
+            with open(os.path.join(self.directory, "cursor"), "r", encoding="utf-8") as f:
+                seg, offset = (int(x) for x in f.read().split())
+            return seg, offset
+        except (OSError, ValueError):
+            return (segments[0] if segments else 1), 0
+
+    def _write_cursor(self) -> None:
+        path = os.path.join(self.directory, "cursor")
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(f"{self._cursor[0]} {self._cursor[1]}")
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"保存发件箱游标失败: {path} - {e}")
+
+    def _count_pending(self) -> int:
+        count = 0
+        seg, offset = self._cursor
+        while seg <= self._write_seg:
+            try:
+                with open(self._segment_path(seg), "rb") as f:
+                    f.seek(offset)
+                    count += sum(1 for line in f if line.endswith(b"\n"))
+            except FileNotFoundError:
+                pass
+            seg, offset = seg + 1, 0
+        return count
+
+
+# ================================================================
+# 推送
+# ================================================================
+
+class _Delivery:
+    """单个订阅的发件箱与推送状态"""
+
+    def __init__(self, subscription: Subscription, outbox):
+        self.subscription = subscription
+        self.outbox = outbox
+        self.session = requests.Session()
+        self.wakeup: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+        self.delivered = 0
+        self.batches = 0
+        self.dropped = 0
+        self.failures = 0               # 连续失败次数，成功后清零
+        self.last_error = ""
+        self.last_delivery_at: Optional[float] = None
+        self.next_retry_at: Optional[float] = None
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self.outbox),
+            "delivered": self.delivered,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "last_delivery_at": self.last_delivery_at,
+            "next_retry_in": round(max(0.0, self.next_retry_at - time.time()), 1) if self.next_retry_at else None,
+        }
+
+
+class EventBus:
+    """事件发布与 Webhook 订阅推送（publish 线程安全，推送协程运行在事件循环中）"""
+
+    def __init__(
+        self,
+        store_path: Optional[str] = None,
+        outbox_dir: Optional[str] = None,
+        batch_size: int = 100,
+        batch_interval: float = 1.0,
+        timeout: float = 10,
+        compress_min_size: int = 1024,
+        retry_max_seconds: float = 300,
+        max_outbox: int = 100000,
+    ):
+        """
+        Args:
+            store_path: 订阅持久化文件，为空则不持久化
+            outbox_dir: 发件箱目录（每个订阅一个子目录），为空则只保存在内存
+            batch_size: 每次推送最多的事件数
+            batch_interval: 首个事件到达后最多等待的秒数
+            timeout: 推送请求超时（秒）
+            compress_min_size: 请求体不小于该字节数时 gzip 压缩
+            retry_max_seconds: 失败重试的最大退避间隔（秒）
+            max_outbox: 每个订阅最多积压的事件数，超出时丢弃最早的
+        """
+        self.store_path = store_path
+        self.outbox_dir = outbox_dir
+        self.batch_size = max(1, batch_size)
+        self.batch_interval = batch_interval
+        self.timeout = timeout
+        self.compress_min_size = compress_min_size
+        self.retry_max_seconds = retry_max_seconds
+        self.max_outbox = max(self.batch_size, max_outbox)
+        self.published = 0
+        self._deliveries: dict[str, _Delivery] = {}
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._load()
+
+    # ---------------- 订阅 ----------------
+
+    def subscribe(
+        self,
+        url: str,
+        events: Optional[list[str]] = None,
+        device_ids: Optional[list[str]] = None,
+        secret: str = "",
+        description: str = "",
+        tenant_id: str = "",
+    ) -> Subscription:
+        """
+        新增订阅
+
+        Raises:
+            ValueError: 地址不是 http(s) 或事件类型未知
+        """
+        if not url.startswith(("http://", "https://")):
+            raise ValueError(f"Webhook 地址须以 http:// 或 https:// 开头: {url}")
+        events = list(events or ["*"])
+        for pattern in events:
+            if not any(_match(pattern, t) for t in EVENT_TYPES):
+                raise ValueError(f"未知的事件类型: {pattern}，可选 {', '.join(EVENT_TYPES)}，或 task.*、*")
+        subscription = Subscription(
+            uuid.uuid4().hex[:12], url, events, device_ids, secret, description, tenant_id=tenant_id
+        )
+        delivery = self._open(subscription)
+        with self._lock:
+            self._deliveries[subscription.subscription_id] = delivery
+        self._save()
+        if self._loop is not None:
+            self._start_delivery(delivery)
+        logger.info(f"新增 Webhook 订阅: {subscription.subscription_id} -> {url} {events}")
+        return subscription
+
+    def unsubscribe(self, subscription_id: str) -> bool:
+        """删除订阅及其发件箱中未送达的事件（在事件循环中调用）"""
+        with self._lock:
+            delivery = self._deliveries.pop(subscription_id, None)
+        if delivery is None:
+            return False
+        self._save()
+        if delivery.task is not None:
+            delivery.task.cancel()
+        delivery.outbox.close()
+        delivery.session.close()
+        if self.outbox_dir:
+            shutil.rmtree(os.path.join(self.outbox_dir, subscription_id), ignore_errors=True)
+        return True
+
+    def get(self, subscription_id: str) -> Optional[Subscription]:
+        delivery = self._deliveries.get(subscription_id)
+        return delivery.subscription if delivery is not None else None
+
+    def list(self) -> list[Subscription]:
+        with self._lock:
+            return [d.subscription for d in self._deliveries.values()]
+
+    def stats(self, subscription_id: Optional[str] = None) -> dict:
+        """各订阅的积压、已送达、丢弃、连续失败次数与下次重试时间"""
+        with self._lock:
+            deliveries = list(self._deliveries.values())
+        return {
+            d.subscription.subscription_id: d.stats()
+            for d in deliveries
+            if subscription_id is None or d.subscription.subscription_id == subscription_id
+        }
+
+    # ---------------- 发布 ----------------
+
+    def wants(self, event_type: str, device_id: str = "") -> bool:
+        """是否有订阅关心该事件（发布方据此跳过不必要的探测、查询）"""
+        with self._lock:
+            return any(d.subscription.matches(event_type, device_id) for d in self._deliveries.values())
+
+    def publish(
+        self,
+        event_type: str,
+        data: Any = None,
+        device_id: str = "",
+        subscription_id: Optional[str] = None,
+    ) -> Optional[dict]:
+        """
+        发布事件：写入匹配订阅的发件箱，由推送协程批量送出（可在任意线程调用）
+
+        Args:
+            subscription_id: 只发给该订阅（不检查事件类型，用于测试推送）
+
+        Returns:
+            事件；没有匹配的订阅时返回 None
+        """
+        with self._lock:
+            if subscription_id is not None:
+                targets = [d for d in (self._deliveries.get(subscription_id),) if d is not None]
+            else:
+                targets = [d for d in self._deliveries.values() if d.subscription.matches(event_type, device_id)]
+        if not targets:
+            return None
+        event = {
+            "id": uuid.uuid4().hex,
+            "type": event_type,
+            "time": round(time.time(), 3),
+            "device_id": device_id,
+            "data": data,
+        }
+        line = json.dumps(event, ensure_ascii=False, default=str).encode("utf-8")
+        for delivery in targets:
+            pending = delivery.outbox.append(line)
+            # 只在发件箱由空变为非空、或攒满一批时唤醒推送协程
+            if pending == 1 or pending >= self.batch_size:
+                self._notify(delivery)
+        self.published += 1
+        return event
+
+    # ---------------- 生命周期 ----------------
+
+    def start(self) -> None:
+        """启动各订阅的推送协程（需在事件循环中调用）"""
+        self._loop = asyncio.get_running_loop()
+        with self._lock:
+            deliveries = list(self._deliveries.values())
+        for delivery in deliveries:
+            self._start_delivery(delivery)
+
+    async def stop(self) -> None:
+        """停止推送；未送达（含推送中）的事件留在发件箱，下次启动后重新推送"""
+        with self._lock:
+            deliveries = list(self._deliveries.values())
+        tasks = [d.task for d in deliveries if d.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for delivery in deliveries:
+            delivery.task = None
+            delivery.session.close()
+        self._loop = None
+
+    # ---------------- 内部 ----------------
+
+    def _open(self, subscription: Subscription) -> _Delivery:
+        if self.outbox_dir:
+            outbox = _FileOutbox(os.path.join(self.outbox_dir, subscription.subscription_id))
+        else:
+            outbox = _MemoryOutbox()
+        return _Delivery(subscription, outbox)
+
+    def _start_delivery(self, delivery: _Delivery) -> None:
+        delivery.wakeup = asyncio.Event()
+        delivery.task = asyncio.ensure_future(self._deliver_loop(delivery))
+
+    def _notify(self, delivery: _Delivery) -> None:
+        loop, wakeup = self._loop, delivery.wakeup
+        if loop is None or wakeup is None:
+            return
+        try:
+            loop.call_soon_threadsafe(wakeup.set)
+        except RuntimeError:
+            pass    # 事件循环已关闭
+
+    async def _deliver_loop(self, delivery: _Delivery) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            if not len(delivery.outbox):
+                delivery.wakeup.clear()
+                await delivery.wakeup.wait()
+                continue
+            # 攒批：等到攒满一批或首个事件到达后 batch_interval 秒
+            deadline = loop.time() + self.batch_interval
+            while len(delivery.outbox) < self.batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                delivery.wakeup.clear()
+                try:
+                    await asyncio.wait_for(delivery.wakeup.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._deliver_batch(delivery)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Webhook 推送异常: {delivery.subscription.subscription_id} - {e}")
+                await asyncio.sleep(1)
+
+    async def _deliver_batch(self, delivery: _Delivery) -> None:
+        loop = asyncio.get_running_loop()
+        subscription = delivery.subscription
+        excess = len(delivery.outbox) - self.max_outbox
+        if excess > 0:
+            dropped = await loop.run_in_executor(None, delivery.outbox.drop, excess)
+            delivery.dropped += dropped
+            logger.warning(f"Webhook 积压超过 {self.max_outbox}，丢弃最早的 {dropped} 个事件: {subscription.subscription_id}")
+        lines, token = await loop.run_in_executor(None, delivery.outbox.peek, self.batch_size)
+        if not lines:
+            return
+        body, headers = self._encode(subscription, lines)
+        ok, retry_after, error = await loop.run_in_executor(None, self._post, delivery, body, headers)
+        if ok:
+            await loop.run_in_executor(None, delivery.outbox.ack, token)
+            delivery.delivered += len(lines)
+            delivery.batches += 1
+            delivery.failures = 0
+            delivery.last_delivery_at = time.time()
+            return
+        delivery.failures += 1
+        delivery.last_error = error
+        # 指数退避（1, 2, 4 … 秒）加随机抖动，避免大量订阅在对端恢复时同时重试
+        delay = retry_after or min(self.retry_max_seconds, 2 ** (delivery.failures - 1)) * random.uniform(0.5, 1.0)
+        delivery.next_retry_at = time.time() + delay
+        logger.warning(
+            f"Webhook 推送失败（第 {delivery.failures} 次），{delay:.1f}s 后重试: {subscription.url} - {error}"
+        )
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            delivery.next_retry_at = None
+
+    def _encode(self, subscription: Subscription, lines: "list[bytes]") -> tuple[bytes, dict]:
+        """拼接请求体（事件行已是 JSON，不再反序列化）、签名与压缩"""
+        batch_id = uuid.uuid4().hex
+        head = json.dumps({
+            "subscription_id": subscription.subscription_id,
+            "batch_id": batch_id,
+            "sent_at": round(time.time(), 3),
+        })
+        body = head[:-1].encode("utf-8") + b', "events": [' + b", ".join(lines) + b"]}"
+        headers = {
+            "Content-Type": "application/json; charset=utf-8",
+            "X-Webhook-Subscription": subscription.subscription_id,
+            "X-Webhook-Batch": batch_id,
+            "X-Webhook-Event-Count": str(len(lines)),
+        }
+        if subscription.secret:
+            digest = hmac.new(subscription.secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+            headers["X-Webhook-Signature"] = f"sha256={digest}"
+        if len(body) >= self.compress_min_size:
+            body = gzip.compress(body, compresslevel=6)
+            headers["Content-Encoding"] = "gzip"
+        return body, headers
+
+    def _post(self, delivery: _Delivery, body: bytes, headers: dict) -> tuple[bool, float, str]:
+        """推送一批；返回 (是否成功, 对端要求的重试等待秒数, 错误信息)"""
+        try:
+            resp = delivery.session.post(delivery.subscription.url, data=body, headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            return False, 0.0, str(e)
+        if 200 <= resp.status_code < 300:
+            return True, 0.0, ""
+        try:
+            retry_after = min(self.retry_max_seconds, max(0.0, float(resp.headers.get("Retry-After") or 0)))
+        except ValueError:
+            retry_after = 0.0
+        return False, retry_after, f"HTTP {resp.status_code}"
+
+    def _load(self) -> None:
+        if not self.store_path or not os.path.exists(self.store_path):
+            return
+        try:
+            with open(self.store_path, "r", encoding="utf-8") as f:
+                for item in json.load(f):
+                    subscription = Subscription(
+                        item["subscription_id"], item["url"], item.get("events"), item.get("device_ids"),
+                        item.get("secret", ""), item.get("description", ""), item.get("created_at"),
+                        item.get("tenant_id", ""),
+                    )
+                    self._deliveries[subscription.subscription_id] = self._open(subscription)
+            logger.info(f"已加载 {len(self._deliveries)} 个 Webhook 订阅: {self.store_path}")
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error(f"加载 Webhook 订阅失败: {self.store_path} - {e}")
+
+    def _save(self) -> None:
+        if not self.store_path:
+            return
+        tmp_path = f"{self.store_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump([s.to_dict(with_secret=True) for s in self.list()], f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.store_path)
+        except OSError as e:
+            logger.error(f"保存 Webhook 订阅失败: {self.store_path} - {e}")
+
+
+# ================================================================
+# 新消息识别
+# ================================================================
+
+class MessageTracker:
+    """
+    记录各聊天最近读到的消息，找出读消息结果中此前未读到过的对方消息
+
+    消息以 (发送者, 内容, 时间, 同一结果中相同消息的序号) 识别；某聊天第一次被读取时，
+    返回的对方消息全部视为新消息
+    """
+
+    def __init__(self, max_chats: int = 10000, history: int = 200):
+        """
+        Args:
+            max_chats: 最多记录的聊天数，超出时淘汰最久未读取的
+            history: 每个聊天记住的最近消息数
+        """
+        self.max_chats = max_chats
+        self.history = history
+        self._chats: "OrderedDict[tuple[str, str, str], OrderedDict[tuple, None]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def new_messages(self, device_id: str, app_type: str, contact: str, messages: list[dict]) -> list[dict]:
+        occurrences: dict[tuple, int] = {}
+        keys = []
+        for m in messages:
+            base = (m.get("sender", ""), m.get("content", ""), m.get("timestamp", ""))
+            occurrences[base] = occurrences.get(base, 0) + 1
+            keys.append((*base, occurrences[base]))
+        chat = (device_id, app_type, contact)
+        with self._lock:
+            seen = self._chats.get(chat)
+            if seen is None:
+                seen = self._chats[chat] = OrderedDict()
+                while len(self._chats) > self.max_chats:
+                    self._chats.popitem(last=False)
+            else:
+                self._chats.move_to_end(chat)
+            fresh = [m for m, key in zip(messages, keys) if key not in seen and not m.get("is_self")]
+            for key in keys:
+                seen[key] = None
+                seen.move_to_end(key)
+            while len(seen) > self.history:
+                seen.popitem(last=False)
+        return fresh
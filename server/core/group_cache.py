@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+群成员缓存
+
+获取群成员需要设备端打开群设置页采集，耗时较长。网关按 (设备, 应用, 群名)
+缓存成员列表，邀请/移除/建群成功后直接在缓存上增删，避免每次计算成员差异前
+都重新采集；变更失败或结果无法确认时使该群缓存失效，下次再从设备获取。
+
+使用示例:
+    cache = GroupCache(ttl=600)
+    cache.put("device_1", "wework", "项目群", ["张三", "李四"])
+    cache.apply("device_1", "wework", "项目群", added=["王五"])
+    to_invite, to_remove = GroupCache.plan(["张三", "李四", "王五"], ["张三", "赵六"])
+"""
+import time
+import logging
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+GroupKey = tuple[str, str, str]
+
+
+@dataclass
+class GroupEntry:
+    """单个群的缓存项"""
+    members: list[str]
+    fetched_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+
+    @property
+    def member_count(self) -> int:
+        return len(self.members)
+
+    def to_dict(self) -> dict:
+        return {
+            "members": list(self.members),
+            "member_count": self.member_count,
+            "fetched_at": self.fetched_at,
+            "updated_at": self.updated_at,
+        }
+
+
+class GroupCache:
+    """按 (device_id, app_type, group_name) 缓存群成员列表"""
+
+    def __init__(self, ttl: float = 600):
+        """
+        Args:
+            ttl: 缓存有效期（秒），以最近一次从设备采集的时间计；≤0 表示不缓存
+        """
+        self.ttl = ttl
+        self._groups: dict[GroupKey, GroupEntry] = {}
+
+    def get(self, device_id: str, app_type: str, group_name: str) -> Optional[GroupEntry]:
+        """获取未过期的缓存项，过期则清除并返回 None"""
+        key = (device_id, app_type, group_name)
+        entry = self._groups.get(key)
+        if entry is None:
+            return None
+        if self.ttl <= 0 or time.time() - entry.fetched_at > self.ttl:
+            del self._groups[key]
+            return None
+        return entry
+
+    def put(self, device_id: str, app_type: str, group_name: str, members: Iterable[str]) -> GroupEntry:
+        """写入从设备采集到的完整成员列表"""
+        entry = GroupEntry(members=_unique(members))
+        self._groups[(device_id, app_type, group_name)] = entry
+        return entry
+
+    def apply(
+        self,
+        device_id: str,
+        app_type: str,
+        group_name: str,
+        added: Iterable[str] = (),
+        removed: Iterable[str] = (),
+    ) -> Optional[GroupEntry]:
+        """在缓存上应用已成功的邀请/移除；未缓存的群不做处理"""
+        entry = self.get(device_id, app_type, group_name)
+        if entry is None:
+            return None
+        removed_set = set(removed)
+        entry.members = _unique([m for m in entry.members if m not in removed_set] + list(added))
+        entry.updated_at = time.time()
+        return entry
+
+    def invalidate(self, device_id: str, app_type: Optional[str] = None, group_name: Optional[str] = None) -> int:
+        """使缓存失效：可按设备、设备+应用、或单个群；返回清除的条数"""
+        keys = [
+            k for k in self._groups
+            if k[0] == device_id
+            and (app_type is None or k[1] == app_type)
+            and (group_name is None or k[2] == group_name)
+        ]
+        for k in keys:
+            del self._groups[k]
+        if keys:
+            logger.info(f"群成员缓存失效: {device_id} {app_type or '*'} {group_name or '*'} ({len(keys)}条)")
+        return len(keys)
+
+    def stats(self) -> dict:
+        return {"groups": len(self._groups), "ttl": self.ttl}
+
+    @staticmethod
+    def plan(current: Iterable[str], desired: Iterable[str]) -> tuple[list[str], list[str]]:
+        """
+        计算从当前成员到目标成员的最小变更
+
+        Returns:
+            (需邀请的成员, 需移除的成员)，均保持输入中的顺序
+        """
+        current_list = _unique(current)
+        desired_list = _unique(desired)
+        current_set, desired_set = set(current_list), set(desired_list)
+        to_invite = [m for m in desired_list if m not in current_set]
+        to_remove = [m for m in current_list if m not in desired_set]
+        return to_invite, to_remove
+
+
+def _unique(names: Iterable[str]) -> list[str]:
+    """去空、去重并保持顺序"""
+    seen = set()
+    result = []
+    for name in names:
+        name = str(name).strip()
+        if name and name not in seen:
+            seen.add(name)
+            result.append(name)
+    return result
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+幂等键存储
+
+调用方对发消息、建群等有副作用的接口重试时携带相同的幂等键，
+网关返回首次请求的结果而不是再执行一次。
+
+存储按 (路由, 幂等键) 记录请求体指纹和首次响应：
+    - 容量有上限，超出时淘汰最早的记录
+    - 超过 TTL 的记录视为不存在
+    - 首次请求仍在执行时，重复请求等待其完成后返回同一结果
+    - 同一幂等键用于不同请求体时报冲突；JSON 请求体按规范化后的内容比较，
+      键顺序、空白不同的重试（不同 SDK 重新序列化）视为同一请求
+"""
+import json
+import asyncio
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class IdempotencyRecord:
+    fingerprint: str
+    created_at: float
+    future: asyncio.Future   # 完成后结果为首次响应
+
+    @property
+    def done(self) -> bool:
+        return self.future.done()
+
+
+class IdempotencyConflict(Exception):
+    """同一幂等键被用于不同的请求"""
+
+
+class IdempotencyStore:
+    """
+    有界、带 TTL 的幂等键存储（需在事件循环中使用）
+
+    使用示例:
+        store = IdempotencyStore(max_keys=10000, ttl=86400)
+        record, is_new = store.begin("/api/wework/send_message", key, body)
+        if not is_new:
+            return await record.future
+        try:
+            response = ...
+            store.complete("/api/wework/send_message", key, response)
+        except Exception:
+            store.abort("/api/wework/send_message", key)
+            raise
+    """
+
+    def __init__(self, max_keys: int = 10000, ttl: float = 86400):
+        """
+        Args:
+            max_keys: 最多保留的幂等键数量
+            ttl: 幂等键有效期（秒）
+        """
+        self.max_keys = max(1, max_keys)
+        self.ttl = ttl
+        self._records: "OrderedDict[tuple[str, str], IdempotencyRecord]" = OrderedDict()
+
+    def begin(self, scope: str, key: str, body: bytes = b"") -> tuple[IdempotencyRecord, bool]:
+        """
+        登记一次请求
+
+        Returns:
+            (记录, 是否首次请求)；非首次时 await record.future 得到首次响应
+
+        Raises:
+            IdempotencyConflict: 幂等键已用于请求体不同的请求
+        """
+        self._evict()
+        fingerprint = _fingerprint(body)
+        existing = self._records.get((scope, key))
+        if existing is not None:
+            if existing.fingerprint != fingerprint:
+                raise IdempotencyConflict(f"幂等键已用于不同的请求: {key}")
+            return existing, False
+        record = IdempotencyRecord(
+            fingerprint=fingerprint,
+            created_at=time.time(),
+            future=asyncio.get_running_loop().create_future(),
+        )
+        self._records[(scope, key)] = record
+        while len(self._records) > self.max_keys:
+            self._drop(*self._records.popitem(last=False))
+        return record, True
+
+    def complete(self, scope: str, key: str, value: Any) -> None:
+        """记录首次请求的结果并唤醒等待中的重复请求"""
+        record = self._records.get((scope, key))
+        if record is not None and not record.done:
+            record.future.set_result(value)
+
+    def abort(self, scope: str, key: str) -> None:
+        """首次请求未产生可复用的结果：删除记录，重复请求将重新执行"""
+        record = self._records.pop((scope, key), None)
+        if record is not None:
+            self._drop((scope, key), record)
+
+    def get(self, scope: str, key: str) -> Optional[IdempotencyRecord]:
+        self._evict()
+        return self._records.get((scope, key))
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def _evict(self) -> None:
+        """淘汰过期记录（记录按创建时间有序，从头部开始检查即可）"""
+        deadline = time.time() - self.ttl
+        while self._records:
+            scope_key, record = next(iter(self._records.items()))
+            if record.created_at >= deadline:
+                break
+            self._records.popitem(last=False)
+            self._drop(scope_key, record)
+
+    @staticmethod
+    def _drop(scope_key: tuple[str, str], record: IdempotencyRecord) -> None:
+        # 仍有请求在等待的记录被淘汰：让等待方重新执行而不是永久挂起
+        if not record.done:
+            record.future.set_exception(KeyError(scope_key))
+            # 无人等待时避免 "exception was never retrieved" 警告
+            record.future.exception()
+
+
+def _fingerprint(body: bytes) -> str:
+    """请求体指纹：JSON 按排序键、紧凑分隔符规范化后计算，其他内容按原始字节"""
+    try:
+        canonical = json.dumps(json.loads(body), sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    except ValueError:
+        return hashlib.sha256(body).hexdigest()
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
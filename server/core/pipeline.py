@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+任务流水线（Python SDK）
+
+DeviceClient 的同步调用每次只能提交一个操作，并以 2s 间隔轮询到完成后才返回，批量脚本
+的速度受客户端往返限制。流水线不等待地提交操作，返回 Future；每台设备保持最多 window 个
+在途任务（设备端串行执行，窗口内的任务在设备队列中等待，执行完一个立即开始下一个），
+完成结果按完成顺序产出：
+
+    - 每台设备一个后台线程：补满窗口 -> 查询最早的在途任务（设备 FIFO 执行）-> 完成后立即
+      查询下一个，未完成才等待 poll_interval
+    - 同一设备按提交顺序执行，不同设备并行
+    - 提交失败（设备返回 success=False）时 Future 直接以该响应完成，与同步调用的返回值一致
+
+使用示例:
+    with TaskPipeline(device_manager, window=2) as pipeline:
+        for row in rows:
+            pipeline.send_message(row["contact"], row["message"], device_id="device_1", tag=row)
+        for task in pipeline.as_completed():
+            print(task.tag["contact"], task.result()["success"])
+
+    # 异步代码中
+    async for task in pipeline.completions():
+        ...
+"""
+import time
+import queue
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Iterator, Optional, Union
+
+from .device_client import AppType, DeviceClient
+from .device_manager import DeviceManager
+from .results import TaskResult
+
+logger = logging.getLogger(__name__)
+
+# 可流水线提交的 DeviceClient 方法（均支持 wait=False 并返回 task_id）
+PIPELINE_OPS = (
+    "send_message", "read_messages", "create_group", "invite_to_group",
+    "remove_from_group", "get_group_members", "chat_session",
+)
+
+
+class PipelineTask(Future):
+    """流水线中的一个操作；result() 为与同步调用相同结构的结果"""
+
+    def __init__(self, device_id: str, op: str, args: tuple, kwargs: dict, tag: Any = None):
+        super().__init__()
+        self.device_id = device_id
+        self.op = op
+        self.args = args
+        self.kwargs = kwargs
+        self.tag = tag                      # 调用方的关联数据，原样带回
+        self.task_id = ""
+        self.submitted_at = time.time()
+        self.dispatched_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+
+class _Lane:
+    """单台设备的待提交队列与在途任务"""
+
+    def __init__(self, client: DeviceClient):
+        self.client = client
+        self.pending: deque[PipelineTask] = deque()
+        self.inflight: "OrderedDict[str, PipelineTask]" = OrderedDict()
+        self.wakeup = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+
+class TaskPipeline:
+    """按设备窗口流水线提交 DeviceClient 操作（线程安全）"""
+
+    def __init__(
+        self,
+        clients: Union[DeviceManager, DeviceClient],
+        window: int = 2,
+        poll_interval: float = 0.5,
+        timeout: Optional[float] = None,
+    ):
+        """
+        Args:
+            clients: DeviceManager（多设备，提交时指定 device_id）或单个 DeviceClient
+            window: 每台设备最多的在途任务数（已提交到设备、尚未完成）
+            poll_interval: 最早的在途任务未完成时，再次查询前的等待（秒）
+            timeout: 任务从提交到设备起的超时（秒），默认使用客户端的 timeout 乘以窗口
+        """
+        self.clients = clients
+        self.window = max(1, window)
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self._lanes: dict[str, _Lane] = {}
+        self._lock = threading.Lock()
+        self._completed: "queue.SimpleQueue[PipelineTask]" = queue.SimpleQueue()
+        self._unconsumed = 0                # 已提交、尚未被 as_completed / completions 取走的任务数
+        self._closed = False
+
+    # ---------------- 提交 ----------------
+
+    def submit(self, op: str, *args, device_id: str = "", tag: Any = None, **kwargs) -> PipelineTask:
+        """
+        提交一个操作，立即返回
+
+        Args:
+            op: DeviceClient 方法名，见 PIPELINE_OPS
+            args / kwargs: 该方法的参数（不含 wait）
+            device_id: 目标设备；clients 为单个 DeviceClient 时可省略
+            tag: 调用方关联数据，完成时从 task.tag 取回
+        """
+        if op not in PIPELINE_OPS:
+            raise ValueError(f"不支持流水线提交的操作: {op}，可用: {', '.join(PIPELINE_OPS)}")
+        client = self._client(device_id)
+        device_id = device_id or client.device_id
+        task = PipelineTask(device_id, op, args, kwargs, tag)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("流水线已关闭")
+            lane = self._lanes.get(device_id)
+            if lane is None:
+                lane = self._lanes[device_id] = _Lane(client)
+            lane.pending.append(task)
+            self._unconsumed += 1
+            if lane.thread is None:
+                lane.thread = threading.Thread(
+                    target=self._run, args=(device_id, lane), name=f"pipeline-{device_id}", daemon=True
+                )
+                lane.thread.start()
+            elif len(lane.inflight) < self.window:
+                lane.wakeup.set()       # 窗口未满：唤醒等待中的线程立即提交
+        return task
+
+    def send_message(
+        self, contact: str, message: str, device_id: str = "", app_type: AppType = "wework", tag: Any = None,
+    ) -> PipelineTask:
+        return self.submit("send_message", contact, message, device_id=device_id, tag=tag, app_type=app_type)
+
+    def read_messages(
+        self, contact: str, count: int = 10, device_id: str = "", app_type: AppType = "wework", tag: Any = None,
+    ) -> PipelineTask:
+        return self.submit("read_messages", contact, count, device_id=device_id, tag=tag, app_type=app_type)
+
+    # ---------------- 取结果 ----------------
+
+    def as_completed(self, timeout: Optional[float] = None) -> Iterator[PipelineTask]:
+        """
+        按完成顺序产出任务，直到已提交的任务全部取完（迭代期间新提交的任务也会产出）
+
+        同一时间只应有一个迭代器（as_completed 或 completions）在取结果。
+
+        Raises:
+            queue.Empty: timeout 秒内没有新的完成
+        """
+        while self._take():
+            yield self._completed.get(timeout=timeout)
+
+    async def completions(self) -> AsyncIterator[PipelineTask]:
+        """as_completed 的异步版本（在线程池中等待完成，不阻塞事件循环）"""
+        loop = asyncio.get_running_loop()
+        while self._take():
+            yield await loop.run_in_executor(None, self._completed.get)
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """等待已提交的任务全部完成（不消费完成队列），返回是否全部完成"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for lane in list(self._lanes.values()):
+            thread = lane.thread
+            if thread is not None:
+                thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        return all(lane.thread is None for lane in self._lanes.values())
+
+    def close(self, cancel_pending: bool = False) -> None:
+        """
+        停止接受新提交并等待在途任务完成
+
+        Args:
+            cancel_pending: 取消尚未提交到设备的任务（已提交的仍等待完成）；取消的任务同样从
+                as_completed 产出，result() 抛出 CancelledError
+        """
+        with self._lock:
+            self._closed = True
+            if cancel_pending:
+                for lane in self._lanes.values():
+                    while lane.pending:
+                        task = lane.pending.popleft()
+                        task.cancel()
+                        self._finish(task)
+        self.join()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                device_id: {"pending": len(lane.pending), "inflight": len(lane.inflight)}
+                for device_id, lane in self._lanes.items()
+            }
+
+    def __enter__(self) -> "TaskPipeline":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close(cancel_pending=exc[0] is not None)
+
+    # ---------------- 内部 ----------------
+
+    def _client(self, device_id: str) -> DeviceClient:
+        if isinstance(self.clients, DeviceClient):
+            if device_id and device_id != self.clients.device_id:
+                raise ValueError(f"单设备流水线不能提交到其它设备: {device_id}")
+            return self.clients
+        if not device_id:
+            raise ValueError("多设备流水线提交时需指定 device_id")
+        client = self.clients.get_device(device_id)
+        if client is None:
+            raise ValueError(f"设备不存在: {device_id}")
+        return client
+
+    def _take(self) -> bool:
+        with self._lock:
+            if self._unconsumed <= 0:
+                return False
+            self._unconsumed -= 1
+            return True
+
+    def _finish(self, task: PipelineTask, result: Optional[dict] = None, error: Optional[BaseException] = None) -> None:
+        task.finished_at = time.time()
+        if error is not None:
+            task.set_exception(error)
+        elif result is not None:
+            task.set_result(result)
+        self._completed.put(task)
+
+    def _run(self, device_id: str, lane: _Lane) -> None:
+        client = lane.client
+        timeout = self.timeout or client.timeout * self.window
+        while True:
+            lane.wakeup.clear()
+            with self._lock:
+                batch = []
+                while lane.pending and len(lane.inflight) + len(batch) < self.window:
+                    batch.append(lane.pending.popleft())
+                if not batch and not lane.inflight:
+                    lane.thread = None
+                    return
+            for task in batch:
+                self._dispatch(client, lane, task)
+
+            if not lane.inflight:
+                continue
+            task_id, task = next(iter(lane.inflight.items()))
+            try:
+                resp = client.get_task_result(task_id)
+            except Exception as e:
+                resp = {"success": False, "message": str(e)}
+            data = resp.get("data")
+            if isinstance(data, dict) and data.get("success") is not None:
+                self._complete(lane, task_id, TaskResult.from_device(data).model_dump())
+                continue        # 设备 FIFO 执行，下一个可能也已完成，立即查询
+            if time.time() - task.dispatched_at > timeout:
+                self._complete(lane, task_id, {"success": False, "message": f"任务超时 ({timeout:.0f}s): {task_id}"})
+                continue
+            lane.wakeup.wait(self.poll_interval)
+
+    def _dispatch(self, client: DeviceClient, lane: _Lane, task: PipelineTask) -> None:
+        if not task.set_running_or_notify_cancel():
+            self._finish(task)
+            return
+        try:
+            resp = getattr(client, task.op)(*task.args, wait=False, **task.kwargs)
+        except Exception as e:
+            logger.error(f"流水线提交失败: {task.device_id} {task.op} - {e}")
+            self._finish(task, error=e)
+            return
+        task.task_id = (resp.get("data") or {}).get("task_id", "") if resp.get("success") else ""
+        task.dispatched_at = time.time()
+        if not task.task_id:
+            self._finish(task, result=resp)
+            return
+        lane.inflight[task.task_id] = task
+
+    def _complete(self, lane: _Lane, task_id: str, result: dict) -> None:
+        task = lane.inflight.pop(task_id)
+        self._finish(task, result=result)
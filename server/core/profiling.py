@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+网关性能剖析
+
+网关变慢时用于定位耗时：阻塞事件循环的 requests 调用、adb 截屏子进程、JSON 处理等。
+各组件开销都很低，可在生产环境常开（config.PROFILING_ENABLED）：
+
+    LoopMonitor   - 事件循环延迟监控：协程心跳测量调度延迟；看门狗线程发现心跳停滞时
+                    抓取事件循环线程的调用栈，定位阻塞循环的代码
+    RouteStats    - 按路由统计请求次数、墙钟时间（含最近请求的 p50/p99）与 CPU 时间
+    StackSampler  - 按需采样剖析：在指定时长内定时采集所有线程调用栈，
+                    输出 collapsed stack 格式（flamegraph.pl / speedscope 可直接读取）
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import Counter, deque
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+class LoopMonitor:
+    """
+    事件循环延迟与慢回调监控
+
+    使用示例:
+        monitor = LoopMonitor(interval=0.5, slow_threshold=0.2)
+        monitor.start()          # 需在事件循环中调用
+        monitor.stats()
+    """
+
+    def __init__(self, interval: float = 0.5, slow_threshold: float = 0.2, max_events: int = 50):
+        """
+        Args:
+            interval: 心跳间隔（秒）
+            slow_threshold: 循环被阻塞超过该秒数视为慢回调，记录调用栈
+            max_events: 最多保留的慢回调记录数
+        """
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self._lags: deque[float] = deque(maxlen=600)
+        self._events: deque[dict] = deque(maxlen=max_events)
+        self._beat = time.perf_counter()
+        self._loop_thread_id: Optional[int] = None
+        self._pending_event: Optional[dict] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.perf_counter()
+        self._stop.clear()
+        self._task = asyncio.ensure_future(self._heartbeat())
+        threading.Thread(target=self._watchdog, name="LoopWatchdog", daemon=True).start()
+        logger.info(f"事件循环监控已启动（心跳 {self.interval}s，慢回调阈值 {self.slow_threshold}s）")
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _heartbeat(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self._beat = time.perf_counter()
+            lag = max(0.0, self._beat - start - self.interval)
+            self._lags.append(lag)
+            event = self._pending_event
+            if event is not None:
+                # 阻塞已结束，补全实际阻塞时长
+                event["blocked_seconds"] = round(lag, 3)
+                self._pending_event = None
+
+    def _watchdog(self) -> None:
+        check = max(0.02, self.slow_threshold / 2)
+        while not self._stop.wait(check):
+            stalled = time.perf_counter() - self._beat - self.interval
+            if stalled < self.slow_threshold or self._pending_event is not None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            event = {
+                "at": time.time(),
+                "blocked_seconds": round(stalled, 3),
+                "stack": traceback.format_stack(frame) if frame is not None else [],
+            }
+            self._pending_event = event
+            self._events.append(event)
+            logger.warning(f"事件循环被阻塞 ≥{stalled:.2f}s，已记录调用栈")
+
+    def stats(self) -> dict:
+        lags = list(self._lags)
+        return {
+            "interval": self.interval,
+            "slow_threshold": self.slow_threshold,
+            "lag": {
+                "samples": len(lags),
+                "last": round(lags[-1], 4) if lags else 0.0,
+                "avg": round(sum(lags) / len(lags), 4) if lags else 0.0,
+                "p99": round(_percentile(lags, 0.99), 4),
+                "max": round(max(lags), 4) if lags else 0.0,
+            },
+            "slow_callbacks": list(self._events),
+        }
+
+
+class RouteStats:
+    """
+    按路由统计请求耗时
+
+    CPU 时间为请求期间事件循环线程的 CPU 时间；有并发请求时会包含其它请求的开销，为近似值。
+    墙钟时间的百分位按每个路由最近 window 个请求计算。
+    """
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self._routes: dict[str, dict] = {}
+
+    def record(self, route: str, wall: float, cpu: float, status_code: int) -> None:
+        item = self._routes.get(route)
+        if item is None:
+            item = self._routes[route] = {
+                "count": 0, "errors": 0, "wall_total": 0.0, "wall_max": 0.0, "cpu_total": 0.0,
+                "recent": deque(maxlen=self.window),
+            }
+        item["count"] += 1
+        item["errors"] += status_code >= 500
+        item["wall_total"] += wall
+        item["wall_max"] = max(item["wall_max"], wall)
+        item["recent"].append(wall)
+        item["cpu_total"] += cpu
+
+    def snapshot(self) -> list[dict]:
+        rows = []
+        for route, item in self._routes.items():
+            count = item["count"]
+            recent = list(item["recent"])
+            rows.append({
+                "route": route,
+                "count": count,
+                "errors": item["errors"],
+                "wall_avg_ms": round(item["wall_total"] / count * 1000, 2),
+                "wall_p50_ms": round(_percentile(recent, 0.5) * 1000, 2),
+                "wall_p99_ms": round(_percentile(recent, 0.99) * 1000, 2),
+                "wall_max_ms": round(item["wall_max"] * 1000, 2),
+                "wall_total_s": round(item["wall_total"], 3),
+                "cpu_avg_ms": round(item["cpu_total"] / count * 1000, 2),
+                "cpu_total_s": round(item["cpu_total"], 3),
+            })
+        return sorted(rows, key=lambda r: r["wall_total_s"], reverse=True)
+
+    def reset(self) -> None:
+        self._routes.clear()
+
+
+class StackSampler:
+    """按需采样剖析器（同一时间只允许一次采样）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    def sample(self, seconds: float, interval: float = 0.005) -> Counter:
+        """
+        在调用线程中阻塞采样 seconds 秒，返回 collapsed stack -> 采样次数
+
+        Raises:
+            RuntimeError: 已有采样在进行
+        """
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("已有采样正在进行")
+        try:
+            counts: Counter = Counter()
+            me = threading.get_ident()
+            names = {t.ident: t.name for t in threading.enumerate()}
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                for tid, frame in sys._current_frames().items():
+                    if tid == me:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})")
+                        frame = frame.f_back
+                    stack.append(names.get(tid) or f"thread-{tid}")
+                    counts[";".join(reversed(stack))] += 1
+                time.sleep(interval)
+            return counts
+        finally:
+            self._lock.release()
+
+    @staticmethod
+    def collapsed(counts: Counter) -> str:
+        """collapsed stack 文本：每行「帧;帧;帧 次数」"""
+        return "\n".join(f"{stack} {n}" for stack, n in counts.most_common()) + "\n"
+
+
+def _short_path(path: str) -> str:
+    parts = path.replace("\\", "/").split("/")
+    return "/".join(parts[-2:]) if len(parts) > 1 else os.path.basename(path)
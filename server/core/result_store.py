@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+网关侧任务结果存储
+
+经网关提交的设备任务在此登记，取到结果后保存；已完成任务的状态查询直接由网关返回，
+不再经过网络访问设备。长期运行时内存保持平稳：
+
+    - 每台设备最多保留 max_per_device 条记录，超出时淘汰该设备最早的记录
+    - 超过 TTL 的记录被淘汰
+    - 记录使用 __slots__，不带每实例 __dict__
+    - 序列化后超过 spill_bytes 的结果（联系人列表、长聊天记录等）写入 spill_dir，
+      内存中只保留文件引用，查询时再读取
+
+使用示例:
+    store = ResultStore(max_per_device=1000, ttl=86400, spill_dir="task_results")
+    store.track("device_1", "wework", "send_message", task_id)
+    store.complete("device_1", task_id, {"success": True, "message": "ok", "data": None})
+    store.get(task_id).to_dict()
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Collection, Optional
+
+logger = logging.getLogger(__name__)
+
+STATUS_PENDING = "pending"
+STATUS_SUCCESS = "success"
+STATUS_FAILED = "failed"
+
+
+class TaskRecord:
+    """单个任务的记录；payload_ref 非空时结果数据在磁盘上"""
+
+    __slots__ = (
+        "task_id", "device_id", "app_type", "op", "target", "status",
+        "submitted_at", "finished_at", "checked_at", "service_ms", "message", "payload", "payload_ref",
+    )
+
+    def __init__(self, task_id: str, device_id: str, app_type: str = "", op: str = "", target: str = ""):
+        self.task_id = task_id
+        self.device_id = device_id
+        self.app_type = app_type
+        self.op = op
+        self.target = target               # 操作的联系人或群名称
+        self.status = STATUS_PENDING
+        self.submitted_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.checked_at = 0.0              # 最近一次向设备查询的时间
+        self.service_ms: Optional[int] = None   # 设备端执行耗时（不含排队）
+        self.message = ""
+        self.payload: Any = None
+        self.payload_ref: Optional[str] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status != STATUS_PENDING
+
+    def to_dict(self, payload: Any = None) -> dict:
+        return {
+            "task_id": self.task_id,
+            "device_id": self.device_id,
+            "app_type": self.app_type,
+            "op": self.op,
+            "target": self.target,
+            "status": self.status,
+            "submitted_at": self.submitted_at,
+            "finished_at": self.finished_at,
+            "elapsed": round(self.finished_at - self.submitted_at, 3) if self.finished_at else None,
+            "service_ms": self.service_ms,
+            "success": self.status == STATUS_SUCCESS if self.done else None,
+            "message": self.message,
+            "data": payload,
+            "spilled": self.payload_ref is not None,
+        }
+
+
+class ResultStore:
+    """有界、带 TTL 的任务结果存储（线程安全，可在线程池中调用）"""
+
+    def __init__(
+        self,
+        max_per_device: int = 1000,
+        ttl: float = 86400,
+        spill_dir: Optional[str] = None,
+        spill_bytes: int = 64 * 1024,
+        on_complete: Optional[Callable[[TaskRecord], None]] = None,
+        on_track: Optional[Callable[[TaskRecord], None]] = None,
+    ):
+        """
+        Args:
+            max_per_device: 每台设备最多保留的记录数
+            ttl: 记录有效期（秒，从提交时算起）
+            spill_dir: 大结果落盘目录，为空则全部保存在内存
+            spill_bytes: 结果序列化后超过该字节数时落盘
+            on_complete: 任务首次取到结果时的回调（可能在线程池中调用）
+            on_track: 任务首次登记时的回调（可能在线程池中调用）
+        """
+        self.max_per_device = max(1, max_per_device)
+        self.ttl = ttl
+        self.spill_dir = spill_dir
+        self.spill_bytes = spill_bytes
+        self.on_complete = on_complete
+        self.on_track = on_track
+        self._devices: dict[str, "OrderedDict[str, TaskRecord]"] = {}
+        self._index: dict[str, TaskRecord] = {}
+        self._pending: dict[str, "OrderedDict[str, TaskRecord]"] = {}   # 设备 -> 尚未取到结果的记录
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._spill_ready = False       # 落盘目录在首次落盘时创建
+        self._spill_prefix = ""         # 落盘文件名前缀（进程号），目录可被多个进程共用
+
+    # ---------------- 写入 ----------------
+
+    def track(self, device_id: str, app_type: str, op: str, task_id: str, target: str = "") -> TaskRecord:
+        """登记已提交的任务（重复登记返回已有记录）"""
+        with self._lock:
+            record = self._index.get(task_id)
+            if record is not None:
+                return record
+            record = TaskRecord(task_id, device_id, app_type, op, target)
+            self._insert(record)
+            self._pending.setdefault(device_id, OrderedDict())[task_id] = record
+        if self.on_track is not None:
+            try:
+                self.on_track(record)
+            except Exception as e:
+                logger.error(f"登记回调异常: {task_id} - {e}")
+        return record
+
+    def complete(self, device_id: str, task_id: str, result: dict) -> TaskRecord:
+        """
+        保存任务结果
+
+        Args:
+            result: 设备端 task_result 的 data（含 success / message / data），data 应已解码
+        """
+        payload = result.get("data")
+        payload_ref = self._spill(device_id, task_id, payload)
+        with self._lock:
+            record = self._index.get(task_id)
+            if record is None:
+                record = TaskRecord(task_id, device_id)
+                self._insert(record)
+            first = not record.done
+            self._unpend(record)
+            record.status = STATUS_SUCCESS if result.get("success") else STATUS_FAILED
+            record.finished_at = time.time()
+            record.checked_at = record.finished_at
+            record.message = result.get("message") or ""
+            record.service_ms = result.get("elapsed_ms")
+            if record.payload_ref != payload_ref:
+                self._remove_spill(record)
+            record.payload = None if payload_ref else payload
+            record.payload_ref = payload_ref
+        if first and self.on_complete is not None:
+            try:
+                self.on_complete(record)
+            except Exception as e:
+                logger.error(f"结果回调异常: {task_id} - {e}")
+        return record
+
+    def forget_pending(self, task_id: str) -> None:
+        """不再把该任务列入 pending()（设备可能已丢失该任务）；之后取到结果仍正常保存"""
+        with self._lock:
+            record = self._index.get(task_id)
+            if record is not None:
+                self._unpend(record)
+
+    def mark_checked(self, task_id: str) -> None:
+        """记录一次向设备查询（结果尚未完成）"""
+        record = self._index.get(task_id)
+        if record is not None:
+            record.checked_at = time.time()
+
+    # ---------------- 查询 ----------------
+
+    def get(self, task_id: str) -> Optional[TaskRecord]:
+        with self._lock:
+            record = self._index.get(task_id)
+            if record is not None and record.submitted_at < time.time() - self.ttl:
+                self._discard(record)
+                return None
+            return record
+
+    def load_payload(self, record: TaskRecord) -> Any:
+        """取结果数据（落盘的从文件读取；文件丢失时返回 None）"""
+        if record.payload_ref is None:
+            return record.payload
+        try:
+            with open(record.payload_ref, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"读取落盘结果失败: {record.payload_ref} - {e}")
+            return None
+
+    def result(self, task_id: str) -> Optional[dict]:
+        """已完成任务的结果，结构与设备端 task_result 的 data 相同；未完成或不存在时返回 None"""
+        record = self.get(task_id)
+        if record is None or not record.done:
+            return None
+        return {
+            "task_id": record.task_id,
+            "success": record.status == STATUS_SUCCESS,
+            "message": record.message,
+            "data": self.load_payload(record),
+            "elapsed_ms": record.service_ms,
+        }
+
+    def list(
+        self, device_id: Optional[str] = None, limit: int = 100, devices: Optional[Collection[str]] = None
+    ) -> list[TaskRecord]:
+        """最近的任务记录（新的在前，不含结果数据）；devices 限定只返回这些设备的记录"""
+        with self._lock:
+            self._evict_expired()
+            if device_id is not None:
+                records = list(self._devices.get(device_id, {}).values())
+            else:
+                records = list(self._index.values())
+        if devices is not None:
+            records = [r for r in records if r.device_id in devices]
+        records.sort(key=lambda r: r.submitted_at, reverse=True)
+        return records[:limit]
+
+    def pending(self) -> "dict[str, list[TaskRecord]]":
+        """各设备尚未取到结果的记录（按提交顺序）"""
+        with self._lock:
+            return {device_id: list(records.values()) for device_id, records in self._pending.items()}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "records": len(self._index),
+                "devices": len(self._devices),
+                "pending": sum(not r.done for r in self._index.values()),
+                "spilled": sum(r.payload_ref is not None for r in self._index.values()),
+            }
+
+    # ---------------- 内部 ----------------
+
+    def _insert(self, record: TaskRecord) -> None:
+        records = self._devices.setdefault(record.device_id, OrderedDict())
+        records[record.task_id] = record
+        self._index[record.task_id] = record
+        while len(records) > self.max_per_device:
+            self._discard(next(iter(records.values())))
+        self._evict_expired(records)
+
+    def _evict_expired(self, records: Optional["OrderedDict[str, TaskRecord]"] = None) -> None:
+        """淘汰过期记录（各设备的记录按提交时间有序，从头部检查即可）"""
+        deadline = time.time() - self.ttl
+        for device_records in [records] if records is not None else list(self._devices.values()):
+            while device_records:
+                oldest = next(iter(device_records.values()))
+                if oldest.submitted_at >= deadline:
+                    break
+                self._discard(oldest)
+
+    def _discard(self, record: TaskRecord) -> None:
+        self._index.pop(record.task_id, None)
+        self._unpend(record)
+        records = self._devices.get(record.device_id)
+        if records is not None:
+            records.pop(record.task_id, None)
+            if not records:
+                del self._devices[record.device_id]
+        self._remove_spill(record)
+
+    def _unpend(self, record: TaskRecord) -> None:
+        records = self._pending.get(record.device_id)
+        if records is not None and records.pop(record.task_id, None) is not None and not records:
+            del self._pending[record.device_id]
+
+    def _spill(self, device_id: str, task_id: str, payload: Any) -> Optional[str]:
+        if not self.spill_dir or payload is None or isinstance(payload, (bool, int, float)):
+            return None
+        text = json.dumps(payload, ensure_ascii=False)
+        if len(text.encode("utf-8")) <= self.spill_bytes:
+            return None
+        name = hashlib.sha1(f"{device_id}:{task_id}".encode("utf-8")).hexdigest()
+        try:
+            self._prepare_spill_dir()
+            path = os.path.join(self.spill_dir, f"{self._spill_prefix}{name}.json")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+        except OSError as e:
+            logger.error(f"结果落盘失败，保留在内存: {self.spill_dir} {name} - {e}")
+            return None
+        return path
+
+    def _prepare_spill_dir(self) -> None:
+        """
+        首次落盘时创建目录；落盘文件以本进程号为前缀，同一目录可被多个网关进程共用
+
+        记录只在内存中，同一进程号上次运行遗留的落盘文件已无引用，一并删除；
+        其他前缀的文件可能属于仍在运行的进程，不删除
+        """
+        with self._spill_lock:
+            if self._spill_ready:
+                return
+            self._spill_prefix = f"{os.getpid()}-"
+            os.makedirs(self.spill_dir, exist_ok=True)
+            for name in os.listdir(self.spill_dir):
+                if name.startswith(self._spill_prefix) and name.endswith(".json"):
+                    try:
+                        os.remove(os.path.join(self.spill_dir, name))
+                    except OSError:
+                        pass
+            self._spill_ready = True
+
+    @staticmethod
+    def _remove_spill(record: TaskRecord) -> None:
+        if record.payload_ref is not None:
+            try:
+                os.remove(record.payload_ref)
+            except OSError:
+                pass
+            record.payload_ref = None
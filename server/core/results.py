@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+设备端任务结果模型
+
+设备端 /api/task_result 的 data 字段：新版 APK 返回 JSON 值（数组/对象），
+旧版 APK 返回 toString 后的字符串（JSON 或 Kotlin 集合格式，如 "[张三, 李四]"、
+"{success=[张三], failed=[]}"）。DeviceClient 取结果时统一在此解码一次，
+上层直接使用 list/dict 或下面的类型化模型。
+
+使用示例:
+    result = TaskResult.from_device(client.get_task_result(task_id)["data"])
+    members = result.as_names()          # list[str] | None
+    invite = result.as_invite()          # InviteResult | None
+"""
+import json
+import re
+from typing import Any, Optional
+
+from pydantic import BaseModel, Field, ValidationError
+
+
+class ChatMessage(BaseModel):
+    """聊天消息（与设备端 ChatMessage 对应）"""
+    sender: str = ""
+    content: str = ""
+    timestamp: str = ""
+    is_self: bool = False
+    msg_type: str = "text"
+
+
+class InviteResult(BaseModel):
+    """邀请入群结果"""
+    success: list[str] = Field(default_factory=list)
+    failed: list[str] = Field(default_factory=list)
+
+
+class SessionActionResult(BaseModel):
+    """聊天会话中单个动作的结果"""
+    type: str = ""
+    success: bool = False
+    message: str = ""
+    data: Any = None
+
+
+class TaskResult(BaseModel):
+    """设备端任务结果，data 已解码"""
+    task_id: str = ""
+    success: bool = False
+    message: str = ""
+    data: Any = None
+    elapsed_ms: Optional[int] = None     # 设备端执行耗时（不含排队），旧版 APK 无此字段
+
+    @classmethod
+    def from_device(cls, raw: dict) -> "TaskResult":
+        """由设备端 task_result 的 data 构造（对已解码的结果重复调用也安全）"""
+        return cls(
+            task_id=raw.get("task_id") or "",
+            success=bool(raw.get("success")),
+            message=raw.get("message") or "",
+            data=decode_task_data(raw.get("data")),
+            elapsed_ms=raw.get("elapsed_ms"),
+        )
+
+    def as_names(self) -> Optional[list[str]]:
+        """联系人、群成员、移除成员等名称列表"""
+        if isinstance(self.data, list) and all(isinstance(x, str) for x in self.data):
+            return self.data
+        return None
+
+    def as_invite(self) -> Optional[InviteResult]:
+        return _validate(InviteResult, self.data) if isinstance(self.data, dict) else None
+
+    def as_messages(self) -> Optional[list[ChatMessage]]:
+        if not isinstance(self.data, list):
+            return None
+        messages = [_validate(ChatMessage, x) for x in self.data]
+        return None if any(m is None for m in messages) else messages
+
+    def as_session(self) -> Optional[list[SessionActionResult]]:
+        if not isinstance(self.data, list):
+            return None
+        actions = [_validate(SessionActionResult, x) for x in self.data]
+        return None if any(a is None for a in actions) else actions
+
+
+def decode_task_data(value: Any) -> Any:
+    """把设备端以字符串传回的 data 还原为 list/dict；非字符串原样返回"""
+    if not isinstance(value, str):
+        return value
+    text = value.strip()
+    if not text:
+        return None
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    if text.startswith("{") and text.endswith("}"):
+        # Kotlin Map: {success=[张三, 李四], failed=[]}
+        return {k: _split_kotlin_list(v) for k, v in re.findall(r"(\w+)=\[(.*?)\]", text)}
+    if text.startswith("[") and text.endswith("]") and "(" not in text:
+        # Kotlin List<String>: [张三, 李四]（data class 列表无法可靠还原，保持原样）
+        return _split_kotlin_list(text[1:-1])
+    return value
+
+
+def _split_kotlin_list(inner: str) -> list[str]:
+    return [item for item in inner.split(", ") if item]
+
+
+def _validate(model: type[BaseModel], value: Any) -> Optional[BaseModel]:
+    if not isinstance(value, dict):
+        return None
+    try:
+        return model.model_validate(value)
+    except ValidationError:
+        return None
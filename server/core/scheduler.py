@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+"""
+定时任务调度器
+
+在网关内执行周期任务（cron 表达式）和一次性延时任务，目标为发消息、读消息、
+群管理等操作，替代外部脚本各自实例化 DeviceClient 轮询。
+
+特性：
+    - 任务持久化到本地 JSON 文件，重启后继续调度
+    - 错过执行（如网关停机）时按 missed_policy 处理：
+        skip     - 跳过错过的执行，从当前时间起计算下一次
+        run_once - 立即补执行一次（多次错过也只补一次），再计算下一次
+    - 启动时间打散：每个任务按 (设备, 任务ID) 的哈希在 spread_seconds 内固定偏移，
+      相同 cron 的大量任务不会在同一秒同时压到设备上
+    - 一次性任务执行（或错过）后保留 finished_retention 秒供查询结果，之后从任务列表与持久化文件中删除
+
+cron 表达式为 5 段：分 时 日 月 周（本地时间），支持 * , - / ，周日为 0 或 7。
+
+使用示例:
+    scheduler = Scheduler(executor, store_path="scheduled_jobs.json")
+    scheduler.add(Job(job_id="", device_id="device_1", app_type="wework",
+                      action="send_message", params={"contact": "张三", "message": "早安"},
+                      cron="0 9 * * 1-5"))
+    scheduler.start()   # 需在事件循环中调用
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+from dataclasses import dataclass, field, asdict
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+MISSED_POLICIES = ("skip", "run_once")
+
+
+# ================================================================
+# cron 表达式
+# ================================================================
+
+class CronExpression:
+    """5 段 cron 表达式（分 时 日 月 周）"""
+
+    _RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+    def __init__(self, expr: str):
+        parts = expr.split()
+        if len(parts) != 5:
+            raise ValueError(f"cron 表达式需为 5 段（分 时 日 月 周）: {expr}")
+        self.expr = expr
+        fields = [self._parse(p, lo, hi) for p, (lo, hi) in zip(parts, self._RANGES)]
+        self.minutes, self.hours, self.days, self.months, weekdays = fields
+        self.weekdays = {d % 7 for d in weekdays}
+        # 日与周同时受限时按标准 cron 语义取「或」
+        self._day_any = parts[2] == "*"
+        self._weekday_any = parts[4] == "*"
+
+    @staticmethod
+    def _parse(part: str, lo: int, hi: int) -> set[int]:
+        values = set()
+        for item in part.split(","):
+            rng, _, step_str = item.partition("/")
+            step = int(step_str) if step_str else 1
+            if rng == "*":
+                start, end = lo, hi
+            elif "-" in rng:
+                start, end = (int(x) for x in rng.split("-", 1))
+            else:
+                start = int(rng)
+                end = hi if step_str else start
+            if start < lo or end > hi or start > end or step < 1:
+                raise ValueError(f"cron 字段超出范围 [{lo}-{hi}]: {item}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, dt: datetime) -> bool:
+        day_ok = dt.day in self.days
+        weekday_ok = (dt.isoweekday() % 7) in self.weekdays
+        if self._day_any:
+            return weekday_ok
+        if self._weekday_any:
+            return day_ok
+        return day_ok or weekday_ok
+
+    def next_after(self, ts: float) -> float:
+        """返回严格晚于 ts 的下一次触发时间（秒级时间戳）"""
+        dt = datetime.fromtimestamp(ts).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = dt + timedelta(days=366 * 5)
+        while dt < limit:
+            if dt.month not in self.months:
+                dt = (dt.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0)
+                continue
+            if not self._day_matches(dt):
+                dt = (dt + timedelta(days=1)).replace(hour=0, minute=0)
+                continue
+            if dt.hour not in self.hours:
+                dt = (dt + timedelta(hours=1)).replace(minute=0)
+                continue
+            if dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+                continue
+            return dt.timestamp()
+        raise ValueError(f"cron 表达式在 5 年内不会触发: {self.expr}")
+
+
+# ================================================================
+# 任务与调度器
+# ================================================================
+
+@dataclass
+class Job:
+    """定时任务"""
+    job_id: str
+    device_id: str
+    app_type: str
+    action: str
+    params: dict = field(default_factory=dict)
+    cron: Optional[str] = None          # 周期任务
+    run_at: Optional[float] = None      # 一次性任务的计划时间
+    name: str = ""
+    missed_policy: str = "run_once"
+    spread_seconds: int = 0
+    enabled: bool = True
+    created_at: float = field(default_factory=time.time)
+    next_fire: Optional[float] = None   # 下一次计划触发时间（未加打散偏移）
+    next_run: Optional[float] = None    # 实际执行时间 = next_fire + 偏移
+    last_run: Optional[float] = None
+    last_success: Optional[bool] = None
+    last_message: str = ""
+    run_count: int = 0
+    tenant_id: str = ""                 # 创建任务的租户，执行时按该租户计费与排队
+
+    @property
+    def finished_at(self) -> Optional[float]:
+        """一次性任务不再调度的时间（执行或错过）；周期任务与未结束的一次性任务为 None"""
+        if self.cron or self.enabled:
+            return None
+        return self.last_run or self.run_at or self.created_at
+
+    @property
+    def offset(self) -> int:
+        """按 (设备, 任务ID) 固定的打散偏移（秒）"""
+        if self.spread_seconds <= 0:
+            return 0
+        digest = hashlib.md5(f"{self.device_id}:{self.job_id}".encode("utf-8")).hexdigest()
+        return int(digest, 16) % self.spread_seconds
+
+    def schedule_after(self, ts: float) -> None:
+        """计算晚于 ts 的下一次执行；一次性任务执行后不再调度"""
+        if self.cron:
+            self.next_fire = CronExpression(self.cron).next_after(ts)
+        elif self.run_at is not None and self.run_at > ts:
+            self.next_fire = self.run_at
+        else:
+            self.next_fire = None
+        self.next_run = self.next_fire + self.offset if self.next_fire is not None else None
+        if self.next_run is None and not self.cron:
+            self.enabled = False
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+JobExecutor = Callable[[Job], Awaitable[dict]]
+
+
+class Scheduler:
+    """
+    定时任务调度器（在事件循环中运行）
+
+    执行函数 executor(job) 为协程，返回与对应接口相同结构的结果；
+    同一任务上一次执行未结束时，本次触发跳过。
+    """
+
+    def __init__(
+        self,
+        executor: JobExecutor,
+        store_path: Optional[str] = None,
+        missed_grace: float = 60,
+        default_spread: int = 0,
+        finished_retention: float = 86400,
+    ):
+        """
+        Args:
+            executor: 执行任务的协程函数
+            store_path: 持久化文件路径，为空则不持久化
+            missed_grace: 晚于计划时间超过该秒数视为错过执行
+            default_spread: 任务未指定 spread_seconds 时的打散窗口（秒）
+            finished_retention: 一次性任务结束后保留的秒数，0 表示执行完立即删除
+        """
+        self.executor = executor
+        self.store_path = store_path
+        self.missed_grace = missed_grace
+        self.default_spread = default_spread
+        self.finished_retention = finished_retention
+        self._jobs: dict[str, Job] = {}
+        self._running: set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._load()
+
+    # ---------------- 任务管理 ----------------
+
+    def add(self, job: Job) -> Job:
+        """新增任务（校验 cron、计算首次执行时间并持久化）"""
+        if job.missed_policy not in MISSED_POLICIES:
+            raise ValueError(f"missed_policy 须为 {MISSED_POLICIES} 之一")
+        if bool(job.cron) == (job.run_at is not None):
+            raise ValueError("cron 与 run_at 须且只能指定一个")
+        if job.cron:
+            CronExpression(job.cron)
+        job.job_id = job.job_id or uuid.uuid4().hex[:12]
+        if job.spread_seconds <= 0:
+            job.spread_seconds = self.default_spread if job.cron else 0
+        if job.run_at is not None:
+            # 计划时间已过的一次性任务视为立即执行
+            job.run_at = max(job.run_at, time.time())
+        job.schedule_after(time.time() if job.cron else job.run_at - 1)
+        self._jobs[job.job_id] = job
+        self._save()
+        self._notify()
+        logger.info(f"定时任务已添加: {job.job_id} {job.action} @ {job.cron or job.run_at}")
+        return job
+
+    def remove(self, job_id: str) -> bool:
+        if self._jobs.pop(job_id, None) is None:
+            return False
+        self._save()
+        return True
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def list(self) -> list[Job]:
+        return sorted(self._jobs.values(), key=lambda j: (j.next_run is None, j.next_run or 0))
+
+    async def run_now(self, job_id: str) -> dict:
+        """立即执行一次（不影响原有计划）"""
+        job = self._jobs[job_id]
+        return await self._execute(job)
+
+    # ---------------- 运行 ----------------
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._loop())
+            logger.info(f"定时任务调度器启动，共 {len(self._jobs)} 个任务")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self) -> None:
+        while True:
+            now = time.time()
+            for job in list(self._jobs.values()):
+                if job.enabled and job.next_run is not None and job.next_run <= now:
+                    self._fire(job, now)
+            self._purge_finished(now)
+            upcoming = [j.next_run for j in self._jobs.values() if j.enabled and j.next_run is not None]
+            timeout = min([max(0.0, t - time.time()) for t in upcoming] + [30.0])
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _fire(self, job: Job, now: float) -> None:
+        missed = now - job.next_run > self.missed_grace
+        if missed and job.missed_policy == "skip":
+            logger.warning(f"定时任务错过执行，已跳过: {job.job_id} (计划 {job.next_run:.0f})")
+            job.last_message = "错过执行，已跳过"
+        elif job.job_id in self._running:
+            logger.warning(f"定时任务上一次仍在执行，本次跳过: {job.job_id}")
+        else:
+            if missed:
+                logger.warning(f"定时任务错过执行，补执行一次: {job.job_id}")
+            asyncio.ensure_future(self._execute(job))
+        # 正常触发时从本次计划时间往后推，错过时从当前时间往后推（保证下一次在未来）
+        job.schedule_after(max(job.next_fire or now, now - job.offset))
+        self._save()
+
+    async def _execute(self, job: Job) -> dict:
+        self._running.add(job.job_id)
+        try:
+            result = await self.executor(job)
+        except Exception as e:
+            logger.error(f"定时任务执行异常: {job.job_id} - {e}")
+            result = {"success": False, "message": str(e)}
+        finally:
+            self._running.discard(job.job_id)
+        job.last_run = time.time()
+        job.last_success = bool(result.get("success"))
+        job.last_message = str(result.get("message", ""))
+        job.run_count += 1
+        self._save()
+        if self.finished_retention <= 0:
+            self._notify()
+        return result
+
+    def _purge_finished(self, now: float) -> None:
+        """删除超过保留期的一次性任务（仍在执行的除外）"""
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job_id not in self._running
+            and job.finished_at is not None and job.finished_at + self.finished_retention <= now
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+        if expired:
+            logger.info(f"已删除 {len(expired)} 个结束的一次性任务")
+            self._save()
+
+    def _notify(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    # ---------------- 持久化 ----------------
+
+    def _load(self) -> None:
+        if not self.store_path or not os.path.exists(self.store_path):
+            return
+        try:
+            with open(self.store_path, "r", encoding="utf-8") as f:
+                for item in json.load(f):
+                    job = Job(**item)
+                    self._jobs[job.job_id] = job
+            logger.info(f"已加载 {len(self._jobs)} 个定时任务: {self.store_path}")
+        except (OSError, ValueError, TypeError) as e:
+            logger.error(f"加载定时任务失败: {self.store_path} - {e}")
+
+    def _save(self) -> None:
+        if not self.store_path:
+            return
+        tmp_path = f"{self.store_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump([j.to_dict() for j in self._jobs.values()], f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.store_path)
+        except OSError as e:
+            logger.error(f"保存定时任务失败: {self.store_path} - {e}")
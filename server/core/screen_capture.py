@@ -0,0 +1,658 @@
+# -*- coding: utf-8 -*-
+"""
+任务画面录制（调试）
+
+UI 自动化任务失败时，单张实时截屏往往已看不到出错时的界面。开启录制后，设备执行任务期间
+网关经 adb 连续截屏，每个任务一个紧凑的段文件，事后可按时间轴逐帧回看：
+
+    - 截屏：adb exec-out screencap 原始像素（不在手机上编码 PNG，比 -p 快），按 scale 隔点
+      缩小并去掉 alpha 通道
+    - 去重：每帧计算 256 位差值感知哈希（dHash），与本任务已保存的帧距离不超过
+      dedup_distance 时只记录一条引用（时钟跳动、光标闪烁、等待加载等不产生新帧）；
+      与上一保存帧相近时再按块确认变化不超过 NOISE_TILES，逐字输入等局部变化累积后仍会保存，
+      任务结束时的最后一帧总是精确保存
+    - 增量：新帧按 tile 像素分块与上一保存帧比较，只保存变化的块（与原内容异或后 zlib 压缩）；
+      变化超过一半或每 keyframe_interval 帧保存一次完整关键帧，回看时从最近的关键帧重建
+    - 归属：设备端任务串行执行，帧归属于该设备最早的未完成任务；任务完成后再截最后一帧结束该段
+    - 容量：单个任务最多录制 max_seconds 秒，目录总大小超过 max_bytes 时删除最早的段文件
+
+段文件格式（小端）：
+    文件头   b"RPAF" | 版本 u8 | tile u16 | 元数据长度 u32 | 元数据 JSON
+    帧记录   类型 1B | t_ms u32 | frame u32 | 宽 u16 | 高 u16 | 负载长度 u32 | 负载
+             K 关键帧：zlib(RGB)
+             D 增量帧：块数 u16 | 块号 u16 * n | zlib(新块 XOR 旧块)
+             R 重复帧：无负载，frame 为引用的已保存帧
+
+使用示例:
+    recorder = ScreenRecorder("screen_frames", capture=..., poll=..., enabled=True)
+    store = ResultStore(on_track=recorder.track)
+    recorder.timeline(task_id)
+    recorder.frame_png(task_id, 3)
+"""
+import os
+import re
+import time
+import zlib
+import json
+import struct
+import logging
+import threading
+import subprocess
+from collections import OrderedDict, deque
+from typing import Callable, Optional
+
+from .result_store import TaskRecord
+
+logger = logging.getLogger(__name__)
+
+# capture(device_id)：设备当前屏幕的 screencap 原始输出（阻塞调用）
+CaptureFunc = Callable[[str], bytes]
+# poll(device_id, task_id)：查询任务结果（阻塞调用，同 DeviceClient.get_task_result）
+PollFunc = Callable[[str, str], dict]
+
+SEGMENT_MAGIC = b"RPAF"
+SEGMENT_VERSION = 1
+SEGMENT_SUFFIX = ".frames"
+_HEADER = struct.Struct("<4sBHI")
+_RECORD = struct.Struct("<cIIHHI")
+
+HASH_SIZE = 16                  # dHash 网格边长，哈希位数为其平方
+NOISE_TILES = 2                 # 与上一保存帧哈希相近、且变化不超过该块数时视为重复（时钟、光标）
+
+
+def screencap(adb: str, serial: str = "", png: bool = False, timeout: float = 10) -> bytes:
+    """
+    经 adb 截屏；指定的序列号不存在时退回默认设备
+
+    Args:
+        png: True 返回 PNG，False 返回原始像素（宽、高、格式头 + RGBA）
+
+    Raises:
+        FileNotFoundError: 找不到 adb
+        subprocess.TimeoutExpired: 截屏超时
+        RuntimeError: adb 返回错误或无输出
+    """
+    args = ["exec-out", "screencap"] + (["-p"] if png else [])
+
+    def run(cmd):
+        out = subprocess.run(cmd, capture_output=True, timeout=timeout)
+        return out.returncode, out.stdout, out.stderr.decode(errors="ignore") if out.stderr else ""
+
+    returncode, stdout, stderr = run([adb, "-s", serial, *args] if serial else [adb, *args])
+    if (returncode != 0 or not stdout) and serial and "not found" in stderr.lower():
+        returncode, stdout, stderr = run([adb, *args])
+    if returncode != 0 or not stdout:
+        raise RuntimeError(stderr.strip() or "无输出")
+    return stdout
+
+
+def decode_screencap(raw: bytes, scale: int = 1) -> tuple[int, int, bytearray]:
+    """解析 screencap 原始输出并按 scale 隔点缩小，返回 (宽, 高, RGB)"""
+    if len(raw) < 12:
+        raise ValueError("screencap 输出过短")
+    width, height, fmt = struct.unpack_from("<III", raw)
+    header = len(raw) - width * height * 4
+    if header not in (12, 16):          # Android 10 起多一个 colorspace 字段
+        raise ValueError(f"无法解析 screencap 输出: {width}x{height}, {len(raw)} 字节")
+    scale = max(1, scale)
+    step = 4 * scale
+    out_w = -(-width // scale)
+    out_h = -(-height // scale)
+    stride = out_w * 3
+    rgb = bytearray(stride * out_h)
+    channels = (2, 1, 0) if fmt == 5 else (0, 1, 2)     # 5: BGRA_8888
+    for j, y in enumerate(range(0, height, scale)):
+        start = header + y * width * 4
+        end = start + width * 4
+        o = j * stride
+        for c, src in enumerate(channels):
+            rgb[o + c:o + stride:3] = raw[start + src:end:step]
+    return out_w, out_h, rgb
+
+
+def perceptual_hash(rgb: bytes, width: int, height: int) -> int:
+    """差值感知哈希：(HASH_SIZE+1) x HASH_SIZE 网格的亮度，比较水平相邻格"""
+    cols, rows = HASH_SIZE + 1, HASH_SIZE
+    stride = width * 3
+    grid = []
+    for gy in range(rows):
+        ys = [((gy * 3 + k) * 2 + 1) * height // (rows * 6) for k in range(3)]
+        for gx in range(cols):
+            xs = [((gx * 3 + k) * 2 + 1) * width // (cols * 6) for k in range(3)]
+            total = 0
+            for y in ys:
+                row = y * stride
+                for x in xs:
+                    i = row + x * 3
+                    total += rgb[i] + 2 * rgb[i + 1] + rgb[i + 2]
+            grid.append(total)
+    value = 0
+    for gy in range(rows):
+        base = gy * cols
+        for gx in range(HASH_SIZE):
+            value = (value << 1) | (grid[base + gx] > grid[base + gx + 1])
+    return value
+
+
+def write_png(width: int, height: int, rgb: bytes) -> bytes:
+    """RGB 像素编码为 PNG"""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    stride = width * 3
+    raw = b"".join(b"\x00" + rgb[y * stride:(y + 1) * stride] for y in range(height))
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw, 6))
+        + chunk(b"IEND", b"")
+    )
+
+
+# ---------------- 分块 ----------------
+
+def _tile_rects(width: int, height: int, tile: int, tiles) -> list[tuple[int, int, int, int]]:
+    cols = -(-width // tile)
+    rects = []
+    for t in tiles:
+        x0, y0 = (t % cols) * tile, (t // cols) * tile
+        rects.append((x0, y0, min(width, x0 + tile), min(height, y0 + tile)))
+    return rects
+
+
+def _gather(canvas: bytes, width: int, rects) -> bytes:
+    stride = width * 3
+    return b"".join(
+        canvas[y * stride + x0 * 3:y * stride + x1 * 3]
+        for x0, y0, x1, y1 in rects for y in range(y0, y1)
+    )
+
+
+def _scatter(canvas: bytearray, width: int, rects, data: bytes) -> None:
+    stride = width * 3
+    p = 0
+    for x0, y0, x1, y1 in rects:
+        n = (x1 - x0) * 3
+        for y in range(y0, y1):
+            o = y * stride + x0 * 3
+            canvas[o:o + n] = data[p:p + n]
+            p += n
+
+
+def _xor(a: bytes, b: bytes) -> bytes:
+    return (int.from_bytes(a, "little") ^ int.from_bytes(b, "little")).to_bytes(len(a), "little")
+
+
+def _changed_tiles(prev: bytes, cur: bytes, width: int, height: int, tile: int) -> list[int]:
+    """与上一帧相比有变化的块号（先按整行比较，只在变化的行内逐块比较）"""
+    stride = width * 3
+    cols = -(-width // tile)
+    changed = set()
+    for y in range(height):
+        o = y * stride
+        if prev[o:o + stride] == cur[o:o + stride]:
+            continue
+        base = (y // tile) * cols
+        for tx in range(cols):
+            if base + tx in changed:
+                continue
+            a = o + tx * tile * 3
+            b = min(o + stride, a + tile * 3)
+            if prev[a:b] != cur[a:b]:
+                changed.add(base + tx)
+    return sorted(changed)
+
+
+# ---------------- 段文件 ----------------
+
+class SegmentWriter:
+    """单个任务的帧段写入（感知哈希去重 + 分块增量）"""
+
+    def __init__(self, path: str, meta: dict, tile: int = 32, dedup_distance: int = 2, keyframe_interval: int = 30):
+        self.path = path
+        self.tile = tile
+        self.dedup_distance = dedup_distance
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.frames = 0             # 时间轴上的帧数（含重复帧）
+        self.stored = 0             # 实际保存的帧数
+        self.size = 0
+        self._hashes: list[tuple[int, int]] = []    # (感知哈希, 保存帧号)，新的在后
+        self._canvas: Optional[bytes] = None
+        self._dims = (0, 0)
+        self._since_key = 0
+        body = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+        self._file = open(path, "wb")
+        self._write(_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, tile, len(body)) + body)
+
+    def add(self, t_ms: int, width: int, height: int, rgb: bytes, final: bool = False) -> str:
+        """
+        追加一帧，返回保存方式：key / delta / repeat
+
+        Args:
+            final: 最后一帧，不做感知去重（与上一保存帧完全相同时仍记为重复）
+        """
+        phash = perceptual_hash(rgb, width, height)
+        self.frames += 1
+        last = self.stored - 1
+        tiles = None
+        if (width, height) == self._dims:
+            if final:
+                tiles = _changed_tiles(self._canvas, rgb, width, height, self.tile)
+                if not tiles:
+                    return self._repeat(t_ms, last)
+            else:
+                for value, frame in reversed(self._hashes):
+                    if bin(value ^ phash).count("1") > self.dedup_distance:
+                        continue
+                    if frame != last:
+                        return self._repeat(t_ms, frame)
+                    tiles = _changed_tiles(self._canvas, rgb, width, height, self.tile)
+                    if len(tiles) <= NOISE_TILES:
+                        return self._repeat(t_ms, frame)
+                    break
+        key = self._canvas is None or (width, height) != self._dims or self._since_key >= self.keyframe_interval
+        if not key:
+            if tiles is None:
+                tiles = _changed_tiles(self._canvas, rgb, width, height, self.tile)
+            key = len(tiles) * 2 > -(-width // self.tile) * -(-height // self.tile)
+        if key:
+            kind, payload = "key", zlib.compress(rgb, 6)
+            self._since_key = 0
+        else:
+            kind = "delta"
+            rects = _tile_rects(width, height, self.tile, tiles)
+            payload = (
+                struct.pack(f"<H{len(tiles)}H", len(tiles), *tiles)
+                + zlib.compress(_xor(_gather(rgb, width, rects), _gather(self._canvas, width, rects)), 6)
+            )
+        frame = self.stored
+        self._record(b"K" if key else b"D", t_ms, frame, width, height, payload)
+        self.stored += 1
+        self._since_key += 1
+        self._canvas = bytes(rgb)
+        self._dims = (width, height)
+        self._hashes.append((phash, frame))
+        return kind
+
+    def close(self) -> int:
+        if not self._file.closed:
+            self._file.close()
+        return self.size
+
+    def _repeat(self, t_ms: int, frame: int) -> str:
+        self._record(b"R", t_ms, frame, 0, 0, b"")
+        return "repeat"
+
+    def _record(self, kind: bytes, t_ms: int, frame: int, width: int, height: int, payload: bytes) -> None:
+        self._write(_RECORD.pack(kind, t_ms, frame, width, height, len(payload)) + payload)
+
+    def _write(self, data: bytes) -> None:
+        self._file.write(data)
+        self._file.flush()
+        self.size += len(data)
+
+
+class FrameSegment:
+    """读取段文件：时间轴与按位置重建帧（缓存最近重建的帧，顺序拖动时只应用一个增量）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.timeline: list[tuple[int, int, str]] = []          # (t_ms, 保存帧号, 类型)
+        self._frames: list[tuple[int, bytes, int, int, int]] = []  # (负载偏移, 类型, 宽, 高, 负载长度)
+        self._cache: Optional[tuple[int, bytearray]] = None
+        self._lock = threading.Lock()
+        with open(path, "rb") as f:
+            magic, version, self.tile, meta_len = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != SEGMENT_MAGIC or version != SEGMENT_VERSION:
+                raise ValueError(f"不是帧段文件: {path}")
+            self.meta = json.loads(f.read(meta_len).decode("utf-8"))
+            offset = _HEADER.size + meta_len
+            size = os.fstat(f.fileno()).st_size
+            while offset + _RECORD.size <= size:
+                kind, t_ms, frame, width, height, length = _RECORD.unpack(f.read(_RECORD.size))
+                offset += _RECORD.size
+                if offset + length > size:
+                    break                   # 录制中断时最后一条记录可能不完整
+                if kind == b"R":
+                    self.timeline.append((t_ms, frame, "repeat"))
+                else:
+                    self.timeline.append((t_ms, frame, "key" if kind == b"K" else "delta"))
+                    self._frames.append((offset, kind, width, height, length))
+                offset += length
+                f.seek(offset)
+        self.size = size
+
+    def info(self) -> dict:
+        width, height = (self._frames[0][2], self._frames[0][3]) if self._frames else (0, 0)
+        return {
+            **self.meta,
+            "width": width,
+            "height": height,
+            "duration_ms": self.timeline[-1][0] if self.timeline else 0,
+            "frame_count": len(self.timeline),
+            "stored_frames": len(self._frames),
+            "keyframes": sum(1 for f in self._frames if f[1] == b"K"),
+            "bytes": self.size,
+            "frames": [
+                {"index": i, "t_ms": t_ms, "frame": frame, "kind": kind}
+                for i, (t_ms, frame, kind) in enumerate(self.timeline)
+            ],
+        }
+
+    def png(self, index: int) -> bytes:
+        """时间轴第 index 帧的 PNG"""
+        frame = self.timeline[index][1]
+        with self._lock:
+            canvas = self._decode(frame)
+            _, _, width, height, _ = self._frames[frame]
+            return write_png(width, height, canvas)
+
+    def _decode(self, frame: int) -> bytearray:
+        start = frame
+        while self._frames[start][1] != b"K":
+            start -= 1
+        cached = self._cache
+        if cached is not None and start <= cached[0] <= frame:
+            start, canvas = cached[0] + 1, cached[1]
+        else:
+            canvas = None
+        with open(self.path, "rb") as f:
+            for i in range(start, frame + 1):
+                offset, kind, width, height, length = self._frames[i]
+                f.seek(offset)
+                payload = f.read(length)
+                if kind == b"K":
+                    canvas = bytearray(zlib.decompress(payload))
+                    continue
+                count = struct.unpack_from("<H", payload)[0]
+                tiles = struct.unpack_from(f"<{count}H", payload, 2)
+                rects = _tile_rects(width, height, self.tile, tiles)
+                data = zlib.decompress(payload[2 + count * 2:])
+                _scatter(canvas, width, rects, _xor(data, _gather(canvas, width, rects)))
+        self._cache = (frame, canvas)
+        return canvas
+
+
+# ---------------- 录制 ----------------
+
+class _Session:
+    """一个任务的录制"""
+
+    __slots__ = ("record", "writer", "started", "started_at", "last_poll", "done")
+
+    def __init__(self, record: TaskRecord):
+        self.record = record
+        self.writer: Optional[SegmentWriter] = None
+        self.started: Optional[float] = None        # 开始归属帧的时间（monotonic）
+        self.started_at = 0.0
+        self.last_poll = 0.0
+        self.done = False
+
+
+class _DeviceCapture:
+    """单台设备的录制状态与统计"""
+
+    def __init__(self):
+        self.sessions: deque[_Session] = deque()
+        self.thread: Optional[threading.Thread] = None
+        self.enabled: Optional[bool] = None     # None 跟随全局设置
+        self.captured = 0
+        self.stored = 0
+        self.repeated = 0
+        self.errors = 0
+        self.last_error = ""
+        self.capture_ms = 0.0                   # 最近一次截屏 + 编码耗时
+
+
+class ScreenRecorder:
+    """按任务录制设备画面（线程安全；每台有待录制任务的设备一个截屏线程）"""
+
+    def __init__(
+        self,
+        directory: str,
+        capture: CaptureFunc,
+        poll: PollFunc,
+        enabled: bool = False,
+        interval: float = 0.5,
+        scale: int = 2,
+        tile: int = 32,
+        dedup_distance: int = 2,
+        keyframe_interval: int = 30,
+        max_seconds: float = 120,
+        max_bytes: int = 500 * 1024 * 1024,
+        poll_interval: float = 2,
+    ):
+        """
+        Args:
+            directory: 段文件目录
+            capture: 截屏函数，返回 screencap 原始输出
+            poll: 任务结果查询，用于及时发现任务完成
+            enabled: 是否对所有设备录制（可按设备用 enable 覆盖）
+            interval: 相邻两次截屏的最小间隔（秒）
+            scale: 保存的缩小倍数（隔 scale 个像素取一个）
+            tile: 增量比较的块边长（像素，缩小后）
+            dedup_distance: 感知哈希距离不超过该值的帧视为重复
+            keyframe_interval: 每保存多少帧插入一个关键帧
+            max_seconds: 单个任务最长录制时间（秒）
+            max_bytes: 段文件总大小上限，超出时删除最早的段
+            poll_interval: 查询任务是否完成的最小间隔（秒）
+        """
+        self.directory = directory
+        self.capture = capture
+        self.poll = poll
+        self.enabled = enabled
+        self.interval = interval
+        self.scale = max(1, scale)
+        self.tile = max(8, tile)
+        self.dedup_distance = dedup_distance
+        self.keyframe_interval = keyframe_interval
+        self.max_seconds = max_seconds
+        self.max_bytes = max_bytes
+        self.poll_interval = poll_interval
+        self._devices: dict[str, _DeviceCapture] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._readers: "OrderedDict[str, FrameSegment]" = OrderedDict()
+        # 已完成的段文件，按修改时间从旧到新，用于总大小控制；目录在首次录制时创建
+        files = []
+        for name in (os.listdir(directory) if os.path.isdir(directory) else ()):
+            if name.endswith(SEGMENT_SUFFIX):
+                path = os.path.join(directory, name)
+                stat = os.stat(path)
+                files.append((stat.st_mtime, path, stat.st_size))
+        files.sort()
+        self._segments: deque[tuple[str, int]] = deque((path, size) for _, path, size in files)
+        self._disk_bytes = sum(size for _, size in self._segments)
+
+    # ---------------- 开关 ----------------
+
+    def enable(self, device_id: str, enabled: Optional[bool]) -> dict:
+        """按设备开启/关闭录制；None 恢复为全局设置。关闭时已在录制的任务录完为止"""
+        with self._lock:
+            self._device(device_id).enabled = enabled
+        return self.stats(device_id)[device_id]
+
+    def enabled_for(self, device_id: str) -> bool:
+        state = self._devices.get(device_id)
+        return self.enabled if state is None or state.enabled is None else state.enabled
+
+    # ---------------- 录制 ----------------
+
+    def track(self, record: TaskRecord) -> None:
+        """ResultStore 登记回调：设备开启录制时为该任务排队录制（可在任意线程调用）"""
+        if self._stop.is_set() or not self.enabled_for(record.device_id):
+            return
+        with self._lock:
+            state = self._device(record.device_id)
+            state.sessions.append(_Session(record))
+            if state.thread is None:
+                state.thread = threading.Thread(
+                    target=self._run, args=(record.device_id, state), name=f"screen-{record.device_id}", daemon=True
+                )
+                state.thread.start()
+
+    def close(self) -> None:
+        """停止所有截屏线程并结束正在写入的段"""
+        self._stop.set()
+        threads = [state.thread for state in self._devices.values() if state.thread is not None]
+        for thread in threads:
+            thread.join(timeout=15)
+
+    def _run(self, device_id: str, state: _DeviceCapture) -> None:
+        while True:
+            with self._lock:
+                if not state.sessions or self._stop.is_set():
+                    remaining = list(state.sessions)
+                    state.sessions.clear()
+                    state.thread = None
+                    break
+                session = state.sessions[0]
+            now = time.monotonic()
+            if session.started is None:
+                session.started, session.started_at = now, time.time()
+            # 先确认任务是否已完成，再截屏：已完成的任务以这一帧（完成后的界面）结束
+            done = self._check_done(device_id, session) or now - session.started > self.max_seconds
+            self._capture(device_id, state, session, final=done)
+            if done:
+                with self._lock:
+                    state.sessions.popleft()
+                self._finish(session)
+                continue
+            self._stop.wait(max(0.0, self.interval - (time.monotonic() - now)))
+        for session in remaining:
+            self._finish(session)
+
+    def _check_done(self, device_id: str, session: _Session) -> bool:
+        if session.record.done:
+            return True
+        now = time.monotonic()
+        if now - session.last_poll >= self.poll_interval:
+            session.last_poll = now
+            try:
+                data = self.poll(device_id, session.record.task_id).get("data")
+                return isinstance(data, dict) and data.get("success") is not None
+            except Exception:
+                pass
+        return False
+
+    def _capture(self, device_id: str, state: _DeviceCapture, session: _Session, final: bool = False) -> None:
+        start = time.monotonic()
+        try:
+            width, height, rgb = decode_screencap(self.capture(device_id), self.scale)
+            if session.writer is None:
+                record = session.record
+                os.makedirs(self.directory, exist_ok=True)
+                session.writer = SegmentWriter(
+                    self._path(record.task_id),
+                    {
+                        "task_id": record.task_id, "device_id": device_id, "app_type": record.app_type,
+                        "op": record.op, "started_at": session.started_at, "scale": self.scale,
+                    },
+                    tile=self.tile, dedup_distance=self.dedup_distance, keyframe_interval=self.keyframe_interval,
+                )
+            kind = session.writer.add(int((start - session.started) * 1000), width, height, rgb, final=final)
+        except Exception as e:
+            state.errors += 1
+            if str(e) != state.last_error:
+                logger.warning(f"任务画面录制截屏失败: {device_id} - {e}")
+            state.last_error = str(e)
+            return
+        state.captured += 1
+        if kind == "repeat":
+            state.repeated += 1
+        else:
+            state.stored += 1
+        state.last_error = ""
+        state.capture_ms = (time.monotonic() - start) * 1000
+
+    def _finish(self, session: _Session) -> None:
+        writer = session.writer
+        if writer is None:
+            return
+        size = writer.close()
+        with self._lock:
+            self._segments.append((writer.path, size))
+            self._disk_bytes += size
+            while self._disk_bytes > self.max_bytes and len(self._segments) > 1:
+                path, old = self._segments.popleft()
+                self._disk_bytes -= old
+                self._readers.pop(path, None)
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    # ---------------- 回看 ----------------
+
+    def timeline(self, task_id: str) -> Optional[dict]:
+        """任务的帧时间轴；没有录制时返回 None"""
+        segment = self._reader(task_id)
+        if segment is None:
+            return None
+        return {**segment.info(), "recording": self._recording(task_id)}
+
+    def frame_png(self, task_id: str, index: int) -> Optional[bytes]:
+        """
+        时间轴第 index 帧（负数从末尾数）的 PNG；没有录制时返回 None
+
+        Raises:
+            IndexError: index 超出时间轴
+        """
+        segment = self._reader(task_id)
+        return None if segment is None else segment.png(index)
+
+    def _reader(self, task_id: str) -> Optional[FrameSegment]:
+        path = self._path(task_id)
+        if not os.path.exists(path):
+            return None
+        with self._lock:
+            segment = self._readers.get(path)
+            # 录制中的段文件持续增长，重新读取索引
+            if segment is not None and not self._recording(task_id):
+                self._readers.move_to_end(path)
+                return segment
+        segment = FrameSegment(path)
+        with self._lock:
+            self._readers[path] = segment
+            while len(self._readers) > 8:
+                self._readers.popitem(last=False)
+        return segment
+
+    def _recording(self, task_id: str) -> bool:
+        return any(
+            session.record.task_id == task_id and session.writer is not None
+            for state in self._devices.values() for session in list(state.sessions)
+        )
+
+    # ---------------- 统计 ----------------
+
+    def stats(self, device_id: Optional[str] = None) -> dict:
+        with self._lock:
+            items = [(device_id, self._device(device_id))] if device_id else list(self._devices.items())
+            return {
+                did: {
+                    "enabled": self.enabled if state.enabled is None else state.enabled,
+                    "queued_tasks": len(state.sessions),
+                    "recording": state.sessions[0].record.task_id if state.sessions and state.sessions[0].writer else "",
+                    "captured": state.captured,
+                    "stored": state.stored,
+                    "repeated": state.repeated,
+                    "errors": state.errors,
+                    "last_error": state.last_error,
+                    "capture_ms": round(state.capture_ms, 1),
+                }
+                for did, state in items
+            }
+
+    def disk_usage(self) -> dict:
+        with self._lock:
+            return {"segments": len(self._segments), "bytes": self._disk_bytes, "max_bytes": self.max_bytes}
+
+    def _device(self, device_id: str) -> _DeviceCapture:
+        state = self._devices.get(device_id)
+        if state is None:
+            state = self._devices[device_id] = _DeviceCapture()
+        return state
+
+    def _path(self, task_id: str) -> str:
+        return os.path.join(self.directory, re.sub(r"[^\w.-]", "_", task_id) + SEGMENT_SUFFIX)
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+聊天会话合并器
+
+设备端每个操作（发消息、读消息、取群成员）都要从主页搜索并打开聊天窗口。
+网关把同一设备上连续提交、针对同一聊天的操作在短时间窗口内合并为一个
+聊天会话任务（/api/chat_session），设备端只导航一次。
+
+合并规则：
+    - 以设备（及租户）为单位，只合并「连续」的操作：同一设备来了另一个聊天的操作时，
+      先下发当前批次，保证设备端执行顺序与提交顺序一致
+    - 窗口到期或动作数达到上限时下发
+    - 批次中只有一个动作时按原接口下发，行为与不合并时完全一致
+    - 提供 limiter（CapacityController）时，每次下发前等待设备有空闲窗口
+    - 多租户：批次按租户分开合并；待下发的批次在每台设备的下发队列中按租户权重公平排队（SFQ，
+      代价为动作数），设备繁忙时大批量的租户不会挡住其他租户，同一租户的批次仍按提交顺序下发
+"""
+import heapq
+import asyncio
+import itertools
+import logging
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Callable, Optional
+
+from .tenants import FairShare
+
+if TYPE_CHECKING:
+    from .capacity import CapacityController
+
+logger = logging.getLogger(__name__)
+
+# dispatch(device_id, app_type, contact, actions) -> 设备端响应（阻塞调用，在线程池中执行）
+DispatchFunc = Callable[[str, str, str, list], dict]
+
+# 单个动作下发时对应的设备端接口（与 ResultStore 记录的 op 一致），多个动作为 chat_session
+_ACTION_OPS = {"send": "send_message", "read": "read_messages", "group_members": "get_group_members"}
+
+
+@dataclass
+class _PendingBatch:
+    app_type: str
+    contact: str
+    tenant: str = ""
+    actions: list = field(default_factory=list)
+    futures: list = field(default_factory=list)
+    timer: Optional[asyncio.TimerHandle] = None
+
+
+class SessionBatcher:
+    """
+    按设备合并连续的同聊天操作
+
+    使用示例:
+        batcher = SessionBatcher(dispatch, window=0.3)
+        resp, index, size = await batcher.submit(
+            "device_1", "wework", "张三", {"type": "send", "message": "你好"}
+        )
+        # size > 1 表示已合并，resp 为会话任务的提交结果，index 为本动作在会话中的序号
+    """
+
+    def __init__(
+        self,
+        dispatch: DispatchFunc,
+        window: float = 0.3,
+        max_actions: int = 20,
+        limiter: Optional["CapacityController"] = None,
+        weight: Optional[Callable[[str], float]] = None,
+    ):
+        """
+        Args:
+            dispatch: 下发函数，参数为 (device_id, app_type, contact, actions)
+            window: 合并窗口（秒），0 表示不合并、立即下发
+            max_actions: 单个会话最多包含的动作数
+            limiter: 设备容量控制器，为空则不限制下发
+            weight: 租户的公平排队权重，为空则各租户同权重
+        """
+        self.dispatch = dispatch
+        self.window = window
+        self.max_actions = max(1, max_actions)
+        self.limiter = limiter
+        self.weight = weight
+        self._pending: dict[tuple[str, str], _PendingBatch] = {}       # (设备, 租户) -> 合并中的批次
+        # 每台设备的下发队列 (公平排队标签, 序号, 批次)，由该设备的下发协程逐个下发，保证同一租户的入队顺序
+        self._queues: dict[str, list[tuple[float, int, _PendingBatch]]] = {}
+        self._fair: dict[str, FairShare] = {}
+        self._workers: dict[str, asyncio.Future] = {}
+        self._seq = itertools.count()
+
+    async def submit(
+        self, device_id: str, app_type: str, contact: str, action: dict, tenant: str = ""
+    ) -> tuple[dict, int, int]:
+        """
+        提交一个聊天动作，等待其所在批次下发完成
+
+        Returns:
+            (设备端响应, 本动作在批次中的序号, 批次动作数)
+        """
+        loop = asyncio.get_running_loop()
+        key = (device_id, tenant)
+        batch = self._pending.get(key)
+        if batch is not None and (batch.app_type, batch.contact) != (app_type, contact):
+            self._flush(key)
+            batch = None
+        if batch is None:
+            batch = _PendingBatch(app_type=app_type, contact=contact, tenant=tenant)
+            self._pending[key] = batch
+            if self.window > 0:
+                batch.timer = loop.call_later(self.window, self._flush, key)
+
+        future = loop.create_future()
+        batch.actions.append(action)
+        batch.futures.append(future)
+        if self.window <= 0 or len(batch.actions) >= self.max_actions:
+            self._flush(key)
+        return await future
+
+    def pending_count(self, device_id: str) -> int:
+        """设备当前待合并与待下发的动作数"""
+        merging = sum(len(b.actions) for (d, _), b in self._pending.items() if d == device_id)
+        return merging + sum(len(b.actions) for _, _, b in self._queues.get(device_id, ()))
+
+    def _flush(self, key: tuple[str, str]) -> None:
+        batch = self._pending.pop(key, None)
+        if batch is None:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+        device_id = key[0]
+        if len(batch.actions) > 1:
+            logger.info(f"合并聊天会话: {device_id} '{batch.contact}' 共 {len(batch.actions)} 个动作")
+        weight = self.weight(batch.tenant) if self.weight else 1.0
+        tag = self._fair.setdefault(device_id, FairShare()).tag(batch.tenant, weight, len(batch.actions))
+        heapq.heappush(self._queues.setdefault(device_id, []), (tag, next(self._seq), batch))
+        worker = self._workers.get(device_id)
+        if worker is None or worker.done():
+            self._workers[device_id] = asyncio.ensure_future(self._drain(device_id))
+
+    async def _drain(self, device_id: str) -> None:
+        """
+        逐个下发设备队列中标签最小的批次
+
+        有 limiter 时先按队首批次的操作等待设备窗口，拿到窗口后再取此刻标签最小的批次，
+        等待期间到达的其他租户的批次也能参与排队。
+        """
+        loop = asyncio.get_running_loop()
+        queue = self._queues[device_id]
+        while queue:
+            if self.limiter is not None:
+                await self.limiter.acquire(device_id, _batch_op(queue[0][2]))
+            tag, _, batch = heapq.heappop(queue)
+            self._fair[device_id].served(tag)
+            op = _batch_op(batch)
+            task_id = ""
+            try:
+                resp = await loop.run_in_executor(
+                    None, self.dispatch, device_id, batch.app_type, batch.contact, batch.actions
+                )
+                if resp.get("success"):
+                    task_id = (resp.get("data") or {}).get("task_id", "")
+            except Exception as e:
+                resp = e
+            finally:
+                if self.limiter is not None:
+                    self.limiter.dispatched(device_id, op, task_id)
+            self._resolve(batch, resp)
+
+    @staticmethod
+    def _resolve(batch: _PendingBatch, resp) -> None:
+        size = len(batch.actions)
+        if isinstance(resp, Exception):
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(resp)
+            return
+        for index, future in enumerate(batch.futures):
+            if not future.done():
+                future.set_result((resp, index, size))
+
+
+def _batch_op(batch: _PendingBatch) -> str:
+    """批次下发时对应的设备端接口"""
+    if len(batch.actions) == 1:
+        return _ACTION_OPS.get(batch.actions[0]["type"], "chat_session")
+    return "chat_session"
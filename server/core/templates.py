@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+消息模板
+
+群发时模板只编译一次（解析为字面量片段与变量），每个收件人按变量行渲染。
+
+语法：
+    {{name}}            变量，行中缺失时报错
+    {{name|默认值}}      变量，行中缺失或为空时使用默认值
+    变量名可用中文，如 {{姓名}}
+
+使用示例:
+    tpl = MessageTemplate("welcome", "{{name}}您好，{{company|我司}}诚邀您参加活动")
+    tpl.render({"name": "张三"})     # "张三您好，我司诚邀您参加活动"
+"""
+import os
+import re
+import json
+import time
+import uuid
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+_VAR_PATTERN = re.compile(r"\{\{\s*(\w+)\s*(?:\|([^}]*))?\}\}")
+
+
+class TemplateError(ValueError):
+    """模板语法错误或渲染时缺少变量"""
+
+
+class MessageTemplate:
+    """编译后的消息模板"""
+
+    def __init__(
+        self, template_id: str, text: str, name: str = "", created_at: Optional[float] = None, tenant_id: str = ""
+    ):
+        self.template_id = template_id
+        self.text = text
+        self.name = name
+        self.created_at = created_at or time.time()
+        self.tenant_id = tenant_id      # 注册模板的租户
+        # 编译结果：(字面量, 变量名, 默认值)，变量名为空表示末尾只有字面量
+        self._segments: list[tuple[str, str, Optional[str]]] = []
+        pos = 0
+        for m in _VAR_PATTERN.finditer(text):
+            default = m.group(2).strip() if m.group(2) is not None else None
+            self._segments.append((text[pos:m.start()], m.group(1), default))
+            pos = m.end()
+        tail = text[pos:]
+        if "{{" in tail or "}}" in tail:
+            raise TemplateError(f"模板语法错误，变量需写作 {{{{name}}}}: {tail[:30]}")
+        self._segments.append((tail, "", None))
+        self.variables = list(dict.fromkeys(name for _, name, _ in self._segments if name))
+        self.required = [
+            v for v in self.variables
+            if any(name == v and default is None for _, name, default in self._segments)
+        ]
+
+    def render(self, row: dict) -> str:
+        """按变量行渲染；缺少必填变量时抛出 TemplateError"""
+        parts = []
+        for literal, name, default in self._segments:
+            parts.append(literal)
+            if not name:
+                continue
+            value = row.get(name)
+            if value is None or value == "":
+                if default is None:
+                    raise TemplateError(f"缺少变量: {name}")
+                value = default
+            parts.append(str(value))
+        return "".join(parts)
+
+    def to_dict(self) -> dict:
+        return {
+            "template_id": self.template_id,
+            "name": self.name,
+            "text": self.text,
+            "variables": self.variables,
+            "required": self.required,
+            "created_at": self.created_at,
+            "tenant_id": self.tenant_id,
+        }
+
+
+class TemplateRegistry:
+    """模板注册表（持久化到本地 JSON 文件，重启后重新编译）"""
+
+    def __init__(self, store_path: Optional[str] = None):
+        self.store_path = store_path
+        self._templates: dict[str, MessageTemplate] = {}
+        self._load()
+
+    def register(self, text: str, name: str = "", template_id: str = "", tenant_id: str = "") -> MessageTemplate:
+        """编译并注册模板；template_id 已存在时覆盖"""
+        template = MessageTemplate(template_id or uuid.uuid4().hex[:12], text, name, tenant_id=tenant_id)
+        self._templates[template.template_id] = template
+        self._save()
+        logger.info(f"消息模板已注册: {template.template_id} 变量={template.variables}")
+        return template
+
+    def get(self, template_id: str) -> Optional[MessageTemplate]:
+        return self._templates.get(template_id)
+
+    def remove(self, template_id: str) -> bool:
+        if self._templates.pop(template_id, None) is None:
+            return False
+        self._save()
+        return True
+
+    def list(self) -> list[MessageTemplate]:
+        return sorted(self._templates.values(), key=lambda t: t.created_at)
+
+    def _load(self) -> None:
+        if not self.store_path or not os.path.exists(self.store_path):
+            return
+        try:
+            with open(self.store_path, "r", encoding="utf-8") as f:
+                for item in json.load(f):
+                    template = MessageTemplate(item["template_id"], item["text"], item.get("name", ""),
+                                               item.get("created_at"), item.get("tenant_id", ""))
+                    self._templates[template.template_id] = template
+            logger.info(f"已加载 {len(self._templates)} 个消息模板: {self.store_path}")
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error(f"加载消息模板失败: {self.store_path} - {e}")
+
+    def _save(self) -> None:
+        if not self.store_path:
+            return
+        tmp_path = f"{self.store_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    [{k: v for k, v in t.to_dict().items() if k in ("template_id", "name", "text", "created_at", "tenant_id")}
+                     for t in self._templates.values()],
+                    f, ensure_ascii=False, indent=2,
+                )
+            os.replace(tmp_path, self.store_path)
+        except OSError as e:
+            logger.error(f"保存消息模板失败: {self.store_path} - {e}")
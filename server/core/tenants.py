@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+"""
+多租户：API Key、设备归属、配额与用量统计
+
+一个网关同时服务多个业务团队时，任何调用方都能操作任意 device_id，某个团队的大批量群发
+会占满准入队列与手机任务队列，其他团队的请求一起变慢。租户把调用方与设备隔离开：
+
+    - 身份：每个租户一个 API Key（请求头 X-API-Key 或 Authorization: Bearer），
+      只能访问分配给自己的设备；管理员 Key 可访问全部设备与接口
+    - 公平排队：准入队列与设备下发队列按租户权重做起始时间公平排队（SFQ，见 FairShare），
+      繁忙时各租户按权重分享处理能力，大批量的租户只会拖慢自己
+    - 配额：每个租户可限制同时处理与排队的请求数（由准入控制执行）、每分钟操作数（令牌桶，
+      允许约 10 秒的突发）与每日操作数（本地时间零点重置）
+    - 用量：按租户统计请求数、响应状态、被拒绝次数与平均耗时；当日用量持久化，重启后配额延续
+
+未配置任何租户时不启用：不校验 API Key，所有调用方视为管理员，行为与之前完全一致。
+
+使用示例:
+    registry = TenantRegistry({"team_a": {"api_key": "xxx", "devices": ["device_1"], "weight": 2}})
+    tenant = registry.authenticate(request.headers.get("X-API-Key"))
+    if tenant is None or not tenant.allows("device_1"):
+        ...
+    registry.charge(tenant)          # 超出速率或每日配额时抛出 QuotaExceeded
+"""
+import os
+import json
+import math
+import time
+import logging
+import datetime
+import threading
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+REASON_RATE_LIMITED = "rate_limited"        # 超过每分钟操作数
+REASON_QUOTA_EXCEEDED = "quota_exceeded"    # 今日配额已用完
+REASON_FORBIDDEN = "forbidden"              # 访问不属于本租户的设备或接口
+
+ADMIN_TENANT_ID = "admin"
+
+
+class QuotaExceeded(Exception):
+    """租户超出配额；retry_after 为建议的重试等待（秒）"""
+
+    def __init__(self, reason: str, message: str, retry_after: int):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+@dataclass(frozen=True)
+class Tenant:
+    """租户（调用方）及其设备与配额"""
+    tenant_id: str
+    name: str = ""
+    api_key: str = field(default="", repr=False)
+    devices: Optional[frozenset] = None     # 可访问的设备，None 为全部设备
+    weight: float = 1.0                     # 公平排队权重
+    max_concurrent: int = 0                 # 同时处理的请求数，0 不限制
+    max_queue: int = 0                      # 排队请求数，0 不限制
+    rate_per_minute: int = 0                # 每分钟操作数，0 不限制
+    daily_quota: int = 0                    # 每日操作数，0 不限制
+    admin: bool = False                     # 可访问全部接口，不受配额限制
+
+    @classmethod
+    def from_config(cls, tenant_id: str, item: dict) -> "Tenant":
+        devices = item.get("devices", "*")
+        return cls(
+            tenant_id=tenant_id,
+            name=item.get("name") or tenant_id,
+            api_key=item.get("api_key") or "",
+            devices=None if devices in ("*", None) else frozenset(devices),
+            weight=max(0.01, float(item.get("weight", 1))),
+            max_concurrent=int(item.get("max_concurrent", 0)),
+            max_queue=int(item.get("max_queue", 0)),
+            rate_per_minute=int(item.get("rate_per_minute", 0)),
+            daily_quota=int(item.get("daily_quota", 0)),
+        )
+
+    def allows(self, device_id: str) -> bool:
+        return self.devices is None or device_id in self.devices
+
+    def visible(self, device_ids: Iterable[str]) -> list[str]:
+        """过滤出本租户可访问的设备（保持顺序）"""
+        return [d for d in device_ids if self.allows(d)]
+
+    def to_dict(self) -> dict:
+        return {
+            "tenant_id": self.tenant_id,
+            "name": self.name,
+            "devices": "*" if self.devices is None else sorted(self.devices),
+            "weight": self.weight,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "rate_per_minute": self.rate_per_minute,
+            "daily_quota": self.daily_quota,
+            "admin": self.admin,
+        }
+
+
+class FairShare:
+    """
+    起始时间公平排队（SFQ）的虚拟时钟
+
+    每个请求的标签 start = max(虚拟时间, 该租户上一请求的结束标签)，结束标签 = start + cost / weight；
+    排队者按标签从小到大服务，服务时虚拟时间推进到该标签。持续排队的租户按权重比例获得服务，
+    同一租户的请求按到达顺序服务；空闲过的租户从当前虚拟时间开始，不会积攒额度一次性挤占队列。
+    """
+
+    def __init__(self):
+        self._virtual = 0.0
+        self._finish: dict[str, float] = {}
+
+    def tag(self, key: str, weight: float = 1.0, cost: float = 1.0) -> float:
+        start = max(self._virtual, self._finish.get(key, 0.0))
+        self._finish[key] = start + cost / max(weight, 0.01)
+        return start
+
+    def served(self, tag: float) -> None:
+        if tag > self._virtual:
+            self._virtual = tag
+
+
+class _Usage:
+    __slots__ = ("day", "used_today", "total", "requests", "status", "rejected",
+                 "latency_ewma", "last_seen", "tokens", "bucket_at")
+
+    def __init__(self):
+        self.day = ""
+        self.used_today = 0                 # 今日已用操作数
+        self.total = 0                      # 累计操作数
+        self.requests: dict[str, int] = {}  # 优先级 -> 请求数
+        self.status = {"2xx": 0, "4xx": 0, "5xx": 0}
+        self.rejected: dict[str, int] = {}  # 原因 -> 次数（含准入控制的拒绝）
+        self.latency_ewma = 0.0
+        self.last_seen = 0.0
+        self.tokens = 0.0                   # 速率令牌桶（不持久化）
+        self.bucket_at = 0.0
+
+
+class TenantRegistry:
+    """租户注册表与用量统计（线程安全：群发与定时任务可能在线程池中计费）"""
+
+    def __init__(self, tenants: Optional[dict] = None, admin_key: str = "", store_path: Optional[str] = None):
+        """
+        Args:
+            tenants: 租户配置 {tenant_id: {"api_key", "devices", "weight", ...}}，为空则不启用多租户
+            admin_key: 管理员 API Key
+            store_path: 用量持久化文件，为空则不持久化
+
+        Raises:
+            ValueError: 租户缺少 api_key 或 api_key 重复
+        """
+        self.store_path = store_path
+        self.enabled = bool(tenants or admin_key)
+        self.admin = Tenant(ADMIN_TENANT_ID, name="管理员", admin=True)
+        self._tenants: dict[str, Tenant] = {}
+        self._keys: dict[str, Tenant] = {}
+        for tenant_id, item in (tenants or {}).items():
+            if tenant_id == ADMIN_TENANT_ID:
+                raise ValueError(f"租户 ID 不能为 {ADMIN_TENANT_ID}")
+            tenant = Tenant.from_config(tenant_id, item)
+            if not tenant.api_key:
+                raise ValueError(f"租户缺少 api_key: {tenant_id}")
+            if tenant.api_key in self._keys or tenant.api_key == admin_key:
+                raise ValueError(f"租户 api_key 重复: {tenant_id}")
+            self._tenants[tenant_id] = tenant
+            self._keys[tenant.api_key] = tenant
+        if admin_key:
+            self._keys[admin_key] = self.admin
+        self._usage: dict[str, _Usage] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._load()
+
+    # ---------------- 租户 ----------------
+
+    def authenticate(self, api_key: Optional[str]) -> Optional[Tenant]:
+        """按 API Key 查找租户；未启用多租户时返回管理员"""
+        if not self.enabled:
+            return self.admin
+        return self._keys.get(api_key or "")
+
+    def get(self, tenant_id: str) -> Optional[Tenant]:
+        if tenant_id == ADMIN_TENANT_ID:
+            return self.admin
+        return self._tenants.get(tenant_id)
+
+    def list(self) -> "list[Tenant]":
+        return list(self._tenants.values())
+
+    def share(self, tenant_id: str) -> tuple[float, int, int]:
+        """准入控制使用的 (权重, 并发上限, 排队上限)"""
+        tenant = self._tenants.get(tenant_id)
+        if tenant is None:
+            return 1.0, 0, 0
+        return tenant.weight, tenant.max_concurrent, tenant.max_queue
+
+    def weight(self, tenant_id: str) -> float:
+        tenant = self._tenants.get(tenant_id)
+        return tenant.weight if tenant else 1.0
+
+    # ---------------- 配额与用量 ----------------
+
+    def charge(self, tenant: Tenant, units: int = 1) -> None:
+        """
+        扣除 units 个操作的配额（管理员不限制）
+
+        Raises:
+            QuotaExceeded: 超过每分钟操作数或今日配额
+        """
+        with self._lock:
+            usage = self._usage_of(tenant.tenant_id)
+            if not tenant.admin and tenant.daily_quota and usage.used_today + units > tenant.daily_quota:
+                self._count_reject(usage, REASON_QUOTA_EXCEEDED)
+                raise QuotaExceeded(
+                    REASON_QUOTA_EXCEEDED, f"今日配额已用完（{tenant.daily_quota} 次）", _seconds_to_midnight()
+                )
+            if not tenant.admin and tenant.rate_per_minute:
+                rate = tenant.rate_per_minute / 60.0
+                burst = max(1.0, tenant.rate_per_minute / 6.0)
+                now = time.monotonic()
+                if usage.bucket_at:
+                    usage.tokens = min(burst, usage.tokens + (now - usage.bucket_at) * rate)
+                else:
+                    usage.tokens = burst
+                usage.bucket_at = now
+                if usage.tokens < units:
+                    self._count_reject(usage, REASON_RATE_LIMITED)
+                    raise QuotaExceeded(
+                        REASON_RATE_LIMITED,
+                        f"超过速率限制（每分钟 {tenant.rate_per_minute} 次）",
+                        max(1, math.ceil((units - usage.tokens) / rate)),
+                    )
+                usage.tokens -= units
+            usage.used_today += units
+            usage.total += units
+            self._dirty = True
+
+    def record(self, tenant: Tenant, priority: str, status_code: int, elapsed: float) -> None:
+        """记录一次已处理的请求"""
+        with self._lock:
+            usage = self._usage_of(tenant.tenant_id)
+            usage.requests[priority] = usage.requests.get(priority, 0) + 1
+            bucket = f"{status_code // 100}xx"
+            if bucket in usage.status:
+                usage.status[bucket] += 1
+            usage.latency_ewma += 0.1 * (elapsed - usage.latency_ewma) if usage.latency_ewma else elapsed
+            usage.last_seen = time.time()
+            self._dirty = True
+
+    def reject(self, tenant: Tenant, reason: str) -> None:
+        """记录一次被拒绝的请求（无权访问、准入控制拒绝等）"""
+        with self._lock:
+            self._count_reject(self._usage_of(tenant.tenant_id), reason)
+
+    def usage(self, tenant_id: str) -> dict:
+        tenant = self.get(tenant_id)
+        with self._lock:
+            usage = self._usage_of(tenant_id)
+            quota = tenant.daily_quota if tenant and not tenant.admin else 0
+            return {
+                "tenant_id": tenant_id,
+                "name": tenant.name if tenant else tenant_id,
+                "day": usage.day,
+                "used_today": usage.used_today,
+                "daily_quota": quota,
+                "remaining_today": max(0, quota - usage.used_today) if quota else None,
+                "total": usage.total,
+                "requests": dict(usage.requests),
+                "status": dict(usage.status),
+                "rejected": dict(usage.rejected),
+                "avg_latency_ms": round(usage.latency_ewma * 1000, 1),
+                "last_seen": usage.last_seen or None,
+            }
+
+    # ---------------- 持久化 ----------------
+
+    def save(self, force: bool = False) -> None:
+        """有未保存的变化时写入持久化文件"""
+        if not self.store_path or not (self._dirty or force):
+            return
+        tmp_path = f"{self.store_path}.tmp"
+        with self._lock:
+            data = {
+                tenant_id: {
+                    "day": u.day, "used_today": u.used_today, "total": u.total, "requests": u.requests,
+                    "status": u.status, "rejected": u.rejected, "last_seen": u.last_seen,
+                }
+                for tenant_id, u in self._usage.items()
+            }
+            self._dirty = False
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.store_path)
+        except OSError as e:
+            logger.error(f"保存租户用量失败: {self.store_path} - {e}")
+
+    def _load(self) -> None:
+        if not self.store_path or not os.path.exists(self.store_path):
+            return
+        try:
+            with open(self.store_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for tenant_id, item in data.items():
+                usage = self._usage[tenant_id] = _Usage()
+                usage.day = item.get("day") or ""
+                usage.used_today = int(item.get("used_today") or 0)
+                usage.total = int(item.get("total") or 0)
+                usage.requests = dict(item.get("requests") or {})
+                usage.status.update(item.get("status") or {})
+                usage.rejected = dict(item.get("rejected") or {})
+                usage.last_seen = item.get("last_seen") or 0.0
+            logger.info(f"已加载租户用量: {len(self._usage)} 个租户 ({self.store_path})")
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            logger.error(f"加载租户用量失败: {self.store_path} - {e}")
+
+    # ---------------- 内部 ----------------
+
+    def _usage_of(self, tenant_id: str) -> _Usage:
+        """取租户用量（调用方持有锁）；跨天时重置当日用量"""
+        usage = self._usage.get(tenant_id)
+        if usage is None:
+            usage = self._usage[tenant_id] = _Usage()
+        today = datetime.date.today().isoformat()
+        if usage.day != today:
+            usage.day = today
+            usage.used_today = 0
+        return usage
+
+    def _count_reject(self, usage: _Usage, reason: str) -> None:
+        usage.rejected[reason] = usage.rejected.get(reason, 0) + 1
+        self._dirty = True
+
+
+def _seconds_to_midnight() -> int:
+    now = datetime.datetime.now()
+    midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time())
+    return max(1, math.ceil((midnight - now).total_seconds()))
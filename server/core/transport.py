@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+"""
+设备 HTTP 交互的录制与回放
+
+网关到设备的所有请求都经 DeviceClient 的 requests 会话发出。这里提供两个 requests
+传输适配器，挂载到会话上即可在不改动调用代码的情况下：
+
+    - 录制（ExchangeRecorder）：照常请求真实设备，同时把每次交互（请求、响应、耗时、
+      连接失败/超时）追加写入 JSONL 文件
+    - 回放（ExchangeReplay）：不访问网络，按录制文件返回响应，并按原始耗时（可缩放）等待，
+      用于无手机时测量网关吞吐与延迟回归
+
+回放不是逐条照搬：
+    - 提交类请求（响应含 task_id）按「方法 + 路径 + 请求体」匹配录制，没有相同请求体时
+      轮流使用同路径的录制；每次提交生成新的 task_id，可回放比录制更多的请求
+    - 每台设备模拟一个 FIFO 任务队列：任务的服务时间取录制结果中的 elapsed_ms（旧版 APK
+      为提交到首次查到结果的间隔），task_result 在模拟完成时间之前返回「仍在执行中」，
+      因此网关的轮询频率、并发窗口变化都会如实反映在回放结果上
+    - status 的 task_queue_size 取模拟队列中等待的任务数
+    - 匹配不区分设备，模拟队列按设备独立：录一台手机即可回放任意多台设备
+
+使用示例:
+    recorder = ExchangeRecorder("device_exchanges.jsonl")
+    client = DeviceClient("http://192.168.1.100:9527", transport=recorder.adapter("http://192.168.1.100:9527"))
+
+    replay = ExchangeReplay("device_exchanges.jsonl", latency_scale=0.5)
+    client = DeviceClient("http://10.0.0.1:9527", transport=replay.adapter("http://10.0.0.1:9527"))
+"""
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+logger = logging.getLogger(__name__)
+
+TRANSPORT_MODES = ("record", "replay")
+
+# 设备端任务仍在执行时 task_result 的响应
+_PENDING_RESPONSE = {"code": 200, "success": False, "message": "任务结果未找到或仍在执行中"}
+
+TransportFactory = Callable[[str], BaseAdapter]
+
+
+def make_transport(mode: str, path: str, latency_scale: float = 1.0) -> Optional[TransportFactory]:
+    """
+    按配置创建传输工厂（api_base -> 适配器），mode 为空时返回 None（直接访问设备）
+
+    Raises:
+        ValueError: mode 不是 record / replay
+    """
+    if not mode:
+        return None
+    if mode == "record":
+        return ExchangeRecorder(path).adapter
+    if mode == "replay":
+        return ExchangeReplay(path, latency_scale=latency_scale).adapter
+    raise ValueError(f"未知的设备传输模式: {mode}，可用: {', '.join(TRANSPORT_MODES)}")
+
+
+def _device_of(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _path_of(url: str) -> str:
+    return urlsplit(url).path
+
+
+def _decode(raw: Any) -> Any:
+    if raw is None:
+        return None
+    if isinstance(raw, bytes):
+        raw = raw.decode("utf-8", errors="replace")
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return raw
+
+
+def _read_timeout(timeout: Any) -> Optional[float]:
+    if isinstance(timeout, tuple):
+        return timeout[1]
+    return timeout
+
+
+def _task_id(response: Any) -> str:
+    if isinstance(response, dict) and response.get("success") and isinstance(response.get("data"), dict):
+        return str(response["data"].get("task_id") or "")
+    return ""
+
+
+# ================================================================
+# 录制
+# ================================================================
+
+class ExchangeRecorder:
+    """把设备交互追加写入 JSONL 文件（各设备客户端共用，线程安全）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+        self._started = time.time()
+        self.count = 0
+        logger.info(f"设备交互录制中: {path}")
+
+    def adapter(self, api_base: str) -> "RecordingAdapter":
+        return RecordingAdapter(self)
+
+    def write(self, exchange: dict) -> None:
+        line = json.dumps(exchange, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            self.count += 1
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class RecordingAdapter(HTTPAdapter):
+    """照常发送请求，并把请求、响应与耗时交给 ExchangeRecorder"""
+
+    def __init__(self, recorder: ExchangeRecorder):
+        super().__init__()
+        self.recorder = recorder
+
+    def send(self, request, **kwargs):
+        exchange = {
+            "ts": round(time.time() - self.recorder._started, 3),
+            "device": _device_of(request.url),
+            "method": request.method,
+            "path": _path_of(request.url),
+            "body": _decode(request.body),
+        }
+        start = time.perf_counter()
+        try:
+            response = super().send(request, **kwargs)
+            response.content      # 读完响应体，耗时包含传输时间
+        except requests.Timeout:
+            self._write(exchange, start, error="timeout")
+            raise
+        except requests.ConnectionError:
+            self._write(exchange, start, error="connect")
+            raise
+        self._write(exchange, start, status=response.status_code, response=_decode(response.content))
+        return response
+
+    def _write(self, exchange: dict, start: float, **fields) -> None:
+        exchange["elapsed"] = round(time.perf_counter() - start, 4)
+        exchange.update(fields)
+        self.recorder.write(exchange)
+
+
+# ================================================================
+# 回放
+# ================================================================
+
+class _SimDevice:
+    """回放中的一台设备：FIFO 任务队列与已提交任务"""
+
+    def __init__(self):
+        self.busy_until = 0.0
+        self.queue: deque[tuple[float, float]] = deque()    # (开始时间, 完成时间)
+        self.tasks: dict[str, tuple[float, dict]] = {}      # task_id -> (完成时间, task_result 响应)
+
+    def waiting(self, now: float) -> int:
+        while self.queue and self.queue[0][1] <= now:
+            self.queue.popleft()
+        return sum(start > now for start, _ in self.queue)
+
+
+class ExchangeReplay:
+    """按录制文件回放设备响应（各设备客户端共用，线程安全）"""
+
+    def __init__(self, path: str, latency_scale: float = 1.0):
+        """
+        Args:
+            path: 录制文件（ExchangeRecorder 写入的 JSONL）
+            latency_scale: 耗时缩放：1 为原始耗时，0.5 为一半，0 为不等待
+        """
+        self.path = path
+        self.latency_scale = max(0.0, latency_scale)
+        self._lock = threading.Lock()
+        self._by_route: dict[tuple[str, str], list[dict]] = {}          # (方法, 路径) -> 录制
+        self._by_body: dict[tuple[str, str, str], deque] = {}           # (方法, 路径, 请求体) -> 未用的录制
+        self._cursor: dict[tuple[str, str], int] = {}
+        self._devices: set[str] = set()
+        self._sim: dict[str, _SimDevice] = {}
+        self._pending = _PENDING_RESPONSE
+        self._poll_latency = 0.0            # task_result 的平均耗时（秒，未缩放）
+        self._load()
+
+    def adapter(self, api_base: str) -> "ReplayAdapter":
+        return ReplayAdapter(self)
+
+    def _load(self) -> None:
+        exchanges = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    exchanges.append(json.loads(line))
+                except ValueError as e:
+                    logger.warning(f"跳过无法解析的录制行 {line_no}: {e}")
+
+        # 任务的服务时间与最终结果：取该 task_id 首次查到结果的 task_result
+        submitted: dict[str, dict] = {}
+        polls = [ex.get("elapsed", 0.0) for ex in exchanges if ex.get("path", "").startswith("/api/task_result/")]
+        self._poll_latency = sum(polls) / len(polls) if polls else 0.0
+        for ex in exchanges:
+            task_id = _task_id(ex.get("response")) if ex.get("method") == "POST" else ""
+            if task_id:
+                submitted[task_id] = ex
+            elif ex.get("path", "").startswith("/api/task_result/"):
+                sub = submitted.get(ex["path"].rsplit("/", 1)[-1])
+                data = (ex.get("response") or {}).get("data") if isinstance(ex.get("response"), dict) else None
+                if sub is None or "result" in sub:
+                    continue
+                if isinstance(data, dict) and data.get("success") is not None:
+                    elapsed_ms = data.get("elapsed_ms")
+                    sub["service"] = elapsed_ms / 1000 if elapsed_ms else max(0.0, ex["ts"] - sub["ts"])
+                    sub["result"] = ex["response"]
+                elif isinstance(ex.get("response"), dict):
+                    self._pending = ex["response"]
+
+        for ex in exchanges:
+            if ex.get("path", "").startswith("/api/task_result/"):
+                continue        # 由模拟队列生成
+            route = (ex.get("method", "GET"), ex.get("path", ""))
+            self._by_route.setdefault(route, []).append(ex)
+            self._by_body.setdefault(route + (self._body_key(ex.get("body")),), deque()).append(ex)
+            self._devices.add(ex.get("device", ""))
+        logger.info(f"已加载设备交互录制: {len(exchanges)} 条，{len(self._by_route)} 种请求 ({self.path})")
+
+    @staticmethod
+    def _body_key(body: Any) -> str:
+        return json.dumps(body, ensure_ascii=False, sort_keys=True)
+
+    def _match(self, method: str, path: str, body: Any) -> Optional[dict]:
+        route = (method, path)
+        with self._lock:
+            same_body = self._by_body.get(route + (self._body_key(body),))
+            if same_body:
+                ex = same_body.popleft()
+                same_body.append(ex)            # 循环使用
+                return ex
+            candidates = self._by_route.get(route)
+            if not candidates:
+                return None
+            index = self._cursor.get(route, 0)
+            self._cursor[route] = index + 1
+            return candidates[index % len(candidates)]
+
+    def respond(self, device: str, method: str, path: str, body: Any) -> tuple[float, Optional[str], int, Any]:
+        """
+        计算回放响应
+
+        Returns:
+            (耗时秒, 错误类型 None/"connect"/"timeout", 状态码, 响应体)
+        """
+        now = time.monotonic()
+        if path.startswith("/api/task_result/"):
+            return self._task_result(device, path.rsplit("/", 1)[-1], now)
+        ex = self._match(method, path, body)
+        if ex is None:
+            return 0.0, None, 404, {"code": 404, "success": False, "message": f"回放录制中没有该请求: {method} {path}"}
+        latency = ex.get("elapsed", 0.0) * self.latency_scale
+        if ex.get("error"):
+            return latency, ex["error"], 0, None
+        response = ex.get("response")
+        with self._lock:
+            sim = self._sim.setdefault(device, _SimDevice())
+            if "service" in ex:
+                task_id = uuid.uuid4().hex[:8]
+                start = max(now + latency, sim.busy_until)
+                sim.busy_until = start + ex["service"] * self.latency_scale
+                sim.queue.append((start, sim.busy_until))
+                result = json.loads(json.dumps(ex["result"]))
+                result["data"]["task_id"] = task_id
+                sim.tasks[task_id] = (sim.busy_until, result)
+                response = {**response, "data": {**response["data"], "task_id": task_id}}
+            elif path == "/api/status" and isinstance(response, dict) and isinstance(response.get("data"), dict):
+                response = {**response, "data": {**response["data"], "task_queue_size": sim.waiting(now)}}
+        return latency, None, ex.get("status", 200), response
+
+    def _task_result(self, device: str, task_id: str, now: float) -> tuple[float, Optional[str], int, Any]:
+        with self._lock:
+            sim = self._sim.get(device)
+            entry = sim.tasks.get(task_id) if sim is not None else None
+        latency = self._poll_latency * self.latency_scale
+        if entry is None or now < entry[0]:
+            return latency, None, 200, self._pending
+        return latency, None, 200, entry[1]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "routes": {f"{m} {p}": len(exs) for (m, p), exs in self._by_route.items()},
+                "recorded_devices": sorted(self._devices),
+                "replayed_devices": len(self._sim),
+                "latency_scale": self.latency_scale,
+            }
+
+
+class ReplayAdapter(BaseAdapter):
+    """不访问网络，从 ExchangeReplay 取响应并按录制耗时等待"""
+
+    def __init__(self, replay: ExchangeReplay):
+        super().__init__()
+        self.replay = replay
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        latency, error, status, content = self.replay.respond(
+            _device_of(request.url), request.method, _path_of(request.url), _decode(request.body)
+        )
+        read_timeout = _read_timeout(timeout)
+        if read_timeout is not None and latency > read_timeout:
+            time.sleep(read_timeout)
+            raise requests.ReadTimeout(f"回放请求超时 ({read_timeout}s): {request.url}", request=request)
+        if latency > 0:
+            time.sleep(latency)
+        if error == "timeout":
+            raise requests.ReadTimeout(f"回放录制的超时: {request.url}", request=request)
+        if error:
+            raise requests.ConnectionError(f"回放录制的连接失败: {request.url}", request=request)
+
+        response = requests.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict({"Content-Type": "application/json"})
+        response._content = json.dumps(content, ensure_ascii=False).encode("utf-8")
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        response.reason = "OK" if status < 400 else "Replay"
+        return response
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+测试公共夹具
+
+- fake_device: 本机线程 HTTP 服务，模拟设备端任务接口（提交即返回 task_id，查询即完成；hold 为 True 时任务保持执行中）
+- gateway: 导入网关模块前把所有持久化文件与目录指向临时目录，并配置两台设备、两个租户
+- client: 携带管理员 API Key 的 TestClient
+- tenant_headers: 各租户的 API Key 请求头
+
+测试模块不要 import conftest（取决于 pytest 的导入方式），共享的常量经夹具或 fake_device 的属性获取。
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+ADMIN_KEY = "test-admin"
+TENANT_KEYS = {"team_a": "key-a", "team_b": "key-b"}
+
+CONTACTS = [{"name": "张三", "remark": ""}, {"name": "李四", "remark": "销售"}]
+
+
+class FakeDevice:
+    """模拟设备端 HTTP 接口，记录收到的 POST 请求"""
+
+    def __init__(self):
+        self.contacts = CONTACTS                   # get_contact_list 返回的联系人
+        self.posts: list[tuple[str, dict]] = []
+        self.gets: list[str] = []
+        self.fail_paths: set[str] = set()
+        self.results: dict[str, object] = {}        # 提交路径 -> 该类任务结果的 data
+        self._task_paths: dict[str, str] = {}
+        self.hold = False
+        self._lock = threading.Lock()
+        device = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, obj):
+                body = json.dumps(obj, ensure_ascii=False).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                data = json.loads(self.rfile.read(length) or b"{}")
+                with device._lock:
+                    device.posts.append((self.path, data))
+                if self.path in device.fail_paths:
+                    return self._send({"code": 500, "success": False, "message": "设备忙"})
+                if self.path == "/api/get_contact_list":
+                    # 联系人列表同步返回，data 为列表而不是 {"task_id": ...}
+                    return self._send({"code": 200, "success": True, "message": "ok", "data": device.contacts})
+                task_id = uuid.uuid4().hex[:8]
+                with device._lock:
+                    device._task_paths[task_id] = self.path
+                self._send({"code": 200, "success": True, "message": "任务已提交", "data": {"task_id": task_id}})
+
+            def do_GET(self):
+                with device._lock:
+                    device.gets.append(self.path)
+                if self.path.startswith("/api/task_result/"):
+                    task_id = self.path.rsplit("/", 1)[-1]
+                    if device.hold:
+                        return self._send({"code": 200, "success": True, "message": "ok", "data": {
+                            "task_id": task_id, "status": "running",
+                        }})
+                    data = device.results.get(device._task_paths.get(task_id, ""))
+                    return self._send({"code": 200, "success": True, "message": "ok", "data": {
+                        "task_id": task_id, "success": True, "message": "done", "data": data, "elapsed_ms": 10,
+                    }})
+                if self.path == "/api/status":
+                    return self._send({"code": 200, "success": True, "message": "ok", "data": {
+                        "accessibility_enabled": True, "task_queue_size": 0,
+                    }})
+                self._send({"code": 404, "success": False, "message": "not found"})
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.api_base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def posted(self, path: str) -> list[dict]:
+        with self._lock:
+            return [data for p, data in self.posts if p == path]
+
+    def polled(self) -> list[str]:
+        """按查询顺序返回被查询结果的 task_id"""
+        with self._lock:
+            return [p.rsplit("/", 1)[-1] for p in self.gets if p.startswith("/api/task_result/")]
+
+    def reset(self) -> None:
+        with self._lock:
+            self.posts.clear()
+            self.gets.clear()
+        self.fail_paths.clear()
+        self.results.clear()
+        self.hold = False
+
+    def start(self) -> "FakeDevice":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture(scope="session")
+def fake_device():
+    device = FakeDevice().start()
+    yield device
+    device.stop()
+
+
+@pytest.fixture(scope="session")
+def gateway(fake_device):
+    """网关模块（整个测试会话只导入一次）"""
+    from server import config
+
+    tmp = tempfile.mkdtemp(prefix="rpa-gateway-test-")
+    config.DEVICES = {
+        "device_1": {"name": "设备1", "api_base": fake_device.api_base, "target_app": "wework"},
+        "device_2": {"name": "设备2", "api_base": fake_device.api_base, "target_app": "wework"},
+    }
+    config.TENANTS = {
+        "team_a": {"api_key": TENANT_KEYS["team_a"], "devices": ["device_1"]},
+        "team_b": {"api_key": TENANT_KEYS["team_b"], "devices": ["device_2"]},
+    }
+    config.TENANT_ADMIN_KEY = ADMIN_KEY
+    config.DEVICE_TRANSPORT = ""
+    config.SESSION_MERGE_WINDOW = 0
+    config.CAMPAIGN_SEND_INTERVAL = 0
+    config.CONTACT_INDEX_REFRESH_INTERVAL = 0
+    config.EVENT_DEVICE_PROBE_INTERVAL = 0
+    config.SCREEN_CAPTURE_ENABLED = False
+    for name in (
+        "DEVICE_TRANSPORT_FILE", "RESULT_STORE_SPILL_DIR", "CONTACT_INDEX_STORE", "WEBHOOK_STORE", "WEBHOOK_OUTBOX_DIR",
+        "SCHEDULER_STORE", "TEMPLATE_STORE", "CAMPAIGN_SPOOL_DIR", "SCREEN_CAPTURE_DIR", "TENANT_USAGE_STORE",
+    ):
+        setattr(config, name, os.path.join(tmp, getattr(config, name)))
+
+    from server.api import app as gateway_module
+    yield gateway_module
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def _test_client(gateway):
+    from fastapi.testclient import TestClient
+
+    with TestClient(gateway.app, headers={"X-API-Key": ADMIN_KEY}) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def client(_test_client, fake_device):
+    fake_device.reset()
+    return _test_client
+
+
+@pytest.fixture
+def tenant_headers() -> dict[str, dict]:
+    return {tenant: {"X-API-Key": key} for tenant, key in TENANT_KEYS.items()}
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""准入控制：请求分类、429 与 Retry-After、上传请求体不被缓冲"""
+import asyncio
+import time
+
+import pytest
+from starlette.requests import Request
+
+from server.core.admission import (
+    PRIORITY_BULK, PRIORITY_CRITICAL, PRIORITY_INTERACTIVE, REASON_DEADLINE, REASON_DEVICE_BUSY, REASON_OVERLOADED,
+    AdmissionController, AdmissionRejected,
+)
+
+
+@pytest.mark.parametrize("method, path, expected", [
+    ("GET", "/api/devices", (PRIORITY_CRITICAL, "")),
+    ("GET", "/api/devices/device_1/screen", (PRIORITY_INTERACTIVE, "device_1")),
+    ("OPTIONS", "/api/wework/send_message", (PRIORITY_CRITICAL, "")),
+    ("POST", "/api/wework/send_message", (PRIORITY_INTERACTIVE, "")),
+    ("POST", "/api/wework/contacts", (PRIORITY_BULK, "")),
+    ("POST", "/api/wework/campaigns", (PRIORITY_BULK, "")),
+    ("POST", "/api/wechat/campaigns", (PRIORITY_BULK, "")),
+    ("POST", "/api/broadcast", (PRIORITY_BULK, "")),
+    ("POST", "/api/jobs/abc/run", (PRIORITY_BULK, "")),
+    ("POST", "/api/templates", (PRIORITY_CRITICAL, "")),
+])
+def test_admission_class(gateway, method, path, expected):
+    assert gateway._admission_class(method, path) == expected
+
+
+def _request(content_type: str) -> Request:
+    async def receive():
+        raise AssertionError("请求体不应被读取")
+
+    headers = [(b"content-type", content_type.encode())]
+    return Request({"type": "http", "method": "POST", "path": "/", "headers": headers}, receive)
+
+
+@pytest.mark.parametrize("content_type", ["application/x-ndjson", "text/csv", "application/jsonl", ""])
+def test_upload_body_is_not_read(gateway, content_type):
+    assert asyncio.run(gateway._request_json(_request(content_type))) == {}
+
+
+def test_controller_rejects_when_full():
+    async def run():
+        controller = AdmissionController(max_concurrent=1, max_queue=0)
+        ticket = await controller.admit(PRIORITY_INTERACTIVE, "device_1")
+        with pytest.raises(AdmissionRejected) as excinfo:
+            await controller.admit(PRIORITY_INTERACTIVE, "device_2")
+        controller.release(ticket)
+        return excinfo.value
+
+    rejected = asyncio.run(run())
+    assert rejected.reason == REASON_OVERLOADED
+    assert rejected.retry_after >= 1
+
+
+@pytest.fixture
+def busy_devices(gateway, monkeypatch):
+    """设备上积压已超过队列深度上限"""
+    controller = AdmissionController(max_per_device=1, backlog=lambda device_id: 5, drain=lambda device_id, n: 7.0)
+    monkeypatch.setattr(gateway, "admission", controller)
+    return controller
+
+
+def test_device_busy_returns_429_with_retry_after(client, busy_devices):
+    response = client.post("/api/wework/send_message", json={"device_id": "device_1", "contact": "张三", "message": "x"})
+    assert response.status_code == 429
+    assert response.json()["reason"] == REASON_DEVICE_BUSY
+    assert int(response.headers["Retry-After"]) >= 7
+    assert client.get("/api/devices").status_code == 200
+
+
+def test_campaign_upload_is_admitted_by_query_device(client, busy_devices):
+    response = client.post(
+        "/api/wework/campaigns", params={"template_id": "missing", "device_id": "device_1"},
+        content='{"contact": "张三"}\n'.encode(), headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 429
+    assert response.json()["reason"] == REASON_DEVICE_BUSY
+
+
+def test_preflight_bypasses_admission(client, busy_devices):
+    response = client.options("/api/wework/send_message", headers={
+        "Origin": "http://localhost:5173", "Access-Control-Request-Method": "POST",
+    })
+    assert response.status_code == 200
+    assert response.headers["access-control-allow-origin"] in ("*", "http://localhost:5173")
+
+
+def test_waiter_past_deadline_is_rejected_not_cancelled():
+    """事件循环被阻塞超过排队时限后再唤醒：等待方收到 deadline 拒绝，而不是 CancelledError"""
+    async def run():
+        controller = AdmissionController(max_concurrent=1, max_queue=10)
+        ticket = await controller.admit(PRIORITY_INTERACTIVE, "")
+        waiter = asyncio.ensure_future(controller.admit(PRIORITY_INTERACTIVE, "", timeout=0.05))
+        await asyncio.sleep(0)
+        time.sleep(0.1)             # 阻塞事件循环，越过等待方的截止时间
+        controller.release(ticket)
+        with pytest.raises(AdmissionRejected) as excinfo:
+            await waiter
+        return controller, excinfo.value
+
+    controller, rejected = asyncio.run(run())
+    assert rejected.reason == REASON_DEADLINE
+    assert controller.stats()["priorities"][PRIORITY_INTERACTIVE]["rejected"][REASON_DEADLINE] == 1
+    assert controller.stats()["active"] == 0
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""模板群发：设备队列溢出到文件，慢设备不挡住其他设备"""
+import asyncio
+import os
+
+from server.core.campaign import Campaign, CampaignRunner
+from server.core.templates import MessageTemplate
+
+
+def _write_csv(path, rows):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("contact,device_id,name\n")
+        for contact, device_id in rows:
+            f.write(f"{contact},{device_id},{contact}\n")
+
+
+def test_busy_device_does_not_block_others(tmp_path):
+    path = str(tmp_path / "recipients.csv")
+    rows = [(f"a{i}", "slow") for i in range(20)] + [(f"b{i}", "fast") for i in range(5)]
+    _write_csv(path, rows)
+
+    async def run():
+        release = asyncio.Event()
+        sent = []
+
+        async def send(device_id, app_type, contact, message, tenant_id):
+            if device_id == "slow":
+                await release.wait()
+            sent.append((device_id, contact, message))
+            return {"success": True}
+
+        runner = CampaignRunner(send, queue_size=2)
+        campaign = runner.start(
+            Campaign(campaign_id="", template_id="t", app_type="wework", device_id="", fmt="csv", path=path),
+            MessageTemplate("t", "你好 {{name}}"),
+        )
+        for _ in range(100):
+            if sum(1 for d, _, _ in sent if d == "fast") == 5:
+                break
+            await asyncio.sleep(0.01)
+        fast_done_while_slow_blocked = [c for d, c, _ in sent if d == "fast"]
+        spooled = [name for name in os.listdir(tmp_path) if name.endswith(".lane")]
+
+        release.set()
+        for _ in range(100):
+            if campaign.finished_at is not None:
+                break
+            await asyncio.sleep(0.01)
+        return campaign, sent, fast_done_while_slow_blocked, spooled
+
+    campaign, sent, fast_done, spooled = asyncio.run(run())
+    assert fast_done == [f"b{i}" for i in range(5)]
+    assert spooled, "超出内存容量的消息应写入溢出文件"
+    assert campaign.status == "completed"
+    assert campaign.sent == 25
+    assert [c for d, c, _ in sent if d == "slow"] == [f"a{i}" for i in range(20)]
+    assert ("slow", "a3", "你好 a3") in sent
+    assert os.listdir(tmp_path) == []
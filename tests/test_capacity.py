@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""设备容量模型：服务时间 EWMA、AIMD 窗口、下发节奏、外部积压，以及各路由的下发都经过控制器"""
+import asyncio
+import time
+
+import pytest
+
+from server.core.capacity import CapacityController, OpStats
+from server.core.result_store import STATUS_FAILED, STATUS_SUCCESS, TaskRecord
+
+
+def _controller(**kwargs) -> CapacityController:
+    return CapacityController(poll=lambda device_id, task_id: {}, status=lambda device_id: {}, **kwargs)
+
+
+def _complete(controller: CapacityController, task_id: str, seconds: float, success: bool = True) -> None:
+    record = TaskRecord(task_id, "device_1", op="send_message")
+    record.service_ms = int(seconds * 1000)
+    record.status = STATUS_SUCCESS if success else STATUS_FAILED
+    controller.observe(record)
+
+
+def test_service_time_ewma():
+    stats = OpStats()
+    stats.observe(1.0, True, degraded=False)
+    assert (stats.mean, stats.dev, stats.baseline) == (1.0, 0.5, 1.0)
+    stats.observe(2.0, False, degraded=False)
+    assert stats.mean == pytest.approx(1.2)
+    assert stats.dev == pytest.approx(0.625)
+    assert stats.baseline == pytest.approx(1.004)
+    assert (stats.count, stats.failures) == (2, 1)
+    assert stats.fail_rate == pytest.approx(0.2)
+
+
+def test_window_grows_on_completion_and_halves_when_slow():
+    controller = _controller(initial_window=2, max_window=8)
+    state = controller._state("device_1")
+    for i in range(6):
+        state.inflight[f"t{i}"] = ("send_message", time.monotonic())
+        _complete(controller, f"t{i}", 1.0)
+    grown = state.window
+    assert 2 < grown <= 8
+    assert not state.warning
+
+    for i in range(6, 12):
+        _complete(controller, f"t{i}", 10.0)
+    assert state.window == pytest.approx(max(1.0, grown / 2))
+    assert "服务时间" in state.warning
+    assert controller.stats("device_1")["device_1"]["degraded"] is True
+
+
+def test_window_is_capped():
+    controller = _controller(initial_window=2, max_window=3)
+    state = controller._state("device_1")
+    for i in range(50):
+        state.inflight[f"t{i}"] = ("send_message", time.monotonic())
+        _complete(controller, f"t{i}", 1.0)
+    assert state.window == 3
+
+
+def test_dispatch_is_paced():
+    """相邻下发至少间隔 预测服务时间 / 窗口"""
+    controller = _controller(initial_window=2)
+    state = controller._state("device_1")
+    state.ops["send_message"] = OpStats()
+    state.ops["send_message"].observe(0.4, True, degraded=False)
+
+    async def run():
+        await controller.acquire("device_1", "send_message")
+        controller.dispatched("device_1", "send_message", "")      # 提交失败，释放窗口
+        start = time.monotonic()
+        await controller.acquire("device_1", "send_message")
+        return time.monotonic() - start
+
+    assert asyncio.run(run()) >= 0.15
+
+
+def test_full_window_blocks_until_completion():
+    controller = _controller(initial_window=1, max_window=1)
+    controller._state("device_1").inflight["t0"] = ("send_message", time.monotonic())
+
+    async def run():
+        controller.start()
+        waiter = asyncio.ensure_future(controller.acquire("device_1", "send_message"))
+        await asyncio.sleep(0.05)
+        blocked = not waiter.done()
+        _complete(controller, "t0", 0.01)
+        await asyncio.wait_for(waiter, 1)
+        return blocked
+
+    assert asyncio.run(run()) is True
+
+
+@pytest.mark.parametrize("queue_size, inflight, external", [(1, 2, 0), (0, 1, 0), (3, 2, 2), (2, 0, 2)])
+def test_external_backlog(queue_size, inflight, external):
+    """设备队列不含正在执行的任务：超出网关在途数 - 1 的部分才是外部积压"""
+    controller = CapacityController(
+        poll=lambda device_id, task_id: {}, status=lambda device_id: {"task_queue_size": queue_size},
+        initial_window=4,
+    )
+    state = controller._state("device_1")
+    for i in range(inflight):
+        state.inflight[f"t{i}"] = ("send_message", time.monotonic())
+    asyncio.run(controller._check_backlog("device_1", state))
+    assert state.external_backlog == external
+    assert state.window == (2 if external else 4)
+    assert controller.backlog("device_1") == inflight + external
+
+
+class _RecordingController(CapacityController):
+    """只记录下发、不轮询的容量控制器"""
+
+    def __init__(self):
+        super().__init__(poll=lambda device_id, task_id: {}, status=lambda device_id: {}, autotune=False)
+        self.submitted: list[tuple[str, str, str]] = []
+
+    def dispatched(self, device_id: str, op: str, task_id: str) -> None:
+        self.submitted.append((device_id, op, task_id))
+
+
+@pytest.fixture
+def recording_capacity(gateway, monkeypatch):
+    controller = _RecordingController()
+    monkeypatch.setattr(gateway, "capacity", controller)
+    monkeypatch.setattr(gateway.session_batcher, "limiter", controller)
+    return controller
+
+
+@pytest.mark.parametrize("path, body, op", [
+    ("/api/wework/session", {"contact": "张三", "actions": [{"type": "send", "message": "x"}], "wait": False},
+     "chat_session"),
+    ("/api/wework/create_group", {"group_name": "新群", "members": ["张三"]}, "create_group"),
+    ("/api/wework/invite_to_group", {"group_name": "客户群", "members": ["张三"]}, "invite_to_group"),
+    ("/api/wework/remove_from_group", {"group_name": "客户群", "members": ["张三"]}, "remove_from_group"),
+    ("/api/wework/send_message", {"contact": "张三", "message": "x"}, "send_message"),
+])
+def test_routes_register_inflight_tasks(client, recording_capacity, path, body, op):
+    response = client.post(path, json={"device_id": "device_1", **body})
+    assert response.status_code == 200
+    task_id = response.json()["data"]["data"]["task_id"]
+    assert recording_capacity.submitted == [("device_1", op, task_id)]
+
+
+def test_broadcast_registers_inflight_tasks(client, recording_capacity):
+    data = client.post("/api/broadcast", json={"contact": "张三", "message": "x"}).json()["data"]
+    assert sorted(data) == ["device_1", "device_2"]
+    assert sorted((d, t) for d, _, t in recording_capacity.submitted) == sorted(
+        (d, r["data"]["task_id"]) for d, r in data.items()
+    )
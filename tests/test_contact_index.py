@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""联系人索引：检索与延迟持久化"""
+import asyncio
+import json
+
+from server.core.contact_index import ContactIndex
+
+
+def test_search_and_locate():
+    index = ContactIndex()
+    index.update("device_1", "wework", ["张三", {"name": "李四", "remark": "VIP客户"}])
+    index.update("device_2", "wework", ["张三"])
+    assert [c["name"] for c in index.search("张")] == ["张三"]
+    assert [c["name"] for c in index.search("VIP")] == ["李四"]
+    assert sorted(index.locate("张三", "wework")) == ["device_1", "device_2"]
+
+
+def test_updates_are_saved_once_after_delay(tmp_path):
+    store = tmp_path / "contact_index.json"
+
+    async def run():
+        index = ContactIndex(store_path=str(store), save_delay=0.05)
+        index.update("device_1", "wework", ["张三"])
+        index.update("device_2", "wework", ["李四"])
+        written_immediately = store.exists()
+        for _ in range(100):
+            if store.exists():
+                break
+            await asyncio.sleep(0.01)
+        return written_immediately
+
+    assert asyncio.run(run()) is False
+    saved = json.loads(store.read_text(encoding="utf-8"))
+    assert sorted(item["device_id"] for item in saved) == ["device_1", "device_2"]
+    assert sorted(ContactIndex(store_path=str(store)).locate("李四", "wework")) == ["device_2"]
+
+
+def test_save_without_event_loop_is_synchronous(tmp_path):
+    store = tmp_path / "contact_index.json"
+    ContactIndex(store_path=str(store)).update("device_1", "wework", ["张三"])
+    assert store.exists()
+
+
+def test_learned_contacts_are_saved(tmp_path):
+    store = tmp_path / "contact_index.json"
+
+    async def run():
+        index = ContactIndex(store_path=str(store), save_delay=0.05)
+        index.learn("device_1", "wework", "王五")
+        for _ in range(100):
+            if store.exists():
+                break
+            await asyncio.sleep(0.01)
+
+    asyncio.run(run())
+    assert ContactIndex(store_path=str(store)).locate("王五", "wework") == ["device_1"]
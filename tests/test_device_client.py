@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""DeviceClient：提交的任务登记到结果存储"""
+from server.core.device_client import DeviceClient
+from server.core.result_store import ResultStore
+
+
+def test_contact_list_with_result_store(fake_device):
+    """get_contact_list 的 data 为列表，不能按 task_id 登记"""
+    store = ResultStore()
+    client = DeviceClient(fake_device.api_base, device_id="device_1", result_store=store)
+    resp = client.get_contact_list(app_type="wework")
+    assert resp["success"] is True
+    assert resp["data"] == fake_device.contacts
+    assert store.list("device_1") == []
+
+
+def test_submitted_task_is_tracked(fake_device):
+    store = ResultStore()
+    client = DeviceClient(fake_device.api_base, device_id="device_1", result_store=store)
+    resp = client.send_message("张三", "你好", wait=False, app_type="wework")
+    task_id = resp["data"]["task_id"]
+    record = store.get(task_id)
+    assert record is not None
+    assert (record.device_id, record.op, record.target) == ("device_1", "send_message", "张三")
+
+
+def test_contacts_route_updates_index(client, fake_device):
+    response = client.post("/api/wework/contacts", json={"device_id": "device_1"})
+    assert response.status_code == 200
+    assert response.json()["data"] == fake_device.contacts
+    found = client.get("/api/contacts/locate", params={"name": "李四", "app_name": "wework"}).json()["data"]
+    assert "device_1" in str(found)
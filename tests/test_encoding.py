@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""响应编码：gzip 压缩阈值、msgpack 协商"""
+import gzip
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from server.api.encoding import EncodedResponse, decode_body, make_encoding_middleware
+
+ROWS = [{"name": f"联系人{i}", "remark": ""} for i in range(200)]
+
+
+@pytest.fixture(scope="module")
+def client():
+    app = FastAPI(default_response_class=EncodedResponse)
+    app.middleware("http")(make_encoding_middleware(min_size=1024))
+
+    @app.get("/big")
+    async def big():
+        return {"success": True, "data": ROWS}
+
+    @app.get("/small")
+    async def small():
+        return {"success": True}
+
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+def _raw(response):
+    return b"".join(response.iter_raw())
+
+
+def test_large_json_is_gzipped(client):
+    with client.stream("GET", "/big", headers={"Accept-Encoding": "gzip"}) as response:
+        assert response.headers["content-encoding"] == "gzip"
+        assert "Accept-Encoding" in response.headers["vary"]
+        body = gzip.decompress(_raw(response))
+    assert decode_body(body, "application/json")["data"] == ROWS
+
+
+def test_small_or_unrequested_is_not_compressed(client):
+    assert "content-encoding" not in client.get("/small", headers={"Accept-Encoding": "gzip"}).headers
+    assert "content-encoding" not in client.get("/big", headers={"Accept-Encoding": "identity"}).headers
+
+
+def test_msgpack_negotiation():
+    msgpack = pytest.importorskip("msgpack")
+    app = FastAPI(default_response_class=EncodedResponse)
+    app.middleware("http")(make_encoding_middleware())
+
+    @app.get("/big")
+    async def big():
+        return {"success": True, "data": ROWS}
+
+    with TestClient(app) as test_client:
+        response = test_client.get("/big", headers={"Accept": "application/msgpack"})
+        assert response.headers["content-type"].startswith("application/msgpack")
+        assert msgpack.unpackb(response.content, raw=False)["data"] == ROWS
+        assert test_client.get("/big").headers["content-type"].startswith("application/json")
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""Webhook 推送：攒批、签名与压缩、失败重试、重启后从游标继续、积压丢弃"""
+import asyncio
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from server.core.events import EVENT_TASK_COMPLETED, EventBus
+
+
+class Receiver:
+    """本机 Webhook 接收方：记录收到的请求；replies 中的状态码按顺序使用，用完后返回 200"""
+
+    def __init__(self):
+        self.requests: list[tuple[dict, bytes]] = []     # (请求头, 解压后的请求体)
+        self.replies: list[tuple[int, dict]] = []
+        self._lock = threading.Lock()
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.headers.get("Content-Encoding") == "gzip":
+                    body = gzip.decompress(body)
+                with receiver._lock:
+                    receiver.requests.append((dict(self.headers), body))
+                    status, headers = receiver.replies.pop(0) if receiver.replies else (200, {})
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/hook"
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def batches(self) -> list[list[dict]]:
+        with self._lock:
+            return [json.loads(body)["events"] for _, body in self.requests]
+
+    def event_ids(self) -> list[str]:
+        return [e["id"] for batch in self.batches() for e in batch]
+
+
+@pytest.fixture
+def receiver():
+    receiver = Receiver()
+    yield receiver
+    receiver.server.shutdown()
+    receiver.server.server_close()
+
+
+async def _until(condition, timeout: float = 3.0) -> None:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "等待推送超时"
+        await asyncio.sleep(0.01)
+
+
+def _publish(bus: EventBus, count: int) -> list[str]:
+    return [bus.publish(EVENT_TASK_COMPLETED, {"n": i}, device_id="device_1")["id"] for i in range(count)]
+
+
+def test_full_batches_are_sent_immediately(receiver):
+    async def run():
+        bus = EventBus(batch_size=3, batch_interval=30)
+        bus.subscribe(receiver.url)
+        bus.start()
+        ids = _publish(bus, 6)
+        await _until(lambda: len(receiver.requests) == 2)
+        await bus.stop()
+        return ids
+
+    ids = asyncio.run(run())
+    assert [len(batch) for batch in receiver.batches()] == [3, 3]
+    assert receiver.event_ids() == ids
+
+
+def test_partial_batch_waits_for_interval(receiver):
+    async def run():
+        loop = asyncio.get_running_loop()
+        bus = EventBus(batch_size=100, batch_interval=0.2)
+        bus.subscribe(receiver.url)
+        bus.start()
+        start = loop.time()
+        _publish(bus, 2)
+        await _until(lambda: receiver.requests)
+        elapsed = loop.time() - start
+        await bus.stop()
+        return elapsed
+
+    assert asyncio.run(run()) >= 0.15
+    assert [len(batch) for batch in receiver.batches()] == [2]
+
+
+def test_signature_covers_uncompressed_body(receiver):
+    async def run():
+        bus = EventBus(batch_interval=0, compress_min_size=1)
+        subscription = bus.subscribe(receiver.url, secret="s3cret")
+        bus.start()
+        _publish(bus, 1)
+        await _until(lambda: receiver.requests)
+        await bus.stop()
+        return subscription
+
+    subscription = asyncio.run(run())
+    headers, body = receiver.requests[0]
+    assert headers["Content-Encoding"] == "gzip"
+    assert headers["X-Webhook-Subscription"] == subscription.subscription_id
+    expected = hmac.new(b"s3cret", body, hashlib.sha256).hexdigest()
+    assert headers["X-Webhook-Signature"] == f"sha256={expected}"
+
+
+def test_non_2xx_is_retried(receiver):
+    receiver.replies = [(503, {"Retry-After": "0.1"})]
+
+    async def run():
+        bus = EventBus(batch_interval=0)
+        subscription = bus.subscribe(receiver.url)
+        bus.start()
+        ids = _publish(bus, 2)
+        await _until(lambda: len(receiver.requests) == 2)
+        await _until(lambda: bus.stats()[subscription.subscription_id]["delivered"] == 2)
+        stats = bus.stats()[subscription.subscription_id]
+        await bus.stop()
+        return ids, stats
+
+    ids, stats = asyncio.run(run())
+    first, second = receiver.batches()
+    assert [e["id"] for e in first] == [e["id"] for e in second] == ids
+    assert (stats["pending"], stats["failures"], stats["last_error"]) == (0, 0, "HTTP 503")
+
+
+def test_restart_resumes_from_cursor(receiver, tmp_path):
+    store_path, outbox_dir = str(tmp_path / "webhooks.json"), str(tmp_path / "outbox")
+
+    async def first_run():
+        bus = EventBus(store_path=store_path, outbox_dir=outbox_dir, batch_interval=0)
+        subscription = bus.subscribe(receiver.url)
+        bus.start()
+        delivered = _publish(bus, 2)
+        await _until(lambda: len(receiver.requests) == 1)
+        await bus.stop()
+        pending = _publish(bus, 2)          # 推送停止期间发布的事件只写入发件箱
+        bus._deliveries[subscription.subscription_id].outbox.close()
+        return subscription, delivered, pending
+
+    subscription, delivered, pending = asyncio.run(first_run())
+    assert receiver.event_ids() == delivered
+    segment = os.path.join(outbox_dir, subscription.subscription_id, "00000001.jsonl")
+    with open(segment, "ab") as f:
+        f.write(b'{"id": "partial')         # 模拟进程在写入一行的中途退出
+
+    async def second_run():
+        bus = EventBus(store_path=store_path, outbox_dir=outbox_dir, batch_interval=0)
+        assert bus.stats()[subscription.subscription_id]["pending"] == 2
+        bus.start()
+        await _until(lambda: len(receiver.requests) == 2)
+        await _until(lambda: bus.stats()[subscription.subscription_id]["pending"] == 0)
+        await bus.stop()
+
+    asyncio.run(second_run())
+    assert receiver.event_ids() == delivered + pending
+
+
+def test_backlog_over_max_outbox_drops_oldest(receiver):
+    async def run():
+        bus = EventBus(batch_size=2, batch_interval=0, max_outbox=3)
+        subscription = bus.subscribe(receiver.url)
+        ids = _publish(bus, 10)
+        bus.start()
+        await _until(lambda: bus.stats()[subscription.subscription_id]["delivered"] == 3)
+        stats = bus.stats()[subscription.subscription_id]
+        await bus.stop()
+        return ids, stats
+
+    ids, stats = asyncio.run(run())
+    assert receiver.event_ids() == ids[-3:]
+    assert stats["dropped"] == 7
+    assert stats["pending"] == 0
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""群成员缓存：变更计划、增删与失效，以及群成员同步接口"""
+import time
+import uuid
+
+import pytest
+
+from server.core.group_cache import GroupCache
+
+
+def test_plan_is_minimal_and_keeps_order():
+    to_invite, to_remove = GroupCache.plan(["张三", "李四", " 王五 ", "李四"], ["赵六", "张三", "", "钱七"])
+    assert to_invite == ["赵六", "钱七"]
+    assert to_remove == ["李四", "王五"]
+    assert GroupCache.plan(["张三"], ["张三"]) == ([], [])
+
+
+def test_apply_and_invalidate():
+    cache = GroupCache(ttl=600)
+    assert cache.apply("device_1", "wework", "项目群", added=["张三"]) is None
+    cache.put("device_1", "wework", "项目群", ["张三", "李四"])
+    cache.put("device_1", "wechat", "项目群", ["张三"])
+    cache.put("device_2", "wework", "项目群", ["张三"])
+
+    entry = cache.apply("device_1", "wework", "项目群", added=["王五", "张三"], removed=["李四"])
+    assert entry.members == ["张三", "王五"]
+    assert cache.invalidate("device_1", "wework", "项目群") == 1
+    assert cache.get("device_1", "wework", "项目群") is None
+    assert cache.invalidate("device_1") == 1
+    assert cache.get("device_2", "wework", "项目群") is not None
+
+
+def test_entries_expire():
+    cache = GroupCache(ttl=600)
+    cache.put("device_1", "wework", "项目群", ["张三"]).fetched_at -= 601
+    assert cache.get("device_1", "wework", "项目群") is None
+    assert cache.stats()["groups"] == 0
+
+    disabled = GroupCache(ttl=0)
+    disabled.put("device_1", "wework", "项目群", ["张三"])
+    assert disabled.get("device_1", "wework", "项目群") is None
+
+
+def _wait(condition, timeout: float = 3.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "等待群成员缓存更新超时"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def group_name():
+    return f"项目群-{uuid.uuid4().hex[:6]}"
+
+
+def _members(gateway, group_name: str):
+    entry = gateway.group_cache.get("device_1", "wework", group_name)
+    return entry.members if entry is not None else None
+
+
+def test_sync_fetches_plans_and_updates_cache(client, gateway, fake_device, group_name):
+    fake_device.results.update({
+        "/api/get_group_members": ["张三", "李四", "王五"],
+        "/api/invite_to_group": {"success": ["赵六"], "failed": []},
+        "/api/remove_from_group": ["李四", "王五"],
+    })
+    body = {"device_id": "device_1", "group_name": group_name, "members": ["张三", "赵六"]}
+
+    dry_run = client.post("/api/wework/group_members/sync", json={**body, "dry_run": True}).json()
+    assert dry_run["data"] == {
+        "plan": {"current_count": 3, "invite": ["赵六"], "remove": ["李四", "王五"]}, "tasks": {},
+    }
+    assert fake_device.posted("/api/invite_to_group") == []
+
+    data = client.post("/api/wework/group_members/sync", json=body).json()["data"]
+    assert data["tasks"]["invite"]["data"]["task_id"] and data["tasks"]["remove"]["data"]["task_id"]
+    assert [d["members"] for d in fake_device.posted("/api/invite_to_group")] == [["赵六"]]
+    assert [d["members"] for d in fake_device.posted("/api/remove_from_group")] == [["李四", "王五"]]
+    assert len(fake_device.posted("/api/get_group_members")) == 1       # 计划与执行都只采集一次
+
+    _wait(lambda: _members(gateway, group_name) == ["张三", "赵六"])
+    again = client.post("/api/wework/group_members/sync", json=body).json()["data"]
+    assert again == {"plan": {"current_count": 2, "invite": [], "remove": []}, "tasks": {}}
+    assert len(fake_device.posted("/api/get_group_members")) == 1
+
+    cached = client.post("/api/wework/group_members", json={"device_id": "device_1", "group_name": group_name})
+    assert cached.json()["data"]["cached"] is True
+
+
+def test_unconfirmed_mutation_invalidates(client, gateway, group_name):
+    gateway.group_cache.put("device_1", "wework", group_name, ["张三"])
+    response = client.post(
+        "/api/wework/invite_to_group", json={"device_id": "device_1", "group_name": group_name, "members": ["李四"]},
+    )
+    assert response.status_code == 200
+    _wait(lambda: _members(gateway, group_name) is None)    # 设备未返回邀请结果，无法确认
+
+
+def test_create_group_invalidates(client, gateway, group_name):
+    gateway.group_cache.put("device_1", "wework", group_name, ["张三"])
+    client.post("/api/wework/create_group", json={"device_id": "device_1", "group_name": group_name, "members": ["李四"]})
+    _wait(lambda: _members(gateway, group_name) is None)
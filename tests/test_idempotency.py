@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""幂等键：重放、冲突、失败结果不保留"""
+import uuid
+
+
+def _send(client, key, message="你好"):
+    return client.post(
+        "/api/wework/send_message",
+        json={"device_id": "device_1", "contact": "张三", "message": message},
+        headers={"Idempotency-Key": key},
+    )
+
+
+def test_replay_returns_first_response(client, fake_device):
+    key = uuid.uuid4().hex
+    first = _send(client, key)
+    second = _send(client, key)
+    assert first.status_code == second.status_code == 200
+    assert second.headers.get("Idempotent-Replayed") == "true"
+    assert second.json() == first.json()
+    assert len(fake_device.posted("/api/send_message")) == 1
+
+
+def test_same_key_different_body_conflicts(client):
+    key = uuid.uuid4().hex
+    assert _send(client, key, "第一条").status_code == 200
+    assert _send(client, key, "第二条").status_code == 422
+
+
+def test_failed_submit_is_not_cached(client, fake_device):
+    key = uuid.uuid4().hex
+    fake_device.fail_paths.add("/api/send_message")
+    failed = _send(client, key)
+    assert failed.status_code == 200
+    assert failed.json()["data"]["success"] is False
+
+    fake_device.fail_paths.clear()
+    retried = _send(client, key)
+    assert "Idempotent-Replayed" not in retried.headers
+    assert retried.json()["data"]["success"] is True
+    assert len(fake_device.posted("/api/send_message")) == 2
+
+
+def test_job_creation_is_idempotent(client):
+    key = uuid.uuid4().hex
+    body = {
+        "device_id": "device_1", "app_type": "wework", "action": "send_message",
+        "params": {"contact": "张三", "message": "早安"}, "delay_seconds": 3600,
+    }
+    first = client.post("/api/jobs", json=body, headers={"Idempotency-Key": key})
+    second = client.post("/api/jobs", json=body, headers={"Idempotency-Key": key})
+    assert first.status_code == 200
+    assert second.headers.get("Idempotent-Replayed") == "true"
+    assert second.json()["data"]["job_id"] == first.json()["data"]["job_id"]
+    client.delete(f"/api/jobs/{first.json()['data']['job_id']}")
+
+
+def test_reserialized_json_body_is_replayed(client, fake_device):
+    """同一 JSON 换了键顺序与空白（不同 SDK 重新序列化）仍按同一请求重放"""
+    key = uuid.uuid4().hex
+    headers = {"Idempotency-Key": key, "Content-Type": "application/json"}
+    first = client.post(
+        "/api/wework/send_message", headers=headers,
+        content='{"device_id":"device_1","contact":"张三","message":"你好"}'.encode(),
+    )
+    second = client.post(
+        "/api/wework/send_message", headers=headers,
+        content='{\n  "message": "你好",\n  "contact": "\\u5f20\\u4e09",\n  "device_id": "device_1"\n}'.encode(),
+    )
+    assert first.status_code == second.status_code == 200
+    assert second.headers.get("Idempotent-Replayed") == "true"
+    assert len(fake_device.posted("/api/send_message")) == 1
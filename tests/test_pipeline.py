@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""任务流水线：设备窗口、FIFO 轮询、提交失败、取消、完成顺序与超时"""
+import threading
+import time
+
+import pytest
+
+from server.core.device_client import DeviceClient
+from server.core.pipeline import TaskPipeline
+
+
+@pytest.fixture
+def device(fake_device):
+    fake_device.reset()
+    yield fake_device
+    fake_device.reset()
+
+
+@pytest.fixture
+def device_client(device):
+    return DeviceClient(device.api_base, timeout=5, device_id="device_1")
+
+
+def _wait(condition, timeout: float = 3.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "等待流水线超时"
+        time.sleep(0.01)
+
+
+def test_window_limits_inflight_and_polls_oldest_first(device, device_client):
+    device.hold = True
+    with TaskPipeline(device_client, window=2, poll_interval=0.02) as pipeline:
+        tasks = [pipeline.send_message(f"联系人{i}", "你好") for i in range(5)]
+        _wait(lambda: len(device.posted("/api/send_message")) == 2)
+        _wait(lambda: len(device.polled()) >= 3)
+        assert pipeline.stats() == {"device_1": {"pending": 3, "inflight": 2}}
+        assert len(device.posted("/api/send_message")) == 2
+        ours = {t.task_id for t in tasks if t.task_id}
+        assert {task_id for task_id in device.polled() if task_id in ours} == {tasks[0].task_id}
+
+        device.hold = False
+        completed = list(pipeline.as_completed(timeout=5))
+    assert completed == tasks
+    assert all(t.result()["success"] for t in tasks)
+    assert [d["contact"] for d in device.posted("/api/send_message")] == [f"联系人{i}" for i in range(5)]
+
+
+def test_failed_submit_completes_first_with_device_response(device, device_client):
+    device.hold = True
+    device.fail_paths.add("/api/read_messages")
+    with TaskPipeline(device_client, window=2, poll_interval=0.02) as pipeline:
+        held = pipeline.send_message("张三", "你好")
+        failed = pipeline.read_messages("李四")
+        first = next(pipeline.as_completed(timeout=5))
+        device.hold = False
+        rest = list(pipeline.as_completed(timeout=5))
+    assert first is failed
+    assert failed.result() == {"code": 500, "success": False, "message": "设备忙"}
+    assert failed.task_id == ""
+    assert rest == [held]
+
+
+def test_close_cancels_pending_and_waits_for_inflight(device, device_client):
+    device.hold = True
+    pipeline = TaskPipeline(device_client, window=1, poll_interval=0.02)
+    tasks = [pipeline.send_message(f"联系人{i}", "你好") for i in range(3)]
+    _wait(lambda: tasks[0].task_id)
+    threading.Timer(0.1, setattr, (device, "hold", False)).start()
+    pipeline.close(cancel_pending=True)
+
+    assert tasks[0].result()["success"] is True
+    assert all(t.cancelled() for t in tasks[1:])
+    assert len(device.posted("/api/send_message")) == 1
+    assert set(pipeline.as_completed(timeout=1)) == set(tasks)
+    with pytest.raises(RuntimeError):
+        pipeline.send_message("张三", "你好")
+
+
+def test_task_timeout(device, device_client):
+    device.hold = True
+    with TaskPipeline(device_client, window=1, poll_interval=0.02, timeout=0.1) as pipeline:
+        task = pipeline.send_message("张三", "你好")
+        result = task.result(timeout=5)
+    assert result["success"] is False
+    assert "任务超时" in result["message"]
+
+
+def test_unsupported_op_and_foreign_device(device_client):
+    pipeline = TaskPipeline(device_client)
+    with pytest.raises(ValueError):
+        pipeline.submit("dump_ui_tree")
+    with pytest.raises(ValueError):
+        pipeline.send_message("张三", "你好", device_id="device_2")
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""性能剖析：事件循环阻塞检测、路由耗时汇总与采样输出"""
+import asyncio
+import threading
+import time
+from collections import Counter
+
+from server.core.profiling import LoopMonitor, RouteStats, StackSampler
+
+
+def _blocking_handler():
+    time.sleep(0.3)
+
+
+def test_blocking_call_is_reported_as_loop_lag():
+    async def run():
+        monitor = LoopMonitor(interval=0.02, slow_threshold=0.1)
+        monitor.start()
+        await asyncio.sleep(0.1)
+        _blocking_handler()
+        await asyncio.sleep(0.1)
+        await monitor.stop()
+        return monitor.stats()
+
+    stats = asyncio.run(run())
+    assert stats["lag"]["max"] >= 0.2
+    assert len(stats["slow_callbacks"]) == 1
+    event = stats["slow_callbacks"][0]
+    assert event["blocked_seconds"] >= 0.2
+    assert "_blocking_handler" in "".join(event["stack"])
+
+
+def test_idle_loop_has_no_slow_callbacks():
+    async def run():
+        monitor = LoopMonitor(interval=0.02, slow_threshold=0.2)
+        monitor.start()
+        await asyncio.sleep(0.2)
+        await monitor.stop()
+        return monitor.stats()
+
+    stats = asyncio.run(run())
+    assert stats["lag"]["samples"] > 0
+    assert stats["slow_callbacks"] == []
+
+
+def test_route_stats_aggregate_percentiles():
+    stats = RouteStats(window=100)
+    for ms in range(1, 101):
+        stats.record("GET /api/devices", ms / 1000, 0.0005, 200)
+    stats.record("POST /api/wework/send_message", 10.0, 0.001, 500)
+
+    slow, devices = stats.snapshot()
+    assert slow["route"] == "POST /api/wework/send_message"
+    assert (slow["count"], slow["errors"], slow["wall_p99_ms"]) == (1, 1, 10000.0)
+    assert (devices["count"], devices["errors"]) == (100, 0)
+    assert devices["wall_avg_ms"] == 50.5
+    assert devices["wall_p50_ms"] == 51.0
+    assert devices["wall_p99_ms"] == 100.0
+    assert devices["wall_max_ms"] == 100.0
+    assert devices["cpu_avg_ms"] == 0.5
+
+    for _ in range(100):                    # 百分位只看最近 window 个请求
+        stats.record("GET /api/devices", 0.002, 0.0, 200)
+    devices = next(r for r in stats.snapshot() if r["route"] == "GET /api/devices")
+    assert (devices["wall_p99_ms"], devices["wall_max_ms"]) == (2.0, 100.0)
+
+    stats.reset()
+    assert stats.snapshot() == []
+
+
+def test_sampler_output_is_collapsed_stacks():
+    stop = threading.Event()
+    worker = threading.Thread(target=stop.wait, name="sampled-worker", daemon=True)
+    worker.start()
+    sampler = StackSampler()
+    try:
+        counts = sampler.sample(0.05, interval=0.005)
+    finally:
+        stop.set()
+    assert any(stack.startswith("sampled-worker;") for stack in counts)
+    assert StackSampler.collapsed(Counter({"main;a;b": 3, "main;c": 5})) == "main;c 5\nmain;a;b 3\n"
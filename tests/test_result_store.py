@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""任务结果存储：大结果落盘，落盘目录按需创建、可被多个进程共用"""
+import os
+
+from server.core.result_store import STATUS_SUCCESS, ResultStore
+
+
+def test_spill_dir_is_created_on_first_spill(tmp_path):
+    spill_dir = tmp_path / "task_results"
+    store = ResultStore(spill_dir=str(spill_dir), spill_bytes=100)
+    store.track("device_1", "wework", "send_message", "t1")
+    store.complete("device_1", "t1", {"success": True, "message": "ok", "data": "短结果"})
+    assert not spill_dir.exists()
+
+    contacts = [{"name": f"联系人{i}"} for i in range(50)]
+    store.track("device_1", "wework", "get_contact_list", "t2")
+    record = store.complete("device_1", "t2", {"success": True, "message": "ok", "data": contacts})
+    assert record.status == STATUS_SUCCESS
+    assert len(list(spill_dir.iterdir())) == 1
+    assert store.result("t2")["data"] == contacts
+
+
+def test_only_own_stale_spill_files_are_removed(tmp_path):
+    """同一目录可被多个进程共用：首次落盘只删除本进程号前缀的遗留文件"""
+    spill_dir = tmp_path / "task_results"
+    spill_dir.mkdir()
+    own = spill_dir / f"{os.getpid()}-stale.json"
+    other = spill_dir / f"{os.getpid() + 1}-live.json"
+    unrelated = spill_dir / "settings.json"
+    for path in (own, other, unrelated):
+        path.write_text("[]", encoding="utf-8")
+    store = ResultStore(spill_dir=str(spill_dir), spill_bytes=10)
+    assert own.exists()
+
+    store.track("device_1", "wework", "get_contact_list", "t1")
+    record = store.complete("device_1", "t1", {"success": True, "message": "ok", "data": ["张三"] * 10})
+    assert not own.exists()
+    assert other.exists() and unrelated.exists()
+    assert os.path.basename(record.payload_ref).startswith(f"{os.getpid()}-")
+    assert store.result("t1")["data"] == ["张三"] * 10
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""定时任务：cron 计算、一次性任务清理、创建时的 params 校验"""
+import asyncio
+import json
+import time
+from datetime import datetime
+
+import pytest
+
+from server.core.scheduler import CronExpression, Job, Scheduler
+
+
+def _ts(*args) -> float:
+    return datetime(*args).timestamp()
+
+
+def test_cron_next_fire():
+    weekdays_9am = CronExpression("0 9 * * 1-5")
+    # 2026-10-16 为周五
+    assert weekdays_9am.next_after(_ts(2026, 10, 16, 8, 59)) == _ts(2026, 10, 16, 9, 0)
+    assert weekdays_9am.next_after(_ts(2026, 10, 16, 9, 0)) == _ts(2026, 10, 19, 9, 0)
+    assert CronExpression("*/15 * * * *").next_after(_ts(2026, 1, 1, 0, 7, 30)) == _ts(2026, 1, 1, 0, 15)
+    # 日与周同时受限时取「或」：每月 1 日或周日
+    assert CronExpression("0 0 1 * 0").next_after(_ts(2026, 10, 19, 12, 0)) == _ts(2026, 10, 25, 0, 0)
+
+
+def test_cron_rejects_bad_expression():
+    with pytest.raises(ValueError):
+        CronExpression("0 9 * *")
+    with pytest.raises(ValueError):
+        CronExpression("60 * * * *")
+
+
+def test_one_shot_job_is_removed_after_retention(tmp_path):
+    store = tmp_path / "jobs.json"
+
+    async def run():
+        executed = []
+
+        async def executor(job):
+            executed.append(job.job_id)
+            return {"success": True}
+
+        scheduler = Scheduler(executor, store_path=str(store), finished_retention=0)
+        scheduler.start()
+        once = scheduler.add(Job(job_id="", device_id="device_1", app_type="wework", action="send_message",
+                                 run_at=time.time()))
+        periodic = scheduler.add(Job(job_id="", device_id="device_1", app_type="wework", action="send_message",
+                                     cron="0 9 * * *"))
+        for _ in range(100):
+            if scheduler.get(once.job_id) is None:
+                break
+            await asyncio.sleep(0.02)
+        await scheduler.stop()
+        return executed, once, periodic, scheduler
+
+    executed, once, periodic, scheduler = asyncio.run(run())
+    assert executed == [once.job_id]
+    assert scheduler.get(once.job_id) is None
+    assert scheduler.get(periodic.job_id) is not None
+    assert [j["job_id"] for j in json.loads(store.read_text(encoding="utf-8"))] == [periodic.job_id]
+
+
+@pytest.mark.parametrize("params", [
+    {"contact": "张三", "message": "早安", "device_id": "device_2"},
+    {"contact": "张三", "message": "早安", "app_type": "wechat"},
+    {"contact": "张三"},
+])
+def test_create_job_rejects_bad_params(client, params):
+    response = client.post("/api/jobs", json={
+        "device_id": "device_1", "action": "send_message", "params": params, "delay_seconds": 3600,
+    })
+    assert response.status_code == 400
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+"""任务画面录制：未录制时不创建目录"""
+import os
+
+from server.core.screen_capture import ScreenRecorder
+
+
+def test_directory_is_not_created_until_recording(tmp_path):
+    directory = tmp_path / "screen_frames"
+    recorder = ScreenRecorder(str(directory), capture=lambda device_id: b"", poll=lambda device_id, task_id: {})
+    assert not directory.exists()
+    assert recorder.disk_usage()["segments"] == 0
+    recorder.close()
+
+
+def test_gateway_import_creates_no_directories(gateway):
+    from server import config
+
+    assert not config.SCREEN_CAPTURE_ENABLED
+    for name in ("SCREEN_CAPTURE_DIR", "RESULT_STORE_SPILL_DIR"):
+        assert not os.path.exists(getattr(config, name)), name
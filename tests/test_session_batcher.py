@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""聊天会话合并：同一设备连续的同聊天操作合并下发"""
+import asyncio
+
+from server.core.session_batcher import SessionBatcher
+
+
+def _run(submissions, window=0.05, max_actions=20):
+    calls = []
+
+    def dispatch(device_id, app_type, contact, actions):
+        calls.append((device_id, contact, [a["type"] for a in actions]))
+        return {"success": True, "data": {"task_id": f"t{len(calls)}"}}
+
+    async def main():
+        batcher = SessionBatcher(dispatch, window=window, max_actions=max_actions)
+        return await asyncio.gather(*(
+            batcher.submit(device_id, "wework", contact, {"type": kind, "message": "x"})
+            for device_id, contact, kind in submissions
+        ))
+
+    return asyncio.run(main()), calls
+
+
+def test_consecutive_actions_are_merged():
+    results, calls = _run([("device_1", "张三", "send"), ("device_1", "张三", "send"), ("device_1", "张三", "read")])
+    assert calls == [("device_1", "张三", ["send", "send", "read"])]
+    assert [(index, size) for _, index, size in results] == [(0, 3), (1, 3), (2, 3)]
+
+
+def test_other_contact_flushes_current_batch_in_order():
+    _, calls = _run([("device_1", "张三", "send"), ("device_1", "李四", "send"), ("device_1", "张三", "send")])
+    assert [contact for _, contact, _ in calls] == ["张三", "李四", "张三"]
+
+
+def test_devices_and_limits_are_independent():
+    _, calls = _run(
+        [("device_1", "张三", "send")] * 3 + [("device_2", "张三", "send")],
+        max_actions=2,
+    )
+    assert sorted((d, len(actions)) for d, _, actions in calls) == [("device_1", 1), ("device_1", 2), ("device_2", 1)]
+
+
+def test_zero_window_dispatches_each_action():
+    _, calls = _run([("device_1", "张三", "send"), ("device_1", "张三", "send")], window=0)
+    assert [actions for _, _, actions in calls] == [["send"], ["send"]]
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""多租户：鉴权、设备与资源隔离、CORS、公平排队"""
+import heapq
+import uuid
+
+import pytest
+
+from server.core.tenants import FairShare, QuotaExceeded, TenantRegistry
+
+ORIGIN = {"Origin": "http://localhost:5173"}
+
+
+@pytest.fixture
+def team_a(tenant_headers):
+    return tenant_headers["team_a"]
+
+
+@pytest.fixture
+def team_b(tenant_headers):
+    return tenant_headers["team_b"]
+
+
+def test_missing_key_is_401_with_cors_headers(client):
+    response = client.get("/api/devices", headers={"X-API-Key": "wrong", **ORIGIN})
+    assert response.status_code == 401
+    assert "access-control-allow-origin" in response.headers
+
+
+def test_foreign_device_is_403_with_cors_headers(client, fake_device, team_a):
+    response = client.post(
+        "/api/wework/send_message", json={"device_id": "device_2", "contact": "张三", "message": "x"},
+        headers={**team_a, **ORIGIN},
+    )
+    assert response.status_code == 403
+    assert "access-control-allow-origin" in response.headers
+    assert fake_device.posted("/api/send_message") == []
+
+
+def test_device_list_is_scoped(client, team_a):
+    data = client.get("/api/devices", headers=team_a).json()["data"]
+    assert "device_1" in str(data) and "device_2" not in str(data)
+
+
+def test_templates_are_scoped_to_tenant(client, team_a, team_b):
+    template_id = f"tpl-{uuid.uuid4().hex[:6]}"
+    created = client.post("/api/templates", json={"template_id": template_id, "text": "{{name}}您好"}, headers=team_a)
+    assert created.status_code == 200
+    assert created.json()["data"]["tenant_id"] == "team_a"
+
+    assert client.get(f"/api/templates/{template_id}", headers=team_a).status_code == 200
+    assert client.get(f"/api/templates/{template_id}", headers=team_b).status_code == 404
+    assert template_id not in str(client.get("/api/templates", headers=team_b).json()["data"])
+    assert client.post(f"/api/templates/{template_id}/preview", json={"row": {"name": "张三"}},
+                       headers=team_b).status_code == 404
+    assert client.delete(f"/api/templates/{template_id}", headers=team_b).status_code == 404
+    conflict = client.post("/api/templates", json={"template_id": template_id, "text": "覆盖"}, headers=team_b)
+    assert conflict.status_code == 409
+    campaign = client.post(
+        "/api/wework/campaigns", params={"template_id": template_id, "device_id": "device_2"},
+        content="contact,name\n张三,张三\n".encode(), headers={**team_b, "Content-Type": "text/csv"},
+    )
+    assert campaign.status_code == 404
+
+    assert template_id in str(client.get("/api/templates").json()["data"])   # 管理员可见全部
+    assert client.delete(f"/api/templates/{template_id}", headers=team_a).status_code == 200
+
+
+def test_contact_stats_are_scoped(client, team_a):
+    for device_id in ("device_1", "device_2"):
+        assert client.post("/api/wework/contacts", json={"device_id": device_id}).status_code == 200
+    stats = client.get("/api/contacts/stats", headers=team_a).json()["data"]
+    assert {s["device_id"] for s in stats["sources"]} == {"device_1"}
+    assert stats["devices"] == 1
+    assert {s["device_id"] for s in client.get("/api/contacts/stats").json()["data"]["sources"]} >= {
+        "device_1", "device_2",
+    }
+
+
+def test_foreign_task_frames_report_task_not_found(client, team_a, team_b):
+    task_id = client.post(
+        "/api/wework/send_message", json={"device_id": "device_2", "contact": "张三", "message": "x"}, headers=team_b,
+    ).json()["data"]["data"]["task_id"]
+    response = client.get(f"/api/tasks/{task_id}/frames", headers=team_a)
+    assert response.status_code == 404
+    assert response.json()["detail"] == f"任务不存在或已过期: {task_id}"
+
+
+def test_rate_limit():
+    registry = TenantRegistry({"t": {"api_key": "k", "rate_per_minute": 6}})
+    tenant = registry.authenticate("k")
+    charged = 0
+    with pytest.raises(QuotaExceeded) as excinfo:
+        for _ in range(100):
+            registry.charge(tenant)
+            charged += 1
+    assert 1 <= charged < 100
+    assert excinfo.value.retry_after >= 1
+
+
+def test_fair_share_follows_weights():
+    """持续排队时按权重分享：权重 3 的租户后到，仍与先到的大批量租户按 3:1 交替服务"""
+    fair = FairShare()
+    queue = []
+    seq = 0
+    for _ in range(40):
+        heapq.heappush(queue, (fair.tag("bulk", 1.0), seq, "bulk"))
+        seq += 1
+    for _ in range(12):
+        heapq.heappush(queue, (fair.tag("vip", 3.0), seq, "vip"))
+        seq += 1
+
+    served = []
+    while queue:
+        tag, _, tenant = heapq.heappop(queue)
+        fair.served(tag)
+        served.append(tenant)
+    first = served[:16]
+    assert first.count("vip") == 12
+    assert served[-1] == "bulk"
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""设备交互录制与回放：录下的交互可以脱离真实设备重放"""
+import json
+
+from server.core.device_client import DeviceClient
+from server.core.transport import ExchangeRecorder, ExchangeReplay
+
+
+def test_record_then_replay(fake_device, tmp_path):
+    path = str(tmp_path / "exchanges.jsonl")
+    recorder = ExchangeRecorder(path)
+    client = DeviceClient(fake_device.api_base, device_id="device_1", transport=recorder.adapter(fake_device.api_base))
+    recorded_id = client.send_message("张三", "你好", wait=False)["data"]["task_id"]
+    assert client.get_task_result(recorded_id)["data"]["success"] is True
+    assert client.get_contact_list()["data"] == fake_device.contacts
+    recorder.close()
+
+    with open(path, encoding="utf-8") as f:
+        paths = [json.loads(line)["path"] for line in f]
+    assert "/api/send_message" in paths and f"/api/task_result/{recorded_id}" in paths
+
+    # 回放时不连接任何设备：地址不可达也能得到录制的响应
+    api_base = "http://10.255.0.1:9527"
+    replay = ExchangeReplay(path, latency_scale=0)
+    client = DeviceClient(api_base, device_id="device_1", transport=replay.adapter(api_base))
+    submitted = client.send_message("张三", "你好", wait=False)
+    assert submitted["success"] is True
+    task_id = submitted["data"]["task_id"]
+    assert task_id and task_id != recorded_id
+    result = client.get_task_result(task_id)
+    assert result["data"]["success"] is True
+    assert client.get_contact_list()["data"] == fake_device.contacts